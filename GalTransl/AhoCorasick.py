@@ -0,0 +1,74 @@
+"""
+Aho-Corasick 多模式匹配，一次扫描找出文本中出现的所有词
+"""
+
+from typing import Iterable, List, Set
+
+
+class CAhoCorasick:
+    """
+    由一组词构建的 Aho-Corasick 自动机。词的编号即其在 words 中的下标，
+    重复的词共用同一个编号。空字符串不参与匹配。
+    """
+
+    __slots__ = ["words", "_goto", "_fail", "_out"]
+
+    def __init__(self, words: Iterable[str]) -> None:
+        self.words: List[str] = []
+        word_ids = {}
+        self._goto: List[dict] = [{}]
+        self._out: List[List[int]] = [[]]
+
+        for word in words:
+            if word in word_ids or word == "":
+                continue
+            word_id = word_ids[word] = len(self.words)
+            self.words.append(word)
+            state = 0
+            for ch in word:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._out.append([])
+                state = next_state
+            self._out[state].append(word_id)
+
+        # 广度优先建立失败指针，并把失败链上的输出合并到当前状态
+        self._fail: List[int] = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[next_state] = fail
+                if self._out[fail]:
+                    self._out[next_state] = self._out[next_state] + self._out[fail]
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def find_all(self, text: str) -> Set[int]:
+        """
+        返回 text 中出现过的所有词的编号（包括互相重叠的词）
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+    def find_words(self, text: str) -> Set[str]:
+        """
+        返回 text 中出现过的所有词
+        """
+        return {self.words[word_id] for word_id in self.find_all(text)}
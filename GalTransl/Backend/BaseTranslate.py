@@ -1,8 +1,7 @@
 import asyncio
-import httpx
+from contextlib import nullcontext
 from opencc import OpenCC
-from typing import Optional
-from GalTransl.COpenAI import COpenAITokenPool
+from typing import Callable, Optional, TYPE_CHECKING
 from GalTransl.ConfigHelper import CProxyPool
 from GalTransl import LOGGER, LANG_SUPPORTED, TRANSLATOR_DEFAULT_ENGINE
 from GalTransl.i18n import get_text, GT_LANG
@@ -12,22 +11,48 @@ from GalTransl.ConfigHelper import (
 from GalTransl.CSentense import CSentense, CTransList
 from GalTransl.Cache import save_transCache_to_json
 from GalTransl.Dictionary import CGptDict
-from openai import RateLimitError, AsyncOpenAI
+from GalTransl.ClientPool import HTTP_CLIENT_POOL
+from GalTransl.Concurrency import hedged_call
 import re
+from hashlib import sha1
 from tenacity import (
     retry,
+    retry_if_not_exception_type,
     wait_random_exponential,
 )  # for exponential backoff
 
+if TYPE_CHECKING:
+    # openai 在创建 chatbot 时才导入，重建结果等不请求接口的路径不需要加载
+    from GalTransl.COpenAI import COpenAITokenPool
+
+# 按token预算分批时，每行格式开销的估计值
+LINE_TOKENS_OVERHEAD = 8
+# 按token预算分批时，每批句数上限为 numPerRequestTranslate 的倍数
+MAX_BATCH_FACTOR = 3
+
+
+class CDegenerationError(Exception):
+    """
+    流式输出过程中检测到退化(重复/超长)，已中止请求
+    """
+
+    def __init__(self, partial: str) -> None:
+        super().__init__("输出退化，已中止请求")
+        self.partial = partial
 
 
 class BaseTranslate:
+    # 翻译过程中每取一批句子就以 (未命中列表, 本批结束位置) 调用，可截走剩余部分交给其他worker
+    split_tail: Optional[Callable[[CTransList, int], None]] = None
+    # 只作为上下文翻译的句子(工作窃取时的交叉部分副本)的 id，不计入进度和结果
+    context_lines: frozenset = frozenset()
+
     def __init__(
         self,
         config: CProjectConfig,
         eng_type: str,
         proxy_pool: Optional[CProxyPool]=None,
-        token_pool: COpenAITokenPool=None,
+        token_pool: "COpenAITokenPool"=None,
     ):
         """
         根据提供的类型、配置、API 密钥和代理设置初始化 Chatbot 对象。
@@ -81,6 +106,9 @@ class BaseTranslate:
         # 跳过h
         self.skipH = config.getKey("skipH", False)
 
+        # token预算
+        self.init_token_budget(config)
+
         # 流式输出模式
         self.streamOutputMode = config.getKey("gpt.streamOutputMode", False)
         if config.getKey("workersPerProject") > 1:  # 多线程关闭流式输出
@@ -101,28 +129,52 @@ class BaseTranslate:
 
         pass
 
+    def init_token_budget(self, config: CProjectConfig):
+        """
+        读取 gpt.token_limit，大于0时按token数量装填每批句子
+        """
+        if val := config.getKey("gpt.token_limit"):
+            self.token_limit = val
+            import tiktoken
+
+            self.tokenizer = tiktoken.get_encoding("o200k_base")
+        else:
+            self.token_limit = 0
+            self.tokenizer = None
+        self._token_counts: dict = {}
+
     def init_chatbot(self, eng_type, config: CProjectConfig):
         section_name = "OpenAI-Compatible"
         self.model_name = config.getBackendConfigSection(section_name).get(
             "rewriteModelName", TRANSLATOR_DEFAULT_ENGINE[eng_type]
         )
         self.token = self.tokenProvider.getToken()
-        base_path = "/v1" if not re.search(r"/v\d+$", self.token.domain) else ""
         self.api_timeout=config.getBackendConfigSection(section_name).get("apiTimeout", 60)
-        if self.proxyProvider:
-            self.proxy = self.proxyProvider.getProxy()
-            client = httpx.AsyncClient(proxy=self.proxy.addr if self.proxy else None)
-        else:
-            client = httpx.AsyncClient()
-        self.chatbot = AsyncOpenAI(
-            api_key=self.token.token,
-            base_url=f"{self.token.domain}{base_path}",
+        self.proxy = self.proxyProvider.getProxy() if self.proxyProvider else None
+        self.chatbot = self._create_chatbot(self.token)
+        pass
+
+    def _create_chatbot(self, token):
+        """
+        用 token 和共享的连接池创建客户端
+        """
+        from openai import AsyncOpenAI
+
+        base_path = "/v1" if not re.search(r"/v\d+$", token.domain) else ""
+        client = HTTP_CLIENT_POOL.getClient(
+            token.domain, self.proxy.addr if self.proxy else None
+        )
+        return AsyncOpenAI(
+            api_key=token.token,
+            base_url=f"{token.domain}{base_path}",
             max_retries=0,
             http_client=client,
         )
-        pass
 
-    @retry(wait=wait_random_exponential(min=1, max=60))
+    @retry(
+        wait=wait_random_exponential(min=1, max=60),
+        retry=retry_if_not_exception_type(CDegenerationError),
+    )
     async def ask_chatbot(
         self,
         model_name="",
@@ -134,50 +186,221 @@ class BaseTranslate:
         top_p=1,
         stream=False,
         max_tokens=None,
+        watchdog: Optional[Callable[[str], bool]] = None,
     ):
+        """
+        watchdog: 流式输出时每收到一段就用已输出的内容调用，返回 True 时立即中止请求，
+        并抛出 CDegenerationError，释放服务端的推理槽位
+
+        启用 hedgeRequests 时，请求超过 p95 延迟仍未完成会用另一个key或端点再发一个相同的请求，
+        取先完成的一个。没有其他key或端点时不对冲
+        """
+        if messages == []:
+            messages = [
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ]
+        request = lambda lease: self._ask_chatbot_once(
+            lease,
+            model_name=model_name,
+            messages=messages,
+            temperature=temperature,
+            frequency_penalty=frequency_penalty,
+            top_p=top_p,
+            stream=stream,
+            max_tokens=max_tokens,
+            watchdog=watchdog,
+        )
+        result, _ = await hedged_call(
+            getattr(self.pj_config, "hedger", None),
+            lambda: request(self.endpoint_lease),
+            (lambda: request(self.hedge_endpoint_lease)) if self.can_hedge() else None,
+        )
+        return result
+
+    async def _ask_chatbot_once(
+        self,
+        endpoint_lease,
+        model_name,
+        messages,
+        temperature,
+        frequency_penalty,
+        top_p,
+        stream,
+        max_tokens,
+        watchdog,
+    ):
+        from openai import RateLimitError
+
+        lease = endpoint_lease()
         try:
-            if messages == []:
-                messages = [
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": prompt},
-                ]
-            response = await self.chatbot.chat.completions.create(
-                model=model_name if model_name else self.model_name,
-                messages=messages,
-                stream=stream,
-                temperature=temperature,
-                frequency_penalty=frequency_penalty,
-                max_tokens=max_tokens,
-                timeout=self.api_timeout,
-                top_p=top_p,
-            )
-            result=""
-            lastline=""
-            if stream:
-                async for chunk in response:
-                    result += chunk.choices[0].delta.content or ""
-                    lastline+=chunk.choices[0].delta.content or ""
-                    if lastline.endswith("\n"):
-                        if self.pj_config.active_workers==1:
-                            print(lastline)
-                        lastline=""
-            else:
-                result = response.choices[0].message.content
+            async with self.request_slot(), lease as chatbot:
+                response = await chatbot.chat.completions.create(
+                    model=model_name if model_name else self.model_name,
+                    messages=messages,
+                    stream=stream,
+                    temperature=temperature,
+                    frequency_penalty=frequency_penalty,
+                    max_tokens=max_tokens,
+                    timeout=self.api_timeout,
+                    top_p=top_p,
+                )
+                result=""
+                lastline=""
+                if stream:
+                    async for chunk in response:
+                        result += chunk.choices[0].delta.content or ""
+                        lastline+=chunk.choices[0].delta.content or ""
+                        if lastline.endswith("\n"):
+                            if self.pj_config.active_workers==1:
+                                print(lastline)
+                            lastline=""
+                        if watchdog and watchdog(result):
+                            await response.close()
+                            raise CDegenerationError(result)
+                else:
+                    result = response.choices[0].message.content
             return result
         except RateLimitError as e:
             LOGGER.debug(f"[RateLimit] {e}")
             raise e
+        except CDegenerationError:
+            raise
         except Exception as e:
             try:
                 LOGGER.error(f"[API Error] {response.model_extra['error']}")
             except:
                 LOGGER.error(f"[API Error] {e}")
             raise e
-                
+
+    def request_slot(self):
+        """
+        占用自适应并发控制的一个请求名额，未启用时不限制
+        """
+        limiter = getattr(self.pj_config, "limiter", None)
+        return limiter.slot() if limiter else nullcontext()
+
+    def endpoint_lease(self):
+        """
+        为一次请求选择端点，返回本次请求使用的客户端，默认为固定的 self.chatbot
+        """
+        return nullcontext(self.chatbot)
+
+    def can_hedge(self) -> bool:
+        """
+        是否有另一个key可以发出对冲请求
+        """
+        return self.tokenProvider is not None and self.tokenProvider.countUsableTokens() > 1
+
+    def hedge_endpoint_lease(self):
+        """
+        对冲请求使用当前key以外的key，不替换 self.chatbot
+        """
+        token = self.tokenProvider.getOtherToken(self.token)
+        if token is None:
+            raise RuntimeError("没有其他可用的key，不发出对冲请求")
+        return nullcontext(self._create_chatbot(token))
 
     def clean_up(self):
         pass
 
+    def get_model_name(self) -> str:
+        if chatbot_engine := getattr(getattr(self, "chatbot", None), "engine", ""):
+            return chatbot_engine
+        return getattr(self, "model_name", "")
+
+    def _get_prompts(self) -> list[str]:
+        """
+        返回 [系统提示词, 翻译提示词]，后端可能保存在自身或 chatbot 上
+        """
+        chatbot = getattr(self, "chatbot", None)
+        prompts = []
+        for attr in ("system_prompt", "trans_prompt"):
+            prompt = getattr(self, attr, None) or getattr(chatbot, attr, None) or ""
+            prompts.append(prompt if isinstance(prompt, str) else "")
+        return prompts
+
+    def get_prompt_version(self) -> str:
+        """
+        返回当前提示词的短哈希，提示词变化时翻译记忆库不复用旧译文
+        """
+        return sha1("\n".join(self._get_prompts()).encode("utf-8")).hexdigest()[:12]
+
+    def count_tokens(self, text: str) -> int:
+        if text not in self._token_counts:
+            if len(self._token_counts) > 50000:
+                self._token_counts.clear()
+            self._token_counts[text] = len(self.tokenizer.encode(text))
+        return self._token_counts[text]
+
+    def _line_tokens(self, tran: CSentense) -> int:
+        # 原文 + 预计同等长度的译文，各加上每行格式(id/name/引号等)的开销
+        return 2 * (self.count_tokens(f"{tran.speaker}{tran.post_jp}") + LINE_TOKENS_OVERHEAD)
+
+    def exclude_context_lines(
+        self, num: int, trans_result: CTransList
+    ) -> tuple[int, CTransList]:
+        """
+        去掉一批结果中只作为上下文的句子，返回 (计入进度的句数, 计入结果的句子)
+        """
+        if not self.context_lines:
+            return num, trans_result
+        kept = [tran for tran in trans_result if id(tran) not in self.context_lines]
+        return max(0, num - (len(trans_result) - len(kept))), kept
+
+    def get_batch(
+        self,
+        translist_unhit: CTransList,
+        i: int,
+        num_pre_request: int,
+        gpt_dic: CGptDict = None,
+        dic_type: str = "gpt",
+    ) -> tuple[CTransList, str]:
+        """
+        从第 i 句开始取一批待翻译的句子，并生成这批句子的GPT字典提示。
+
+        gpt.token_limit 为0时每批固定 num_pre_request 句；
+        大于0时按token预算装填：提示词、上一轮译文、字典和原文及预计的译文都计入预算，
+        每批至少1句，至多 num_pre_request 的 MAX_BATCH_FACTOR 倍。
+        """
+        if self.token_limit <= 0:
+            trans_list_split = translist_unhit[i : i + num_pre_request]
+            dic_prompt = gpt_dic.gen_prompt(trans_list_split, dic_type) if gpt_dic else ""
+        else:
+            trans_list_split, dic_prompt = self._fill_batch_by_tokens(
+                translist_unhit, i, num_pre_request, gpt_dic, dic_type
+            )
+        if self.split_tail:
+            # 本批之后剩余的句子可以拆给空闲的worker
+            self.split_tail(translist_unhit, i + len(trans_list_split))
+        return trans_list_split, dic_prompt
+
+    def _fill_batch_by_tokens(
+        self,
+        translist_unhit: CTransList,
+        i: int,
+        num_pre_request: int,
+        gpt_dic: CGptDict,
+        dic_type: str,
+    ) -> tuple[CTransList, str]:
+        context = self._get_prompts() + [getattr(self, "last_translation", "") or ""]
+        budget = self.token_limit - self.count_tokens("\n".join(context))
+        trans_list_split = []
+        used = 0
+        for tran in translist_unhit[i : i + num_pre_request * MAX_BATCH_FACTOR]:
+            line_tokens = self._line_tokens(tran)
+            if trans_list_split and used + line_tokens > budget:
+                break
+            trans_list_split.append(tran)
+            used += line_tokens
+
+        dic_prompt = gpt_dic.gen_prompt(trans_list_split, dic_type) if gpt_dic else ""
+        # 加上字典后超出预算的，从末尾减句
+        while len(trans_list_split) > 1 and used + self.count_tokens(dic_prompt) > budget:
+            used -= self._line_tokens(trans_list_split.pop())
+            dic_prompt = gpt_dic.gen_prompt(trans_list_split, dic_type)
+        return trans_list_split, dic_prompt
+
     def translate(self, trans_list: CTransList, gptdict=""):
         pass
 
@@ -220,18 +443,13 @@ class BaseTranslate:
                 self.restore_context(translist_unhit, num_pre_request)
 
         trans_result_list = []
-        len_trans_list = len(translist_unhit)
         transl_step_count = 0
-        while i < len_trans_list:
+        while i < len(translist_unhit):
             # await asyncio.sleep(1)
-            trans_list_split = (
-                translist_unhit[i : i + num_pre_request]
-                if (i + num_pre_request < len_trans_list)
-                else translist_unhit[i:]
+            trans_list_split, dic_prompt = self.get_batch(
+                translist_unhit, i, num_pre_request, gpt_dic
             )
 
-            dic_prompt = gpt_dic.gen_prompt(trans_list_split) if gpt_dic else ""
-
             num, trans_result = await self.translate(
                 trans_list_split, dic_prompt, proofread=proofread
             )
@@ -248,7 +466,7 @@ class BaseTranslate:
                 save_transCache_to_json(trans_list, cache_file_path)
                 transl_step_count = 0
             LOGGER.info(
-                f"{filename}: {str(len(trans_result_list))}/{str(len_trans_list)}"
+                f"{filename}: {str(len(trans_result_list))}/{str(len(translist_unhit))}"
             )
 
         return trans_result_list
@@ -250,25 +250,21 @@ class ForGalTranslate(BaseTranslate):
             self.restore_context(translist_unhit, num_pre_request)
 
         trans_result_list = []
-        len_trans_list = len(translist_unhit)
         transl_step_count = 0
 
-        while i < len_trans_list:
+        while i < len(translist_unhit):
             # await asyncio.sleep(1)
-            trans_list_split = (
-                translist_unhit[i : i + num_pre_request]
-                if (i + num_pre_request < len_trans_list)
-                else translist_unhit[i:]
+            trans_list_split, dic_prompt = self.get_batch(
+                translist_unhit, i, num_pre_request, gpt_dic, "tsv"
             )
 
-            dic_prompt = gpt_dic.gen_prompt(trans_list_split, "tsv") if gpt_dic else ""
-
             num, trans_result = await self.translate(
                 trans_list_split, dic_prompt, proofread=proofread
             )
 
             if num > 0:
                 i += num
+            num, trans_result = self.exclude_context_lines(num, trans_result)
             self.pj_config.bar(num)
             result_output = ""
             for trans in trans_result:
@@ -281,7 +277,7 @@ class ForGalTranslate(BaseTranslate):
                 transl_step_count = 0
 
             LOGGER.info(
-                f"{filename}: {str(len(trans_result_list))}/{str(len_trans_list)}"
+                f"{filename}: {str(len(trans_result_list))}/{str(len(translist_unhit))}"
             )
 
         return trans_result_list
@@ -1,6 +1,6 @@
 import json, time, asyncio, os, traceback, re
 from opencc import OpenCC
-from typing import Optional
+from typing import List, Optional, Tuple
 from GalTransl.COpenAI import COpenAITokenPool
 from GalTransl.ConfigHelper import CProxyPool
 from GalTransl import LOGGER, LANG_SUPPORTED, TRANSLATOR_DEFAULT_ENGINE
@@ -26,6 +26,47 @@ from GalTransl.Backend.Prompts import (
     DEEPSEEK_PROOFREAD_PROMPT,
 )
 from GalTransl.Backend.BaseTranslate import BaseTranslate
+from GalTransl.Concurrency import hedged_call
+
+
+class CJsonlLineSplitter:
+    """
+    把流式输出切分成完整的行，跳过 {"id 之前的内容，遇到代码块结束标记时结束
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self.started = False
+        self.finished = False
+
+    def _accept(self, line: str) -> Optional[str]:
+        if not self.started:
+            if '{"id' not in line:
+                return None
+            self.started = True
+            return line[line.find('{"id') :]
+        if line.lstrip().startswith("```"):
+            self.finished = True
+            return None
+        return line
+
+    def feed(self, data: str):
+        """
+        输入一段流式输出，依次产出其中已经完整的行
+        """
+        self._buffer += data
+        while not self.finished and "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            if (line := self._accept(line)) is not None:
+                yield line
+
+    def flush(self):
+        """
+        流结束后产出最后一行
+        """
+        line, self._buffer = self._buffer, ""
+        if not self.finished and line and (line := self._accept(line)) is not None:
+            yield line
 
 
 class CGPT4Translate(BaseTranslate):
@@ -102,6 +143,8 @@ class CGPT4Translate(BaseTranslate):
             self.skipH = val
         else:
             self.skipH = False
+        # token预算
+        self.init_token_budget(config)
         # enhance_jailbreak
         if val := config.getKey("gpt.enhance_jailbreak"):
             self.enhance_jailbreak = val
@@ -257,28 +300,41 @@ class CGPT4Translate(BaseTranslate):
                 # change token
 
                 self.token = self.tokenProvider.getToken()
-                self.chatbot.set_api_key(self.token.token)
-                base_path = "/v1" if not re.search(r"/v\d+$", self.token.domain) else ""
-                self.chatbot.set_api_addr(
-                    f"{self.token.domain}{base_path}/chat/completions"
-                )
+                self._use_token(self.chatbot, self.token)
                 if self.pj_config.active_workers == 1:
                     LOGGER.info(
                         get_text("translation_input" if not proofread else "proofread_input", GT_LANG, gptdict, input_json)
                     )
                     LOGGER.info(get_text("output", GT_LANG))
-                resp, data,lastline = "", "",""
                 if not self.full_context_mode:
                     self._del_previous_message()
-                async for data in self.chatbot.ask_stream_async(
-                    prompt_req, assistant_prompt=assistant_prompt
-                ):
-                    resp += data
-                    lastline+=data
-                    if lastline.endswith("\n"):
-                        if self.pj_config.active_workers==1:
-                            print(lastline)
-                        lastline=""
+                # 对冲请求使用会话的副本和另一个key，获胜时再接管它的会话
+                hedge_bot = hedge_token = None
+
+                async def hedge_request():
+                    nonlocal hedge_bot, hedge_token
+                    hedge_token = self.tokenProvider.getOtherToken(self.token)
+                    if hedge_token is None:
+                        raise RuntimeError("没有其他可用的key，不发出对冲请求")
+                    hedge_bot = self._fork_for_hedge(prompt_req, assistant_prompt)
+                    self._use_token(hedge_bot, hedge_token)
+                    return await self._stream_request(
+                        hedge_bot, hedge_token, prompt_req, assistant_prompt, trans_list, proofread
+                    )
+
+                (resp, i, error_flag, error_message, parsed_lines), by_hedge = (
+                    await hedged_call(
+                        getattr(self.pj_config, "hedger", None),
+                        lambda: self._stream_request(
+                            self.chatbot, self.token, prompt_req, assistant_prompt, trans_list, proofread
+                        ),
+                        hedge_request if self.tokenProvider.countUsableTokens() > 1 else None,
+                    )
+                )
+                if by_hedge:
+                    self.chatbot.conversation = hedge_bot.conversation
+                    self.token = hedge_token
+                result_trans_list = self._apply_lines(trans_list, parsed_lines, proofread)
             except asyncio.CancelledError:
                 raise
             except RuntimeError:
@@ -295,6 +351,10 @@ class CGPT4Translate(BaseTranslate):
                     LOGGER.warning(get_text("request_error_switch_token", GT_LANG, self.token.maskToken()))
                     continue
                 elif "try again later" in str_ex or "too many requests" in str_ex:
+                    self.tokenProvider.reportTokenRateLimited(self.token)
+                    if self.tokenProvider.hasIdleToken():
+                        # 还有不在冷却中的key时直接换key重试
+                        continue
                     LOGGER.warning(
                         get_text("request_error_too_many", GT_LANG, self.wait_time)
                     )
@@ -310,111 +370,17 @@ class CGPT4Translate(BaseTranslate):
                     await asyncio.sleep(2)
                     continue
 
-            result_text = resp
-            if "```json" in result_text:
-                lang_list, code_list = extract_code_blocks(result_text)
-                if len(lang_list) > 0 and len(code_list) > 0:
-                    result_text = code_list[0]
-            if '{"id' in result_text:
-                result_text = result_text[result_text.find('{"id') :]
-
-            result_text = (
-                result_text.replace(", doub:", ', "doub":')
-                .replace(", conf:", ', "conf":')
-                .replace(", unkn:", ', "unkn":')
-            )
-            result_text = fix_quotes(result_text)
-
-            i = -1
-            result_trans_list = []
-            key_name = "dst" if not proofread else "newdst"
-            error_flag = False
-            error_message = ""
-            for line in result_text.split("\n"):
-                try:
-                    line_json = json.loads(line)  # 尝试解析json
-                    i += 1
-                except:
-                    if i == -1:
-                        LOGGER.error(get_text("non_json_output", GT_LANG, line))
-                        error_flag = True
-                        break
-                    else:
-                        continue
-
-                # 本行输出不正常
-                if (
-                    isinstance(line_json, dict) == False
-                    or "id" not in line_json
-                    or type(line_json["id"]) != int
-                    or i > len(trans_list) - 1
-                ):
-                    error_message = f"{line}句不无法解析"
-                    error_flag = True
-                    break
-                line_id = line_json["id"]
-                if line_id != trans_list[i].index:
-                    error_message = f"输出{line_id}句id未对应"
-                    error_flag = True
-                    break
-                if key_name not in line_json or type(line_json[key_name]) != str:
-                    error_message = f"第{trans_list[i].index}句找不到{key_name}"
-                    error_flag = True
-                    break
-                # 本行输出不应为空
-                if trans_list[i].post_jp != "" and line_json[key_name] == "":
-                    error_message = f"第{line_id}句空白"
-                    error_flag = True
-                    break
-                if "/" in line_json[key_name]:
-                    if (
-                        "／" not in trans_list[i].post_jp
-                        and "/" not in trans_list[i].post_jp
-                    ):
-                        error_message = (
-                            f"第{line_id}句多余 / 符号：" + line_json[key_name]
-                        )
-                        error_flag = True
-                        break
-                # 针对混元模型的乱码问题
-                if "�" in line_json[key_name]:
-                    error_message = (
-                        f"第{line_id}句包含乱码：" + line_json[key_name]
-                    )
-                    error_flag = True
-                    break
-                if self.target_lang != "English":
-                    if "can't fullfill" in line_json[key_name]:
-                        error_message = f"GPT4拒绝了翻译"
-                        error_flag = True
-                        break
-
-                if "Chinese" in self.target_lang:  # 统一简繁体
-                    line_json[key_name] = self.opencc.convert(line_json[key_name])
-
-                if not proofread:
-                    trans_list[i].pre_zh = line_json[key_name]
-                    trans_list[i].post_zh = line_json[key_name]
-                    trans_list[i].trans_by = self.chatbot.engine
-                    if "conf" in line_json:
-                        trans_list[i].trans_conf = line_json["conf"]
-                    if "doub" in line_json:
-                        trans_list[i].doub_content = line_json["doub"]
-                    if "unkn" in line_json:
-                        trans_list[i].unknown_proper_noun = line_json["unkn"]
-                    result_trans_list.append(trans_list[i])
-                else:
-                    trans_list[i].proofread_zh = line_json[key_name]
-                    trans_list[i].proofread_by = self.chatbot.engine
-                    trans_list[i].post_zh = line_json[key_name]
-                    result_trans_list.append(trans_list[i])
+            if not error_flag and i == -1:
+                # 整个输出中没有可解析的行
+                LOGGER.error(get_text("non_json_output", GT_LANG, resp))
+                error_flag = True
 
             if error_flag:
                 LOGGER.error(get_text("parse_error", self.target_lang, error_message))
                 if self.skipRetry:
                     self.reset_conversation()
                     LOGGER.warning(get_text("parse_error_skip", self.target_lang))
-                    i = 0 if i < 0 else i
+                    i = i + 1  # 从出错的句子开始标记为失败
                     while i < len(trans_list):
                         if not proofread:
                             trans_list[i].pre_zh = "Failed translation"
@@ -430,6 +396,13 @@ class CGPT4Translate(BaseTranslate):
                         i = i + 1
                     return i, result_trans_list
 
+                if i >= 0:
+                    # 出错前的句子已经写入，只重试出错及之后的句子
+                    self._del_last_answer()
+                    self._set_temp_type("normal")
+                    LOGGER.warning(f"-> 前{i + 1}句解析成功，从第{i + 2}句起重试")
+                    return i + 1, result_trans_list
+
                 await asyncio.sleep(1)
                 self._del_last_answer()
                 self.retry_count += 1
@@ -495,25 +468,21 @@ class CGPT4Translate(BaseTranslate):
                 self.restore_context(translist_unhit, num_pre_request)
 
         trans_result_list = []
-        len_trans_list = len(translist_unhit)
         transl_step_count = 0
 
-        while i < len_trans_list:
+        while i < len(translist_unhit):
             #await asyncio.sleep(1)
-            trans_list_split = (
-                translist_unhit[i : i + num_pre_request]
-                if (i + num_pre_request < len_trans_list)
-                else translist_unhit[i:]
+            trans_list_split, dic_prompt = self.get_batch(
+                translist_unhit, i, num_pre_request, gpt_dic
             )
 
-            dic_prompt = gpt_dic.gen_prompt(trans_list_split) if gpt_dic else ""
-
             num, trans_result = await self.translate(
                 trans_list_split, dic_prompt, proofread=proofread
             )
 
             if num > 0:
                 i += num
+            num, trans_result = self.exclude_context_lines(num, trans_result)
             self.pj_config.bar(num)
             result_output = ""
             for trans in trans_result:
@@ -526,7 +495,7 @@ class CGPT4Translate(BaseTranslate):
                 transl_step_count = 0
 
             LOGGER.info(
-                f"{filename}: {str(len(trans_result_list))}/{str(len_trans_list)}"
+                f"{filename}: {str(len(trans_result_list))}/{str(len(translist_unhit))}"
             )
 
 
@@ -554,6 +523,168 @@ class CGPT4Translate(BaseTranslate):
         if last_assistant_message:
             self.chatbot.conversation["default"].append(last_assistant_message)
 
+    def _fork_for_hedge(self, prompt_req: str, assistant_prompt: str):
+        """
+        对冲时才复制会话，并去掉主请求已经追加的本轮提问
+        """
+        chatbot = self.chatbot.fork()
+        asked = [{"role": "user", "content": prompt_req}]
+        if assistant_prompt:
+            asked.append({"role": "assistant", "content": assistant_prompt})
+        messages = chatbot.conversation["default"]
+        if messages[-len(asked) :] == asked:
+            for _ in asked:
+                messages.pop()
+        return chatbot
+
+    def _use_token(self, chatbot, token) -> None:
+        chatbot.set_api_key(token.token)
+        base_path = "/v1" if not re.search(r"/v\d+$", token.domain) else ""
+        chatbot.set_api_addr(f"{token.domain}{base_path}/chat/completions")
+
+    async def _stream_request(
+        self,
+        chatbot,
+        token,
+        prompt_req: str,
+        assistant_prompt: str,
+        trans_list: CTransList,
+        proofread: bool,
+    ) -> Tuple[str, int, bool, str, List[dict]]:
+        """
+        发出一次流式请求，每行输出完整后立即校验，出错时提前中止流。
+
+        Returns:
+            Tuple[str, int, bool, str, List[dict]]: 输出、最后一个正确行的下标、是否出错、错误信息、校验通过的行。
+        """
+        resp, lastline = "", ""
+        i = -1
+        parsed_lines = []
+        error_flag = False
+        error_message = ""
+        line_splitter = CJsonlLineSplitter()
+        async with self.request_slot():
+            st = time.time()
+            stream = chatbot.ask_stream_async(
+                prompt_req, assistant_prompt=assistant_prompt
+            )
+            try:
+                async for data in stream:
+                    resp += data
+                    lastline+=data
+                    if lastline.endswith("\n"):
+                        if self.pj_config.active_workers==1:
+                            print(lastline)
+                        lastline=""
+                    for line in line_splitter.feed(data):
+                        i, error_flag, error_message = self._parse_line(
+                            line, i, trans_list, proofread, parsed_lines
+                        )
+                        if error_flag:
+                            break
+                    if error_flag:
+                        break
+                else:
+                    for line in line_splitter.flush():
+                        i, error_flag, error_message = self._parse_line(
+                            line, i, trans_list, proofread, parsed_lines
+                        )
+                        if error_flag:
+                            break
+            finally:
+                await stream.aclose()
+        self.tokenProvider.reportTokenSuccess(
+            token, time.time() - st, chatbot.get_token_count()
+        )
+        return resp, i, error_flag, error_message, parsed_lines
+
+    def _parse_line(
+        self,
+        line: str,
+        i: int,
+        trans_list: CTransList,
+        proofread: bool,
+        parsed_lines: List[dict],
+    ) -> Tuple[int, bool, str]:
+        """
+        解析并校验一行输出，正确时作为第 i+1 句的结果加入 parsed_lines。
+
+        Returns:
+            Tuple[int, bool, str]: 校验通过的最后一句的下标、是否出错、错误信息。
+        """
+        key_name = "dst" if not proofread else "newdst"
+        line = (
+            line.replace(", doub:", ', "doub":')
+            .replace(", conf:", ', "conf":')
+            .replace(", unkn:", ', "unkn":')
+        )
+        line = fix_quotes(line)
+        try:
+            line_json = json.loads(line)  # 尝试解析json
+        except:
+            if i == -1:
+                LOGGER.error(get_text("non_json_output", GT_LANG, line))
+                return i, True, ""
+            return i, False, ""
+        i += 1
+
+        # 本行输出不正常
+        if (
+            isinstance(line_json, dict) == False
+            or "id" not in line_json
+            or type(line_json["id"]) != int
+            or i > len(trans_list) - 1
+        ):
+            return i - 1, True, f"{line}句不无法解析"
+        line_id = line_json["id"]
+        if line_id != trans_list[i].index:
+            return i - 1, True, f"输出{line_id}句id未对应"
+        if key_name not in line_json or type(line_json[key_name]) != str:
+            return i - 1, True, f"第{trans_list[i].index}句找不到{key_name}"
+        # 本行输出不应为空
+        if trans_list[i].post_jp != "" and line_json[key_name] == "":
+            return i - 1, True, f"第{line_id}句空白"
+        if "/" in line_json[key_name]:
+            if "／" not in trans_list[i].post_jp and "/" not in trans_list[i].post_jp:
+                return i - 1, True, f"第{line_id}句多余 / 符号：" + line_json[key_name]
+        # 针对混元模型的乱码问题
+        if "�" in line_json[key_name]:
+            return i - 1, True, f"第{line_id}句包含乱码：" + line_json[key_name]
+        if self.target_lang != "English":
+            if "can't fullfill" in line_json[key_name]:
+                return i - 1, True, f"GPT4拒绝了翻译"
+
+        if "Chinese" in self.target_lang:  # 统一简繁体
+            line_json[key_name] = self.opencc.convert(line_json[key_name])
+        parsed_lines.append(line_json)
+        return i, False, ""
+
+    def _apply_lines(
+        self, trans_list: CTransList, parsed_lines: List[dict], proofread: bool
+    ) -> CTransList:
+        """
+        把校验通过的行依次写入句子，返回写入的句子
+        """
+        key_name = "dst" if not proofread else "newdst"
+        result_trans_list = []
+        for i, line_json in enumerate(parsed_lines):
+            if not proofread:
+                trans_list[i].pre_zh = line_json[key_name]
+                trans_list[i].post_zh = line_json[key_name]
+                trans_list[i].trans_by = self.chatbot.engine
+                if "conf" in line_json:
+                    trans_list[i].trans_conf = line_json["conf"]
+                if "doub" in line_json:
+                    trans_list[i].doub_content = line_json["doub"]
+                if "unkn" in line_json:
+                    trans_list[i].unknown_proper_noun = line_json["unkn"]
+            else:
+                trans_list[i].proofread_zh = line_json[key_name]
+                trans_list[i].proofread_by = self.chatbot.engine
+                trans_list[i].post_zh = line_json[key_name]
+            result_trans_list.append(trans_list[i])
+        return result_trans_list
+
     def _del_last_answer(self):
         # 删除上次输出
         if self.chatbot.conversation["default"][-1]["role"] == "assistant":
@@ -103,6 +103,8 @@ class CGeminiTranslate(BaseTranslate):
             self.skipH = val
         else:
             self.skipH = False
+        # token预算
+        self.init_token_budget(config)
         # enhance_jailbreak
         if val := config.getKey("gpt.enhance_jailbreak"):
             self.enhance_jailbreak = val
@@ -259,32 +261,37 @@ class CGeminiTranslate(BaseTranslate):
 
                 #空回相关
 
-                if self.gemini_NoneType_count >=1:
-                    # LOGGER.info(f"本次对话空回，尝试修改提示词{GEMINI_ANIT_NONETYPE+prompt_req}")
-                    self.chatbot.add_to_conversation(
-                        message = GEMINI_ANIT_NONETYPE+prompt_req,
-                        role="assistant"
-                    )
-                    async for data in self.chatbot.ask_stream_async(
-                        "开始翻译", assistant_prompt=assistant_prompt
-                    ):
-                        resp += data
-                        lastline+=data
-                        if lastline.endswith("\n"):
-                            if self.pj_config.active_workers==1:
-                                print(lastline)
-                            lastline=""
-                    LOGGER.info(self.chatbot)
-                else:
-                    async for data in self.chatbot.ask_stream_async(
-                        prompt_req, assistant_prompt=assistant_prompt
-                    ):
-                        resp += data
-                        lastline+=data
-                        if lastline.endswith("\n"):
-                            if self.pj_config.active_workers==1:
-                                print(lastline)
-                            lastline=""
+                async with self.request_slot():
+                    st = time.time()
+                    if self.gemini_NoneType_count >=1:
+                        # LOGGER.info(f"本次对话空回，尝试修改提示词{GEMINI_ANIT_NONETYPE+prompt_req}")
+                        self.chatbot.add_to_conversation(
+                            message = GEMINI_ANIT_NONETYPE+prompt_req,
+                            role="assistant"
+                        )
+                        async for data in self.chatbot.ask_stream_async(
+                            "开始翻译", assistant_prompt=assistant_prompt
+                        ):
+                            resp += data
+                            lastline+=data
+                            if lastline.endswith("\n"):
+                                if self.pj_config.active_workers==1:
+                                    print(lastline)
+                                lastline=""
+                        LOGGER.info(self.chatbot)
+                    else:
+                        async for data in self.chatbot.ask_stream_async(
+                            prompt_req, assistant_prompt=assistant_prompt
+                        ):
+                            resp += data
+                            lastline+=data
+                            if lastline.endswith("\n"):
+                                if self.pj_config.active_workers==1:
+                                    print(lastline)
+                                lastline=""
+                self.tokenProvider.reportTokenSuccess(
+                    self.token, time.time() - st, self.chatbot.get_token_count()
+                )
             except asyncio.CancelledError:
                 raise
             except RuntimeError:
@@ -300,7 +307,11 @@ class CGeminiTranslate(BaseTranslate):
                     self._del_last_answer()
                     LOGGER.warning(get_text("request_error_switch_token", GT_LANG, self.token.maskToken()))
                     continue
-                elif "RESOURCE_EXHAUSTED" in str_ex or "too many requests" in str_ex: #429
+                elif "resource_exhausted" in str_ex or "too many requests" in str_ex: #429
+                    self.tokenProvider.reportTokenRateLimited(self.token)
+                    if self.tokenProvider.hasIdleToken():
+                        # 还有不在冷却中的key时直接换key重试
+                        continue
                     LOGGER.warning(
                         get_text("request_error_too_many", GT_LANG, self.wait_time)
                     )
@@ -508,25 +519,21 @@ class CGeminiTranslate(BaseTranslate):
                 self.restore_context(translist_unhit, num_pre_request)
 
         trans_result_list = []
-        len_trans_list = len(translist_unhit)
         transl_step_count = 0
 
-        while i < len_trans_list:
+        while i < len(translist_unhit):
             #await asyncio.sleep(1)
-            trans_list_split = (
-                translist_unhit[i : i + num_pre_request]
-                if (i + num_pre_request < len_trans_list)
-                else translist_unhit[i:]
+            trans_list_split, dic_prompt = self.get_batch(
+                translist_unhit, i, num_pre_request, gpt_dic
             )
 
-            dic_prompt = gpt_dic.gen_prompt(trans_list_split) if gpt_dic else ""
-
             num, trans_result = await self.translate(
                 trans_list_split, dic_prompt, proofread=proofread
             )
 
             if num > 0:
                 i += num
+            num, trans_result = self.exclude_context_lines(num, trans_result)
             self.pj_config.bar(num)
             result_output = ""
             for trans in trans_result:
@@ -539,7 +546,7 @@ class CGeminiTranslate(BaseTranslate):
                 transl_step_count = 0
 
             LOGGER.info(
-                f"{filename}: {str(len(trans_result_list))}/{str(len_trans_list)}"
+                f"{filename}: {str(len(trans_result_list))}/{str(len(translist_unhit))}"
             )
 
 
@@ -1,14 +1,17 @@
 import sys, asyncio, traceback
+from contextlib import asynccontextmanager
+from time import time
 from opencc import OpenCC
 from typing import Optional
 from random import choice
 from GalTransl import LOGGER, LANG_SUPPORTED
 from GalTransl.ConfigHelper import CProjectConfig, CProxyPool
+from GalTransl.COpenAI import CSakuraEndpointPool
 from GalTransl.CSentense import CSentense, CTransList
 from GalTransl.Cache import save_transCache_to_json
 from GalTransl.Dictionary import CGptDict
-from GalTransl.Utils import find_most_repeated_substring
-from GalTransl.Backend.BaseTranslate import BaseTranslate
+from GalTransl.Utils import find_most_repeated_substring, is_repetition_loop
+from GalTransl.Backend.BaseTranslate import BaseTranslate, CDegenerationError
 from GalTransl.Backend.Prompts import (
     Sakura_TRANS_PROMPT,
     Sakura_SYSTEM_PROMPT,
@@ -20,6 +23,10 @@ from GalTransl.Backend.Prompts import (
 )
 from GalTransl import transl_counter
 
+# 流式输出时单行长度超过 原文长度*FACTOR+EXTRA 视为退化
+DEGEN_LINE_LEN_FACTOR = 3
+DEGEN_LINE_LEN_EXTRA = 20
+
 
 class CSakuraTranslate(BaseTranslate):
     # init
@@ -27,7 +34,7 @@ class CSakuraTranslate(BaseTranslate):
         self,
         config: CProjectConfig,
         eng_type: str,
-        endpoint: str,
+        endpoint_pool: CSakuraEndpointPool,
         proxy_pool: Optional[CProxyPool],
     ):
 
@@ -41,23 +48,13 @@ class CSakuraTranslate(BaseTranslate):
             self.transl_dropout = val
         else:
             self.transl_dropout = 0
-        # token_limit
-        if val := config.getKey("gpt.token_limit"):
-            self.token_limit = val
-            import tiktoken
-
-            self.tokenizer = tiktoken.get_encoding("o200k_base")
-        else:
-            self.token_limit = 0
-            self.tokenizer = None
-
         if self.target_lang == "Simplified_Chinese":
             self.opencc = OpenCC("t2s.json")
         elif self.target_lang == "Traditional_Chinese":
             self.opencc = OpenCC("s2tw.json")
 
         self.last_translation = ""
-        self.endpoint = endpoint
+        self.endpoint_pool = endpoint_pool
         self.api_timeout = 30
         self.rateLimitWait = 1
         if eng_type == "sakura-v1.0":
@@ -72,10 +69,6 @@ class CSakuraTranslate(BaseTranslate):
         pass
 
     def init_chatbot(self, eng_type, config: CProjectConfig):
-        from openai import RateLimitError, AsyncOpenAI
-        import httpx
-        import re
-
         backendSpecific = config.projectConfig["backendSpecific"]
         section_name = "SakuraLLM" if "SakuraLLM" in backendSpecific else "Sakura"
         model_name = config.getBackendConfigSection(section_name).get(
@@ -83,28 +76,81 @@ class CSakuraTranslate(BaseTranslate):
         )
         self.model_name = model_name if model_name else "sakura"
 
-        endpoint = self.endpoint
-        endpoint = endpoint[:-1] if endpoint.endswith("/") else endpoint
-        base_path = "/v1" if not re.search(r"/v\d+$", endpoint) else ""
         self.stream = True
-        if "sakura-share" in endpoint:
+        if any("sakura-share" in e.url for e in self.endpoint_pool.endpoints):
             self.stream = False
 
+        self.proxy = None
         if self.proxyProvider:
             self.proxy = self.proxyProvider.getProxy()
-            client = httpx.AsyncClient(proxy=self.proxy.addr if self.proxy else None)
-        else:
-            client = httpx.AsyncClient()
 
-        self.chatbot = AsyncOpenAI(
+        # 每个端点一个客户端，请求时由端点池选择
+        self._chatbots: dict = {}
+        self._endpoint = None  # 主请求最近使用的端点
+        self.chatbot = self._get_chatbot(self.endpoint_pool.endpoints[0].url)
+
+    def _get_chatbot(self, endpoint: str):
+        if endpoint in self._chatbots:
+            return self._chatbots[endpoint]
+        from openai import AsyncOpenAI
+        from GalTransl.ClientPool import HTTP_CLIENT_POOL
+        import re
+
+        endpoint = endpoint[:-1] if endpoint.endswith("/") else endpoint
+        base_path = "/v1" if not re.search(r"/v\d+$", endpoint) else ""
+        client = HTTP_CLIENT_POOL.getClient(
+            endpoint, self.proxy.addr if self.proxy else None
+        )
+        chatbot = AsyncOpenAI(
             api_key="sk-2333",
             base_url=f"{endpoint}{base_path}",
             max_retries=0,
             http_client=client,
         )
-
-    def clean_up(self):
-        self.pj_config.endpointQueue.put_nowait(self.endpoint)
+        self._chatbots[endpoint] = chatbot
+        return chatbot
+
+    @asynccontextmanager
+    async def endpoint_lease(self):
+        """
+        每次请求从端点池选择负载最低的端点，并按结果更新端点的耗时和健康状态
+        """
+        self._endpoint = self.endpoint_pool.acquire()
+        self.chatbot = self._get_chatbot(self._endpoint.url)
+        async with self._track_endpoint(self._endpoint):
+            yield self.chatbot
+
+    def can_hedge(self) -> bool:
+        return len(self.endpoint_pool.endpoints) > 1
+
+    @asynccontextmanager
+    async def hedge_endpoint_lease(self):
+        """
+        对冲请求使用主请求以外的端点，没有其他可用端点时不发出
+        """
+        endpoint = self.endpoint_pool.acquire_other(self._endpoint)
+        if endpoint is None:
+            raise RuntimeError("没有其他可用的端点，不发出对冲请求")
+        async with self._track_endpoint(endpoint):
+            yield self._get_chatbot(endpoint.url)
+
+    @asynccontextmanager
+    async def _track_endpoint(self, endpoint):
+        st = time()
+        try:
+            yield
+        except CDegenerationError:
+            # 端点正常响应，只是输出退化
+            self.endpoint_pool.release(endpoint, time() - st)
+            raise
+        except asyncio.CancelledError:
+            self.endpoint_pool.release(endpoint)
+            raise
+        except Exception:
+            self.endpoint_pool.release(endpoint, failed=True)
+            raise
+        else:
+            self.endpoint_pool.release(endpoint, time() - st)
 
     async def translate(self, trans_list: CTransList, gptdict=""):
         input_list = []
@@ -120,6 +166,10 @@ class CSakuraTranslate(BaseTranslate):
             max_repeat = max(max_repeat, count)
             line_lens.append(len(tmp_text))
         input_str = "\n".join(input_list).strip("\n")
+        # 流式输出时按原文计算每行的长度预算和重复阈值，供 check_degen_in_process 使用
+        self.JP_LINE_LENS = line_lens
+        self.JP_REPETITION_THRESHOLD_LINE = max_repeat
+        self.JP_REPETITION_THRESHOLD_ALL = find_most_repeated_substring(input_str)[1]
 
         prompt_req = self.trans_prompt
         prompt_req = prompt_req.replace("[Input]", input_str)
@@ -145,14 +195,20 @@ class CSakuraTranslate(BaseTranslate):
                 print("-> 输出: ")
 
             resp = ""
-            resp = await self.ask_chatbot(
-                messages=messages,
-                temperature=self.temperature,
-                frequency_penalty=self.frequency_penalty,
-                top_p=self.top_p,
-                max_tokens=len(input_str) * 2,
-                stream=self.stream,
-            )
+            degenerated = False
+            try:
+                resp = await self.ask_chatbot(
+                    messages=messages,
+                    temperature=self.temperature,
+                    frequency_penalty=self.frequency_penalty,
+                    top_p=self.top_p,
+                    max_tokens=len(input_str) * 2,
+                    stream=self.stream,
+                    watchdog=self.check_degen_in_process if self.stream else None,
+                )
+            except CDegenerationError as e:
+                resp = e.partial
+                degenerated = True
 
             result_list = resp.strip("\n").split("\n")
 
@@ -161,10 +217,18 @@ class CSakuraTranslate(BaseTranslate):
             error_flag = False
             error_message = ""
 
-            if len(result_list) != len(trans_list):
+            if degenerated:
+                error_message = f"-> 输出退化，已提前中止"
+                error_flag = True
+                # 提高频率惩罚后重试，翻译成功后会恢复
+                self._set_temp_type("normal")
+            elif len(result_list) != len(trans_list):
                 error_message = f"-> 翻译结果与原文长度不一致"
                 error_flag = True
 
+            # 原文本身重复的允许译文同样重复，超出太多视为模型陷入循环
+            repeat_threshold = max(max_repeat * 2, 12)
+
             for line in result_list:
                 if error_flag:
                     break
@@ -174,6 +238,13 @@ class CSakuraTranslate(BaseTranslate):
                     error_message = f"-> 第{i+1}句空白"
                     error_flag = True
                     break
+                # 本行输出陷入重复循环
+                if is_repetition_loop(line, repeat_threshold):
+                    error_message = f"-> 第{i+1}句疑似退化，重复输出"
+                    error_flag = True
+                    # 提高频率惩罚后重试，翻译成功后会恢复
+                    self._set_temp_type("normal")
+                    break
 
                 # 提取对话内容
                 if trans_list[i].speaker != "":
@@ -280,27 +351,24 @@ class CSakuraTranslate(BaseTranslate):
         self.restore_context(translist_unhit, num_pre_request)
 
         trans_result_list = []
-        len_trans_list = len(translist_unhit)
         transl_step_count = 0
 
-        while i < len_trans_list:
+        while i < len(translist_unhit):
             # await asyncio.sleep(1)
 
-            trans_list_split = translist_unhit[i : i + num_pre_request]
-            dic_prompt = (
-                gpt_dic.gen_prompt(trans_list_split, type="sakura")
-                if gpt_dic != None
-                else ""
+            trans_list_split, dic_prompt = self.get_batch(
+                translist_unhit, i, num_pre_request, gpt_dic, "sakura"
             )
 
             num, trans_result = await self.translate(trans_list_split, dic_prompt)
 
-            if self.transl_dropout > 0 and num == num_pre_request:
+            if self.transl_dropout > 0 and num == len(trans_list_split):
                 if self.transl_dropout < num:
                     num -= self.transl_dropout
                     trans_result = trans_result[:num]
 
             i += num if num > 0 else 0
+            num, trans_result = self.exclude_context_lines(num, trans_result)
             transl_counter["tran_count"] += num
             self.pj_config.bar(num)
             transl_step_count += 1
@@ -312,13 +380,14 @@ class CSakuraTranslate(BaseTranslate):
 
             LOGGER.info("".join([repr(tran) for tran in trans_result]))
             LOGGER.info(
-                f"{filename}: {str(len(trans_result_list))}/{str(len_trans_list)}"
+                f"{filename}: {str(len(trans_result_list))}/{str(len(translist_unhit))}"
             )
 
         return trans_result_list
 
     def reset_conversation(self):
         self.history_resp = ""
+        self.last_translation = ""
 
     def _set_temp_type(self, style_name: str):
         if self._current_temp_type == style_name:
@@ -369,21 +438,31 @@ class CSakuraTranslate(BaseTranslate):
         self.last_translation = json_lines
         LOGGER.info("-> 恢复了上下文")
 
-    def check_degen_in_process(self, cn: str = ""):
+    def check_degen_in_process(self, cn: str = "") -> bool:
+        """
+        流式输出过程中检查译文是否退化：行数超过原文、当前行远超原文长度或陷入重复
+        """
+        cn = cn.lstrip("\n")
         line_count = cn.count("\n") + 1
-        if line_count < len(self.JP_LINE_LENS):  # 长度不超当前行直接放行
-            if len(cn.split("\n")[-1]) < self.JP_LINE_LENS[line_count - 1]:
-                return False
-        else:  # 行数超过当前行，某行反复输出的情况
-            repeated_str, repeated_count = find_most_repeated_substring(cn)
-            if repeated_count > max(self.JP_REPETITION_THRESHOLD_ALL * 2, 12):
-                return True
+        last_line = cn[cn.rfind("\n") + 1 :]
+        if line_count > len(self.JP_LINE_LENS):
+            if cn.rstrip("\n").count("\n") + 1 > len(self.JP_LINE_LENS):
+                return True  # 输出的行数已经多于原文
+            line_budget = self.JP_LINE_LENS[-1]
+        else:
+            line_budget = self.JP_LINE_LENS[line_count - 1]
+        if len(last_line) < line_budget:  # 长度不超当前行直接放行
+            return False
+        if len(last_line) > line_budget * DEGEN_LINE_LEN_FACTOR + DEGEN_LINE_LEN_EXTRA:
+            return True
 
         # 行内反复输出的情况
-        last_line = cn.split("\n")[-1]
-        repeated_str, repeated_count = find_most_repeated_substring(last_line)
-        if repeated_count > max(self.JP_REPETITION_THRESHOLD_LINE * 2, 12):
+        if is_repetition_loop(last_line, max(self.JP_REPETITION_THRESHOLD_LINE * 2, 12)):
             return True
+        # 最后一行时检查整体反复输出的情况
+        if line_count >= len(self.JP_LINE_LENS):
+            if is_repetition_loop(cn, max(self.JP_REPETITION_THRESHOLD_ALL * 2, 12)):
+                return True
 
         return False
 
@@ -1,8 +1,10 @@
 """
 A simple wrapper for the official ChatGPT API
 """
+import copy
 import json
 import os
+from functools import lru_cache
 from importlib.metadata import version
 from importlib.resources import path
 from pathlib import Path
@@ -12,8 +14,117 @@ import httpx
 import requests
 import tiktoken
 
+from GalTransl.ClientPool import HTTP_CLIENT_POOL
 from . import typings as t
 
+_encoding = None
+
+
+def get_encoding() -> tiktoken.Encoding:
+    """
+    Load the cl100k_base encoder once per process
+    """
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+@lru_cache(maxsize=8192)
+def count_text_tokens(text: str) -> int:
+    return len(get_encoding().encode(text))
+
+
+# https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+def count_message_tokens(message: dict) -> int:
+    # every message follows <im_start>{role/name}\n{content}<im_end>\n
+    num_tokens = 5
+    for key, value in message.items():
+        num_tokens += count_text_tokens(value)
+        if key == "name":  # if there's a name, the role is omitted
+            num_tokens += 5  # role is always required and always 1 token
+    return num_tokens
+
+
+class Conversation(list):
+    """
+    A message list that keeps its total token count up to date
+    as messages are added and removed
+    """
+
+    def __init__(self, messages=()) -> None:
+        super().__init__(messages)
+        self._recount()
+
+    def _recount(self) -> None:
+        self.token_count = sum(count_message_tokens(m) for m in self)
+
+    def append(self, message: dict) -> None:
+        super().append(message)
+        self.token_count += count_message_tokens(message)
+
+    def insert(self, index, message: dict) -> None:
+        super().insert(index, message)
+        self.token_count += count_message_tokens(message)
+
+    def extend(self, messages) -> None:
+        super().extend(messages)
+        self._recount()
+
+    def pop(self, index=-1) -> dict:
+        message = super().pop(index)
+        self.token_count -= count_message_tokens(message)
+        return message
+
+    def remove(self, message: dict) -> None:
+        super().remove(message)
+        self.token_count -= count_message_tokens(message)
+
+    def clear(self) -> None:
+        super().clear()
+        self.token_count = 0
+
+    def __setitem__(self, index, value) -> None:
+        super().__setitem__(index, value)
+        self._recount()
+
+    def __delitem__(self, index) -> None:
+        super().__delitem__(index)
+        self._recount()
+
+    def __iadd__(self, messages):
+        self.extend(messages)
+        return self
+
+    def __imul__(self, n):
+        super().__imul__(n)
+        self._recount()
+        return self
+
+
+class ConversationDict(dict):
+    """
+    convo_id -> Conversation, plain lists assigned to it are wrapped
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__()
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, convo_id: str, messages) -> None:
+        if not isinstance(messages, Conversation):
+            messages = Conversation(messages)
+        super().__setitem__(convo_id, messages)
+
+    def update(self, *args, **kwargs) -> None:
+        for convo_id, messages in dict(*args, **kwargs).items():
+            self[convo_id] = messages
+
+    def setdefault(self, convo_id: str, messages=None):
+        if convo_id not in self:
+            self[convo_id] = messages or []
+        return self[convo_id]
+
 
 class Chatbot:
     """
@@ -21,6 +132,7 @@ class Chatbot:
     """
 
     def update_proxy(self, proxy: str) -> None:
+        self.requested_proxy = proxy
         # 本地地址忽略代理
         if "127.0.0.1" in self.api_address or "localhost" in self.api_address:
             proxy = ""
@@ -44,17 +156,9 @@ class Chatbot:
             proxy or os.environ.get("all_proxy") or os.environ.get("ALL_PROXY") or None
         ):
             if "socks5h" not in proxy:
-                self.aclient = httpx.AsyncClient(
-                    follow_redirects=True,
-                    proxy=proxy,
-                    timeout=self.timeout,
-                )
+                self.aclient = HTTP_CLIENT_POOL.getClient(self.api_address, proxy)
         else:
-            self.aclient = httpx.AsyncClient(
-                follow_redirects=True,
-                proxy=proxy,
-                timeout=self.timeout,
-            )
+            self.aclient = HTTP_CLIENT_POOL.getClient(self.api_address)
 
         pass
 
@@ -105,14 +209,16 @@ class Chatbot:
         if proxy:
             self.update_proxy(proxy)
 
-        self.conversation: dict[str, list[dict]] = {
-            "default": [
-                {
-                    "role": "system",
-                    "content": system_prompt,
-                },
-            ],
-        }
+        self.conversation: dict[str, list[dict]] = ConversationDict(
+            {
+                "default": [
+                    {
+                        "role": "system",
+                        "content": system_prompt,
+                    },
+                ],
+            }
+        )
 
         if self.get_token_count("default") > self.max_tokens:
             raise t.ActionRefuseError("System prompt is too long")
@@ -148,24 +254,16 @@ class Chatbot:
             else:
                 break
 
-    # https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
     def get_token_count(self, convo_id: str = "default") -> int:
         """
         Get token count
         """
-
-        encoding = tiktoken.get_encoding("cl100k_base")
-
-        num_tokens = 0
-        for message in self.conversation[convo_id]:
-            # every message follows <im_start>{role/name}\n{content}<im_end>\n
-            num_tokens += 5
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":  # if there's a name, the role is omitted
-                    num_tokens += 5  # role is always required and always 1 token
-        num_tokens += 5  # every reply is primed with <im_start>assistant
-        return num_tokens
+        conversation = self.conversation[convo_id]
+        if not isinstance(conversation, Conversation):
+            # self.conversation 被替换为普通 dict 时
+            conversation = self.conversation[convo_id] = Conversation(conversation)
+        # every reply is primed with <im_start>assistant
+        return conversation.token_count + 5
 
     def get_max_tokens(self, convo_id: str) -> int:
         """
@@ -313,7 +411,8 @@ class Chatbot:
                 # Remove "data: "
                 line = line[6:]
                 if line == "[DONE]":
-                    break
+                    # 读完剩余响应体，连接才能放回连接池复用
+                    continue
                 if "{" not in line:
                     continue
                 if "flagged" in line and "403" in line:
@@ -397,8 +496,24 @@ class Chatbot:
         ]
 
 
+    def fork(self) -> "Chatbot":
+        """
+        Copy the chatbot with its own conversation,
+        the http client is shared
+        """
+        chatbot = copy.copy(self)
+        chatbot.conversation = ConversationDict(
+            {convo_id: list(messages) for convo_id, messages in self.conversation.items()}
+        )
+        return chatbot
+
     def set_api_addr(self, new_api_addr: str) -> None:
+        if new_api_addr == self.api_address:
+            return
         self.api_address = new_api_addr
+        # 端点改变时换用该端点的共享连接
+        if hasattr(self, "aclient"):
+            self.update_proxy(self.requested_proxy)
 
     def set_api_key(self, new_api_key: str) -> None:
         self.api_key = new_api_key
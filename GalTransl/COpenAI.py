@@ -5,25 +5,60 @@ CloseAI related classes
 import asyncio
 from asyncio import gather
 from alive_progress import alive_bar
-from time import time
+from hashlib import sha1
+from os import replace
+from os.path import join as joinpath, exists as isPathExists
+from time import time, monotonic
 from GalTransl import LOGGER, TRANSLATOR_DEFAULT_ENGINE
 from GalTransl.ConfigHelper import CProjectConfig, CProxy
+from GalTransl.ClientPool import HTTP2_AVAILABLE
 from typing import Optional, Tuple
-from random import choice
-from asyncio import Queue
-from openai import OpenAI
+from openai import AsyncOpenAI
+import httpx
+import orjson
 import re
 
+# 未配置 rpm 的 key 按该值计算请求令牌桶，只用于在多个 key 之间均衡
+DEFAULT_RPM = 60
+# 额度不足时的冷却时间(秒)，连续出错时翻倍
+QUOTA_COOLDOWN = 60
+# 限流(429)时的冷却时间(秒)，连续出错时翻倍
+RATE_LIMIT_COOLDOWN = 5
+MAX_COOLDOWN = 1800
+# 同时检测的key数量
+TOKEN_CHECK_CONCURRENCY = 16
+# 单次检测的超时时间(秒)
+TOKEN_CHECK_TIMEOUT = 15
+TOKEN_CHECK_CACHE_FILENAME = "token_check.json"
+# Sakura 端点连续失败该次数后暂停分配
+SAKURA_EJECT_FAILURES = 3
+# Sakura 端点暂停分配的时间(秒)，再次被剔除时翻倍
+SAKURA_EJECT_SECONDS = 30
+SAKURA_EJECT_MAX_SECONDS = 600
+
 
 class COpenAIToken:
     """
-    OpenAI 令牌
+    OpenAI 令牌，附带按 rpm/tpm 计算的令牌桶和健康状态
     """
 
-    def __init__(self, token: str, domain: str, isAvailable: bool) -> None:
+    def __init__(
+        self, token: str, domain: str, isAvailable: bool, rpm: int = 0, tpm: int = 0
+    ) -> None:
         self.token: str = token
         self.domain: str = domain
         self.isAvailable: bool = isAvailable
+        self.rpm: int = rpm  # 每分钟请求数上限，0 表示未知
+        self.tpm: int = tpm  # 每分钟 token 数上限，0 表示不限制
+        self.req_level: float = float(rpm or DEFAULT_RPM)  # 剩余请求数
+        self.tok_level: float = float(tpm)  # 剩余 token 数
+        self.last_refill: float = monotonic()
+        self.latency_avg: float = 0.0  # 最近请求的平均耗时
+        self.tokens_avg: float = 0.0  # 最近请求的平均 token 数
+        self.error_streak: int = 0  # 连续限流/出错次数
+        self.quota_failures: int = 0  # 连续额度不足次数
+        self.cooldown_until: float = 0.0
+        self.cooldown_for_quota: bool = False
 
     def maskToken(self) -> str:
         """
@@ -31,6 +66,33 @@ class COpenAIToken:
         """
         return self.token[:6] + "*" * 17
 
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        req_capacity = self.rpm or DEFAULT_RPM
+        self.req_level = min(req_capacity, self.req_level + elapsed * req_capacity / 60)
+        if self.tpm:
+            self.tok_level = min(self.tpm, self.tok_level + elapsed * self.tpm / 60)
+
+    def isCooling(self, now: float) -> bool:
+        return now < self.cooldown_until
+
+    def headroom(self, now: float) -> float:
+        """
+        剩余可用的请求数，同时受 rpm 和 tpm 限制，连续出错的 key 降低权重
+        """
+        self._refill(now)
+        score = self.req_level
+        if self.tpm and self.tokens_avg > 0:
+            score = min(score, self.tok_level / self.tokens_avg)
+        if self.error_streak:
+            score = score / (1 + self.error_streak) if score > 0 else score * (1 + self.error_streak)
+        return score
+
+    def setCooldown(self, seconds: float, for_quota: bool) -> None:
+        self.cooldown_until = monotonic() + min(seconds, MAX_COOLDOWN)
+        self.cooldown_for_quota = for_quota
+
 
 def initGPTToken(config: CProjectConfig, eng_type: str) -> Optional[list[COpenAIToken]]:
     """
@@ -75,6 +137,13 @@ class COpenAITokenPool:
         self.force_eng_name = config.getBackendConfigSection(section_name).get(
             "rewriteModelName", ""
         )
+        # 检测通过的key在有效期内不再重复检测，0 表示不缓存
+        self.check_cache_ttl = config.getBackendConfigSection(section_name).get(
+            "checkAvailableTTL", 3600
+        )
+        self.check_cache_path = joinpath(
+            config.getCachePath(), TOKEN_CHECK_CACHE_FILENAME
+        )
 
         if all_tokens := config.getBackendConfigSection(section_name).get("tokens"):
             for tokenEntry in all_tokens:
@@ -85,7 +154,15 @@ class COpenAITokenPool:
                     else defaultEndpoint
                 )
                 domain = domain[:-1] if domain.endswith("/") else domain
-                token_list.append(COpenAIToken(token, domain, True))
+                token_list.append(
+                    COpenAIToken(
+                        token,
+                        domain,
+                        True,
+                        int(tokenEntry.get("rpm", 0) or 0),
+                        int(tokenEntry.get("tpm", 0) or 0),
+                    )
+                )
                 pass
 
         for token in token_list:
@@ -93,27 +170,30 @@ class COpenAITokenPool:
 
     async def _isTokenAvailable(
         self, token: COpenAIToken, proxy: CProxy = None, model_name: str = ""
-    ) -> Tuple[bool, bool, bool, COpenAIToken]:
+    ) -> Tuple[bool, COpenAIToken]:
 
         if not token.domain.endswith("/v1") and not re.search(r"/v\d+$", token.domain):
             base_url = token.domain + "/v1"
         else:
             base_url = token.domain
+        st = time()
         try:
-            st = time()
-            client = OpenAI(
+            client = AsyncOpenAI(
                 api_key=token.token,
                 base_url=base_url,
+                max_retries=0,
+                http_client=self.check_client,
             )
-            response = client.chat.completions.create(
+            # 只生成1个token，能正常返回即说明key可以调用该模型
+            response = await client.chat.completions.create(
                 model=model_name,
                 messages=[{"role": "user", "content": "JUST echo OK"}],
                 temperature=0.1,
-                max_tokens=100,
-                timeout=30,
+                max_tokens=1,
+                timeout=TOKEN_CHECK_TIMEOUT,
             )
 
-            if not response.choices[0].message.content:
+            if not response.choices:
                 # token not available, may token has been revoked
                 return False, token
             else:
@@ -138,46 +218,109 @@ class COpenAITokenPool:
         model_name: str = "",
         max_retries: int = 3,
     ) -> Tuple[bool, COpenAIToken]:
-        for retry_count in range(max_retries):
-            is_available, token = await self._isTokenAvailable(token, proxy, model_name)
-            if is_available:
-                self.bar()
-                return is_available, token
-            else:
-                # wait for some time before retrying, you can add some delay here
-                LOGGER.warning(f"可用性检查失败，正在重试 {retry_count + 1} 次...")
-                await asyncio.sleep(1)
+        async with self.check_semaphore:
+            for retry_count in range(max_retries):
+                is_available, token = await self._isTokenAvailable(
+                    token, proxy, model_name
+                )
+                if is_available:
+                    self.bar()
+                    return is_available, token
+                else:
+                    # wait for some time before retrying, you can add some delay here
+                    LOGGER.warning(f"可用性检查失败，正在重试 {retry_count + 1} 次...")
+                    await asyncio.sleep(1)
 
         # If all retries fail, return the result from the last attempt
         self.bar()
         return is_available, token
 
+    @staticmethod
+    def _check_cache_key(token: COpenAIToken, model_name: str) -> str:
+        # 不在磁盘上保存明文key
+        return sha1(f"{token.token}|{token.domain}|{model_name}".encode("utf-8")).hexdigest()
+
+    def _load_check_cache(self) -> dict:
+        if self.check_cache_ttl <= 0 or not isPathExists(self.check_cache_path):
+            return {}
+        try:
+            with open(self.check_cache_path, "rb") as f:
+                cache = orjson.loads(f.read())
+        except Exception as e:
+            LOGGER.debug(f"读取key检测缓存失败: {e}")
+            return {}
+        now = time()
+        return {
+            key: checked_at
+            for key, checked_at in cache.items()
+            if now - checked_at < self.check_cache_ttl
+        }
+
+    def _save_check_cache(self, cache: dict) -> None:
+        if self.check_cache_ttl <= 0:
+            return
+        tmp_path = self.check_cache_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(orjson.dumps(cache))
+            replace(tmp_path, self.check_cache_path)
+        except Exception as e:
+            LOGGER.debug(f"保存key检测缓存失败: {e}")
+
     async def checkTokenAvailablity(
         self, proxy: CProxy = None, eng_type: str = ""
     ) -> None:
         """
-        检测令牌有效性
+        检测令牌有效性，并行检测，有效期内检测通过过的key直接跳过
         """
         model_name = TRANSLATOR_DEFAULT_ENGINE.get(eng_type, "")
         if self.force_eng_name:
             model_name = self.force_eng_name
         assert model_name != "", "model_name is empty!"
 
-        LOGGER.info(f"测试key是否能调用{model_name}模型...")
-        fs = []
-        with alive_bar(total=len(self.tokens),title="测试Key……") as bar:
-            self.bar = bar
-            for _, token in self.tokens:
-                fs.append(
-                    self._check_token_availability_with_retry(
-                        token, proxy if proxy else None, model_name
-                    )
-                )
-            result: list[tuple[bool, COpenAIToken]] = await gather(*fs)
+        check_cache = self._load_check_cache()
+        to_check: list[COpenAIToken] = [
+            token
+            for _, token in self.tokens
+            if self._check_cache_key(token, model_name) not in check_cache
+        ]
+        if len(to_check) < len(self.tokens):
+            LOGGER.info(
+                f"{len(self.tokens) - len(to_check)}个key在{self.check_cache_ttl}秒内检测通过，跳过检测"
+            )
+        checked: dict[int, bool] = {}
+
+        if to_check:
+            LOGGER.info(f"测试key是否能调用{model_name}模型...")
+            self.check_semaphore = asyncio.Semaphore(TOKEN_CHECK_CONCURRENCY)
+            # 检测用单独的短期 client，共享连接池每个端点的连接数按 workersPerProject 限制，
+            # HTTP/1.1 端点上会让检测排队
+            self.check_client = httpx.AsyncClient(
+                follow_redirects=True,
+                proxy=proxy.addr if proxy else None,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_connections=TOKEN_CHECK_CONCURRENCY),
+            )
+            fs = []
+            try:
+                with alive_bar(total=len(to_check), title="测试Key……") as bar:
+                    self.bar = bar
+                    for token in to_check:
+                        fs.append(
+                            self._check_token_availability_with_retry(
+                                token, proxy if proxy else None, model_name
+                            )
+                        )
+                    for isAvailable, token in await gather(*fs):
+                        checked[id(token)] = isAvailable
+            finally:
+                await self.check_client.aclose()
 
         # replace list with new one
         newList: list[tuple[bool, COpenAIToken]] = []
-        for isAvailable, token in result:
+        now = time()
+        for _, token in self.tokens:
+            isAvailable = checked.get(id(token), True)
             if isAvailable != True:
                 LOGGER.warning(
                     "%s is not available for %s, will be removed",
@@ -186,61 +329,213 @@ class COpenAITokenPool:
                 )
             else:
                 newList.append((True, token))
+                check_cache.setdefault(self._check_cache_key(token, model_name), now)
 
         self.tokens = newList
+        if to_check:
+            self._save_check_cache(check_cache)
 
     def reportTokenProblem(self, token: COpenAIToken) -> None:
         """
-        报告令牌无效
+        报告令牌额度不足等问题，令牌进入冷却而不是被移除，连续出问题时冷却时间翻倍
         """
-        for id, tokenPair in enumerate(self.tokens):
-            if tokenPair[1] == token:
-                self.tokens.pop(id)
-            pass
-        pass
+        token.quota_failures += 1
+        token.error_streak += 1
+        token.setCooldown(QUOTA_COOLDOWN * 2 ** (token.quota_failures - 1), True)
+
+    def reportTokenRateLimited(self, token: COpenAIToken) -> None:
+        """
+        报告令牌被限流(429)，清空其请求令牌桶并短暂冷却
+        """
+        token.error_streak += 1
+        token.req_level = min(token.req_level, 0)
+        token.setCooldown(RATE_LIMIT_COOLDOWN * 2 ** (token.error_streak - 1), False)
+
+    def reportTokenSuccess(
+        self, token: COpenAIToken, latency: float, used_tokens: int = 0
+    ) -> None:
+        """
+        报告一次成功的请求，记录耗时和消耗的 token 数
+        """
+        token.error_streak = 0
+        token.quota_failures = 0
+        token.latency_avg = (
+            latency if token.latency_avg == 0 else token.latency_avg * 0.8 + latency * 0.2
+        )
+        if used_tokens > 0:
+            token.tokens_avg = (
+                used_tokens
+                if token.tokens_avg == 0
+                else token.tokens_avg * 0.8 + used_tokens * 0.2
+            )
+            if token.tpm:
+                token.tok_level -= used_tokens
+
+    def hasIdleToken(self) -> bool:
+        """
+        是否还有不在冷却中的令牌
+        """
+        now = monotonic()
+        return any(
+            available and token.isAvailable and not token.isCooling(now)
+            for available, token in self.tokens
+        )
+
+    def countUsableTokens(self) -> int:
+        return sum(1 for available, token in self.tokens if available and token.isAvailable)
+
+    def getOtherToken(self, token: COpenAIToken) -> Optional[COpenAIToken]:
+        """
+        获取 token 以外不在冷却中、余量最多的令牌，用于对冲请求。没有时返回 None
+        """
+        now = monotonic()
+        idle = [
+            t
+            for available, t in self.tokens
+            if available and t.isAvailable and t is not token and not t.isCooling(now)
+        ]
+        if not idle:
+            return None
+        other = max(idle, key=lambda t: (t.headroom(now), -t.latency_avg))
+        other.req_level -= 1
+        return other
 
     def getToken(self) -> COpenAIToken:
         """
-        获取一个有效的 token
+        获取剩余余量最多的 token。
+        所有 token 都在冷却时返回最早结束冷却的，都因额度不足冷却时报错。
         """
-        rounds: int = 0
-        while True:
-            if rounds > 20:
+        now = monotonic()
+        tokens = [token for available, token in self.tokens if available and token.isAvailable]
+        if not tokens:
+            raise RuntimeError("没有可用的 API key！")
+        idle = [token for token in tokens if not token.isCooling(now)]
+        if idle:
+            token = max(idle, key=lambda t: (t.headroom(now), -t.latency_avg))
+        else:
+            if all(token.cooldown_for_quota for token in tokens):
                 raise RuntimeError("COpenAITokenPool::getToken: 可用的API key耗尽！")
-            try:
-                available, token = choice(self.tokens)
-                if not available:
-                    continue
-                if token.isAvailable:
-                    return token
-                rounds += 1
-            except IndexError:
-                raise RuntimeError("没有可用的 API key！")
+            token = min(
+                (t for t in tokens if not t.cooldown_for_quota),
+                key=lambda t: t.cooldown_until,
+            )
+            token._refill(now)
+        token.req_level -= 1
+        return token
+
+
+class CSakuraEndpoint:
+    """
+    Sakura/GalTransl 推理端点及其负载与健康状态
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url: str = url
+        self.outstanding: int = 0  # 正在进行的请求数
+        self.latency_avg: float = 0.0  # 请求耗时的指数移动平均
+        self.failures: int = 0  # 连续失败次数
+        self.ejections: int = 0  # 连续被剔除次数
+        self.ejected_until: float = 0.0
+
+    def isEjected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+
+class CSakuraEndpointPool:
+    """
+    Sakura 端点负载均衡。每个请求选择 (进行中请求数+1)*平均耗时 最小的端点，
+    连续失败的端点被暂时剔除，剔除时间结束后重新参与分配，再次成功即恢复。
+    """
+
+    def __init__(self, urls: list[str]) -> None:
+        self.endpoints: list[CSakuraEndpoint] = [CSakuraEndpoint(url) for url in urls]
+
+    def _score(self, endpoint: CSakuraEndpoint) -> float:
+        latency = endpoint.latency_avg
+        if latency == 0:
+            # 还没有耗时数据的端点按已知端点的最小耗时估计，保证会被尝试
+            known = [e.latency_avg for e in self.endpoints if e.latency_avg > 0]
+            latency = min(known) if known else 1.0
+        return (endpoint.outstanding + 1) * latency
+
+    def acquire(self) -> CSakuraEndpoint:
+        """
+        选择一个端点并计入进行中的请求
+        """
+        now = monotonic()
+        candidates = [e for e in self.endpoints if not e.isEjected(now)]
+        if candidates:
+            endpoint = min(candidates, key=lambda e: (self._score(e), e.outstanding))
+        else:
+            # 全部被剔除时选最早恢复的
+            endpoint = min(self.endpoints, key=lambda e: e.ejected_until)
+        endpoint.outstanding += 1
+        return endpoint
+
+    def acquire_other(
+        self, endpoint: Optional[CSakuraEndpoint]
+    ) -> Optional[CSakuraEndpoint]:
+        """
+        选择 endpoint 以外未被剔除的端点，用于对冲请求。没有时返回 None
+        """
+        now = monotonic()
+        candidates = [
+            e for e in self.endpoints if e is not endpoint and not e.isEjected(now)
+        ]
+        if not candidates:
+            return None
+        other = min(candidates, key=lambda e: (self._score(e), e.outstanding))
+        other.outstanding += 1
+        return other
+
+    def release(
+        self, endpoint: CSakuraEndpoint, latency: Optional[float] = None, failed: bool = False
+    ) -> None:
+        """
+        请求结束。成功时传入耗时，失败时 failed=True，都不传表示不计入统计(如被取消)
+        """
+        endpoint.outstanding -= 1
+        if failed:
+            endpoint.failures += 1
+            if endpoint.failures >= SAKURA_EJECT_FAILURES:
+                seconds = min(
+                    SAKURA_EJECT_SECONDS * 2**endpoint.ejections, SAKURA_EJECT_MAX_SECONDS
+                )
+                endpoint.ejections += 1
+                endpoint.ejected_until = monotonic() + seconds
+                LOGGER.warning(
+                    f"Sakura端点 {endpoint.url} 连续失败{endpoint.failures}次，暂停分配{seconds}秒"
+                )
+            return
+        if latency is None:
+            return
+        if endpoint.ejections:
+            LOGGER.info(f"Sakura端点 {endpoint.url} 已恢复")
+        endpoint.failures = 0
+        endpoint.ejections = 0
+        endpoint.latency_avg = (
+            latency
+            if endpoint.latency_avg == 0
+            else endpoint.latency_avg * 0.8 + latency * 0.2
+        )
 
 
-async def init_sakura_endpoint_queue(projectConfig: CProjectConfig) -> Optional[Queue]:
+async def init_sakura_endpoint_pool(projectConfig: CProjectConfig) -> CSakuraEndpointPool:
     """
-    初始化端点队列，用于Sakura或GalTransl引擎。
+    初始化端点池，用于Sakura或GalTransl引擎。
 
     参数:
     projectConfig: 项目配置对象
-    workersPerProject: 每个项目的工作线程数
-    eng_type: 引擎类型
 
     返回:
-    初始化的端点队列，如果不需要则返回None
+    初始化的端点池
     """
 
     workersPerProject = projectConfig.getKey("workersPerProject") or 1
-    sakura_endpoint_queue = asyncio.Queue()
     section_name = "SakuraLLM" 
     if "endpoints" in projectConfig.getBackendConfigSection(section_name):
         endpoints = projectConfig.getBackendConfigSection(section_name)["endpoints"]
     else:
         endpoints = [projectConfig.getBackendConfigSection(section_name)["endpoint"]]
-    repeated = (workersPerProject + len(endpoints) - 1) // len(endpoints)
-    for _ in range(repeated):
-        for endpoint in endpoints:
-            await sakura_endpoint_queue.put(endpoint)
-    LOGGER.info(f"当前使用 {workersPerProject} 个Sakura worker引擎")
-    return sakura_endpoint_queue
+    LOGGER.info(f"当前使用 {workersPerProject} 个Sakura worker引擎，{len(endpoints)} 个端点")
+    return CSakuraEndpointPool(endpoints)
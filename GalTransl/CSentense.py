@@ -1,3 +1,4 @@
+from sys import intern
 from typing import List
 
 
@@ -6,6 +7,32 @@ class CSentense:
     每个CSentense储存一句待翻译文本
     """
 
+    # 大项目有几十万句，用 __slots__ 代替每个实例的 __dict__
+    __slots__ = [
+        "index",
+        "_pre_jp",
+        "post_jp",
+        "pre_zh",
+        "proofread_zh",
+        "post_zh",
+        "speaker",
+        "_speaker",
+        "is_dialogue",
+        "has_diag_symbol",
+        "left_symbol",
+        "right_symbol",
+        "dia_format",
+        "mono_format",
+        "trans_by",
+        "proofread_by",
+        "problem",
+        "trans_conf",
+        "doub_content",
+        "unknown_proper_noun",
+        "prev_tran",
+        "next_tran",
+    ]
+
     def __init__(self, pre_jp: str, speaker: str = "", index=0) -> None:
         """每个CSentense储存一句待翻译文本
 
@@ -15,6 +42,8 @@ class CSentense:
             index_key (str, optional): 唯一index. Defaults to "".
         """
         self.index = index
+        if isinstance(speaker, str):
+            speaker = intern(speaker)  # 同一说话人的所有句子共用一个字符串
 
         self._pre_jp = pre_jp  # 前原
         self.post_jp = pre_jp  # 前润，初始为原句
@@ -63,6 +63,9 @@ class SplitChunkMetadata:
     def get_file_finished_chunks(self):
         return SplitChunkMetadata.__file_finished_chunk[self.file_path]
 
+    def drop_file_finished_chunks(self):
+        SplitChunkMetadata.__file_finished_chunk.pop(self.file_path, None)
+
     @staticmethod
     def clear_file_finished_chunk():
         SplitChunkMetadata.__file_finished_chunk = {}
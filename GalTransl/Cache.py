@@ -7,13 +7,56 @@ from GalTransl import LOGGER
 from typing import List
 import orjson
 import os
+import mmap
 from GalTransl.i18n import get_text,GT_LANG
 
 
+# 每个缓存文件已写入日志的句子状态 {cache_file_path: {pos: 状态}}
+_journaled: dict[str, dict[int, tuple]] = {}
+
+
+def get_journal_path(cache_file_path: str) -> str:
+    """
+    返回缓存文件对应的追加日志路径，xxx.json -> xxx.jsonl
+    """
+    return os.path.splitext(cache_file_path)[0] + ".jsonl"
+
+
+def _tran_to_cache_obj(tran, post_save=False) -> dict:
+    cache_obj = {
+        "index": tran.index,
+        "name": tran.speaker,
+        "pre_jp": tran.pre_jp,
+        "post_jp": tran.post_jp,
+        "pre_zh": tran.pre_zh,
+    }
+
+    cache_obj["proofread_zh"] = tran.proofread_zh
+
+    if post_save and tran.problem != "":
+        cache_obj["problem"] = tran.problem
+
+    cache_obj["trans_by"] = tran.trans_by
+    cache_obj["proofread_by"] = tran.proofread_by
+
+    if tran.trans_conf != 0:
+        cache_obj["trans_conf"] = tran.trans_conf
+    if tran.doub_content != "":
+        cache_obj["doub_content"] = tran.doub_content
+    if tran.unknown_proper_noun != "":
+        cache_obj["unknown_proper_noun"] = tran.unknown_proper_noun
+    if post_save:
+        cache_obj["post_zh_preview"] = tran.post_zh
+    return cache_obj
+
+
 def save_transCache_to_json(trans_list: CTransList, cache_file_path, post_save=False):
     """
     此函数将翻译缓存保存到 JSON 文件中。
 
+    翻译过程中只把新翻译/有变化的句子追加到 .jsonl 日志，写入量与批大小成正比；
+    翻译结束后(post_save)写出完整的 JSON 缓存并删除日志。
+
     Args:
         trans_list (CTransList): 要保存的翻译列表。
         cache_file_path (str): 要保存到的 JSON 文件的路径。
@@ -21,6 +64,27 @@ def save_transCache_to_json(trans_list: CTransList, cache_file_path, post_save=F
     """
     if not cache_file_path.endswith(".json"):
         cache_file_path += ".json"
+    journal_path = get_journal_path(cache_file_path)
+
+    if not post_save:
+        journaled = _journaled.setdefault(cache_file_path, {})
+        lines = []
+        for pos, tran in enumerate(trans_list):
+            if tran.post_jp == "":  # 对齐get逻辑
+                continue
+            if tran.pre_zh == "":
+                continue
+            state = (tran.pre_zh, tran.proofread_zh, tran.trans_by, tran.proofread_by)
+            if journaled.get(pos) == state:
+                continue
+            journaled[pos] = state
+            lines.append(
+                orjson.dumps({"pos": pos, "cache": _tran_to_cache_obj(tran)})
+            )
+        if lines:
+            with open(journal_path, mode="ab") as f:
+                f.write(b"\n".join(lines) + b"\n")
+        return
 
     cache_json = []
 
@@ -29,36 +93,83 @@ def save_transCache_to_json(trans_list: CTransList, cache_file_path, post_save=F
             continue
         if tran.pre_zh == "":
             continue
+        cache_json.append(_tran_to_cache_obj(tran, post_save))
 
+    # 先写临时文件再替换，中途崩溃不会留下半个缓存文件
+    tmp_path = cache_file_path + ".tmp"
+    with open(tmp_path, mode="wb") as f:
+        f.write(orjson.dumps(cache_json, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, cache_file_path)
+    _journaled.pop(cache_file_path, None)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
 
-        cache_obj = {
-            "index": tran.index,
-            "name": tran.speaker,
-            "pre_jp": tran.pre_jp,
-            "post_jp": tran.post_jp,
-            "pre_zh": tran.pre_zh,
-        }
 
-        cache_obj["proofread_zh"] = tran.proofread_zh
+def load_transCache_journal(cache_file_path: str) -> dict[int, dict]:
+    """
+    读取缓存日志，返回 {句子位置: 缓存}，同一句以最后一条为准。
+    崩溃时写了一半的最后一行会被忽略。
+    """
+    journal = {}
+    journal_path = get_journal_path(cache_file_path)
+    if not os.path.exists(journal_path):
+        return journal
+    with open(journal_path, mode="rb") as f:
+        for line in f:
+            try:
+                record = orjson.loads(line)
+                journal[record["pos"]] = record["cache"]
+            except Exception:
+                LOGGER.debug(f"[cache]跳过损坏的日志行: {journal_path}")
+    return journal
 
-        if post_save and tran.problem != "":
-            cache_obj["problem"] = tran.problem
 
-        cache_obj["trans_by"] = tran.trans_by
-        cache_obj["proofread_by"] = tran.proofread_by
+def _line_key(name, pre_jp: str):
+    # 多人说话时 name 为列表，转成 tuple 才能作为字典键
+    return (name if isinstance(name, str) else tuple(name), pre_jp)
 
-        if tran.trans_conf != 0:
-            cache_obj["trans_conf"] = tran.trans_conf
-        if tran.doub_content != "":
-            cache_obj["doub_content"] = tran.doub_content
-        if tran.unknown_proper_noun != "":
-            cache_obj["unknown_proper_noun"] = tran.unknown_proper_noun
-        if post_save:
-            cache_obj["post_zh_preview"] = tran.post_zh
-        cache_json.append(cache_obj)
 
-    with open(cache_file_path, mode="wb") as f:
-        f.write(orjson.dumps(cache_json, option=orjson.OPT_INDENT_2))
+def build_context_keys(trans_list: CTransList) -> list:
+    """
+    为每个句子生成 (前一非空句, 本句, 后一非空句) 的缓存键。
+    前后各扫描一遍，不必为每句沿链表查找；键中的字符串会缓存自身的哈希值。
+    """
+    line_keys = [_line_key(tran.speaker, tran.pre_jp) for tran in trans_list]
+    keys = [None] * len(trans_list)
+    prev_key = None
+    for i, tran in enumerate(trans_list):
+        keys[i] = prev_key
+        if tran.post_jp != "":
+            prev_key = line_keys[i]
+    next_key = None
+    for i in range(len(trans_list) - 1, -1, -1):
+        keys[i] = (keys[i], line_keys[i], next_key)
+        if trans_list[i].post_jp != "":
+            next_key = line_keys[i]
+    return keys
+
+
+def _load_cache_index(cache_file_path: str) -> dict:
+    """
+    读取 JSON 缓存，建立 {(前句, 本句, 后句): 缓存} 索引
+    """
+    cache_dict = {}
+    if not os.path.exists(cache_file_path) or os.path.getsize(cache_file_path) == 0:
+        return cache_dict
+    with open(cache_file_path, mode="rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                cache_dictList = orjson.loads(memoryview(mm))
+            line_keys = [_line_key(c["name"], c["pre_jp"]) for c in cache_dictList]
+            last = len(line_keys) - 1
+            for i, cache in enumerate(cache_dictList):
+                line_priv = line_keys[i - 1] if i > 0 else None
+                line_next = line_keys[i + 1] if i < last else None
+                cache_dict[(line_priv, line_keys[i], line_next)] = cache
+        except Exception as e:
+            LOGGER.error(get_text("cache_read_error", GT_LANG, cache_file_path=cache_file_path))
+            raise e
+    return cache_dict
 
 
 def get_transCache_from_json(
@@ -70,6 +181,7 @@ def get_transCache_from_json(
     load_post_jp=False,
     ignr_post_jp=False,
     eng_type="",
+    context_keys=None,
 ):
     """
     此函数从 JSON 文件中检索翻译缓存，并相应地更新翻译列表。
@@ -82,6 +194,8 @@ def get_transCache_from_json(
         retran_key (str or list, optional): 重译关键字，可以是字符串或字符串列表。默认为空字符串。
         load_post_jp (bool, optional): 不检查post_jp是否被改变, 且直接使用cache的post_jp。默认为 False。
         ignr_post_jp (bool, optional): 仅不检查post_jp是否被改变。默认为 False。
+        eng_type (str, optional): 引擎类型。默认为空字符串。
+        context_keys (list, optional): build_context_keys 预先算好的上下文键，为 None 时现算。
 
     Returns:
         Tuple[List[CTrans], List[CTrans]]: 包含两个列表的元组：击中缓存的翻译列表和未击中缓存的翻译列表。
@@ -90,29 +204,16 @@ def get_transCache_from_json(
         if not os.path.exists(cache_file_path):
             cache_file_path += ".json"
 
+    # 上次未正常结束时留下的日志，按句子位置优先于 JSON 缓存
+    journal = load_transCache_journal(cache_file_path)
+
     translist_hit = []
     translist_unhit = []
-    cache_dict = {}
-    if os.path.exists(cache_file_path):
-        with open(cache_file_path, encoding="utf8") as f:
-            try:
-                cache_dictList = orjson.loads(f.read())
-                for i, cache in enumerate(cache_dictList):
-                    line_now, line_priv, line_next = "", "None", "None"
-                    line_now = f'{cache["name"]}{cache["pre_jp"]}'
-                    if i > 0:
-                        line_priv = f'{cache_dictList[i-1]["name"]}{cache_dictList[i-1]["pre_jp"]}'
-                    if i < len(cache_dictList) - 1:
-                        line_next = f'{cache_dictList[i+1]["name"]}{cache_dictList[i+1]["pre_jp"]}'
-                    line_priv = "None" if line_priv == "" else line_priv
-                    line_next = "None" if line_next == "" else line_next
-                    cache_dict[line_priv + line_now + line_next] = cache
-            except Exception as e:
-                f.close()
-                LOGGER.error(get_text("cache_read_error", GT_LANG, cache_file_path=cache_file_path))
-                raise e
+    cache_dict = None
+    if context_keys is None:
+        context_keys = build_context_keys(trans_list)
 
-    for tran in trans_list:
+    for pos, tran in enumerate(trans_list):
         # 忽略jp为空的句子
         if tran.pre_jp == "" or tran.post_jp == "":
             tran.pre_zh, tran.post_zh = "", ""
@@ -124,49 +225,40 @@ def get_transCache_from_json(
             translist_hit.append(tran)
             continue
 
-        line_now, line_priv, line_next = "", "None", "None"
         line_now = f"{tran.speaker}{tran.pre_jp}"
-        prev_tran = tran.prev_tran
-        # 找非空前句
-        while prev_tran and prev_tran.post_jp == "":
-            prev_tran = prev_tran.prev_tran
-        if prev_tran:
-            line_priv = f"{prev_tran.speaker}{prev_tran.pre_jp}"
-        # 找非空后句
-        next_tran = tran.next_tran
-        while next_tran and next_tran.post_jp == "":
-            next_tran = next_tran.next_tran
-        if next_tran:
-            line_next = f"{next_tran.speaker}{next_tran.pre_jp}"
-
-        line_priv = "None" if line_priv == "" else line_priv
-        line_next = "None" if line_next == "" else line_next
-        cache_key = line_priv + line_now + line_next
+        cache_key = context_keys[pos]
+        # 需要查缓存时才读取缓存文件
+        if cache_dict is None:
+            cache_dict = _load_cache_index(cache_file_path)
+
+        cache = journal.get(pos)
+        if cache is None or cache["pre_jp"] != tran.pre_jp or cache["name"] != tran.speaker:
+            cache = cache_dict.get(cache_key)
 
         # cache_key不在缓存
-        if cache_key not in cache_dict:
+        if cache is None:
             translist_unhit.append(tran)
             LOGGER.debug(f"[cache]message未命中缓存: {line_now}")
             if "rebuild" in eng_type:
                 LOGGER.error(f"[cache]message未命中缓存: {line_now}")
             continue
 
-        no_proofread = cache_dict[cache_key]["proofread_zh"] == ""
+        no_proofread = cache["proofread_zh"] == ""
 
         if no_proofread:
             # post_jp被改变
             if load_post_jp == ignr_post_jp == False:
-                if tran.post_jp != cache_dict[cache_key]["post_jp"]:
+                if tran.post_jp != cache["post_jp"]:
                     translist_unhit.append(tran)
-                    LOGGER.debug(f"[cache]post_jp被改变: \npost_jp_before{cache_dict[cache_key]['post_jp']}\npost_jp_now{tran.post_jp}")
+                    LOGGER.debug(f"[cache]post_jp被改变: \npost_jp_before{cache['post_jp']}\npost_jp_now{tran.post_jp}")
                     if "rebuild" in eng_type:
-                        LOGGER.error(f"[cache]post_jp被改变: \npost_jp_before: {cache_dict[cache_key]['post_jp']}\npost_jp_now: {tran.post_jp}")
+                        LOGGER.error(f"[cache]post_jp被改变: \npost_jp_before: {cache['post_jp']}\npost_jp_now: {tran.post_jp}")
                     continue
             # pre_zh为空
             if tran.post_jp != "":
                 if (
-                    "pre_zh" not in cache_dict[cache_key]
-                    or cache_dict[cache_key]["pre_zh"] == ""
+                    "pre_zh" not in cache
+                    or cache["pre_zh"] == ""
                 ):
                     translist_unhit.append(tran)
                     LOGGER.debug(f"[cache]pre_zh为空: {line_now}")
@@ -174,9 +266,9 @@ def get_transCache_from_json(
                         LOGGER.error(f"[cache]pre_zh为空: {line_now}")
                     continue
             # 重试失败的
-            if retry_failed and "Failed translation" in cache_dict[cache_key]["pre_zh"]:
+            if retry_failed and "Failed translation" in cache["pre_zh"]:
                 if (
-                    no_proofread or "Fail" in cache_dict[cache_key]["proofread_by"]
+                    no_proofread or "Fail" in cache["proofread_by"]
                 ):  # 且未校对
                     translist_unhit.append(tran)
                     LOGGER.debug(get_text("retry_failed", GT_LANG, line_now=line_now))
@@ -186,34 +278,34 @@ def get_transCache_from_json(
 
             # retran_key在pre_jp中
             if retran_key and check_retran_key(
-                retran_key, cache_dict[cache_key]["pre_jp"]
+                retran_key, cache["pre_jp"]
             ):
                 if "rebuild" not in eng_type:
                     translist_unhit.append(tran)
                     LOGGER.debug(f"[cache]retran_key在pre_jp中。message: {line_now}")
                     continue
             # retran_key在problem中
-            if retran_key and "problem" in cache_dict[cache_key]:
-                if check_retran_key(retran_key, cache_dict[cache_key]["problem"]):
+            if retran_key and "problem" in cache:
+                if check_retran_key(retran_key, cache["problem"]):
                     if "rebuild" not in eng_type:
                         translist_unhit.append(tran)
                         LOGGER.debug(f"[cache]retran_key在problem中。message: {line_now}")
                         continue
 
         # 击中缓存的,post_zh初始值赋pre_zh
-        tran.pre_zh = cache_dict[cache_key]["pre_zh"]
-        if "trans_by" in cache_dict[cache_key]:
-            tran.trans_by = cache_dict[cache_key]["trans_by"]
-        if "proofread_zh" in cache_dict[cache_key]:
-            tran.proofread_zh = cache_dict[cache_key]["proofread_zh"]
-        if "proofread_by" in cache_dict[cache_key]:
-            tran.proofread_by = cache_dict[cache_key]["proofread_by"]
-        if "trans_conf" in cache_dict[cache_key]:
-            tran.trans_conf = cache_dict[cache_key]["trans_conf"]
-        if "doub_content" in cache_dict[cache_key]:
-            tran.doub_content = cache_dict[cache_key]["doub_content"]
-        if "unknown_proper_noun" in cache_dict[cache_key]:
-            tran.unknown_proper_noun = cache_dict[cache_key]["unknown_proper_noun"]
+        tran.pre_zh = cache["pre_zh"]
+        if "trans_by" in cache:
+            tran.trans_by = cache["trans_by"]
+        if "proofread_zh" in cache:
+            tran.proofread_zh = cache["proofread_zh"]
+        if "proofread_by" in cache:
+            tran.proofread_by = cache["proofread_by"]
+        if "trans_conf" in cache:
+            tran.trans_conf = cache["trans_conf"]
+        if "doub_content" in cache:
+            tran.doub_content = cache["doub_content"]
+        if "unknown_proper_noun" in cache:
+            tran.unknown_proper_noun = cache["unknown_proper_noun"]
 
         if tran.proofread_zh != "":
             tran.post_zh = tran.proofread_zh
@@ -227,7 +319,7 @@ def get_transCache_from_json(
 
         # 不检查post_jp是否被改变, 且直接使用cache的post_jp
         if load_post_jp:
-            tran.post_jp = cache_dict[cache_key]["post_jp"]
+            tran.post_jp = cache["post_jp"]
 
         translist_hit.append(tran)
 
@@ -0,0 +1,71 @@
+"""
+进程级 HTTP 连接池
+"""
+
+from importlib.util import find_spec
+from typing import Optional
+from urllib.parse import urlsplit
+import httpx
+from GalTransl import LOGGER
+
+# 安装了 h2 时对 https 端点启用 HTTP/2
+HTTP2_AVAILABLE = find_spec("h2") is not None
+
+
+class CHttpClientPool:
+    """
+    按 (端点, 代理) 复用 httpx.AsyncClient，所有后端共享，避免每个后端实例/每次请求重新握手。
+    """
+
+    def __init__(self, max_workers: int = 1) -> None:
+        self._clients: dict[tuple[str, Optional[str]], httpx.AsyncClient] = {}
+        self.configure(max_workers)
+
+    def configure(self, max_workers: int) -> None:
+        """
+        按 workersPerProject 设置每个端点的 keep-alive 连接数
+        """
+        max_workers = max(1, max_workers or 1)
+        self.limits = httpx.Limits(
+            max_connections=max_workers * 2,
+            max_keepalive_connections=max_workers,
+            keepalive_expiry=60,
+        )
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        sp = urlsplit(url)
+        return f"{sp.scheme}://{sp.netloc}" if sp.netloc else url
+
+    def getClient(self, url: str, proxy: Optional[str] = None) -> httpx.AsyncClient:
+        """
+        获取 url 所在端点对应的共享 client
+        """
+        proxy = proxy or None
+        key = (self._origin(url), proxy)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                follow_redirects=True,
+                proxy=proxy,
+                http2=HTTP2_AVAILABLE,
+                limits=self.limits,
+            )
+            self._clients[key] = client
+            LOGGER.debug("new http client for %s (proxy: %s)", key[0], proxy)
+        return client
+
+    async def aclose(self) -> None:
+        """
+        关闭所有 client，在一次翻译任务结束时调用
+        """
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                LOGGER.debug("close http client failed: %s", e)
+
+
+HTTP_CLIENT_POOL = CHttpClientPool()
@@ -0,0 +1,246 @@
+"""
+自适应并发控制与对冲请求
+"""
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import Any, Awaitable, Callable, Optional, Tuple
+import httpx
+from GalTransl import LOGGER
+
+# 视为限流/过载的错误信息关键字
+OVERLOAD_KEYWORDS = (
+    "429",
+    "too many requests",
+    "try again later",
+    "rate limit",
+    "ratelimit",
+    "resource_exhausted",
+    "overloaded",
+    "timeout",
+    "timed out",
+)
+
+
+def is_overload_error(ex: BaseException) -> bool:
+    """
+    判断异常是否为限流(429)或超时
+    """
+    if isinstance(ex, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return True
+    name = type(ex).__name__.lower()
+    if "ratelimit" in name or "timeout" in name:
+        return True
+    str_ex = str(ex).lower()
+    return any(keyword in str_ex for keyword in OVERLOAD_KEYWORDS)
+
+
+class CAdaptiveLimiter:
+    """
+    AIMD 方式的并发限制器，所有 worker 共享。
+    请求成功且延迟正常时每轮(约 limit 个请求)并发数加 1，
+    遇到限流或超时时并发数减半，范围为 [min_limit, max_limit]。
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        initial: int = 0,
+        decrease_factor: float = 0.5,
+        latency_factor: float = 2.0,
+    ) -> None:
+        """
+        Args:
+            max_limit (int): 并发数上限，一般为 workersPerProject。
+            min_limit (int, optional): 并发数下限。默认为 1。
+            initial (int, optional): 初始并发数，0 表示从上限开始。默认为 0。
+            decrease_factor (float, optional): 限流时并发数乘以该系数。默认为 0.5。
+            latency_factor (float, optional): 延迟超过平均值的该倍数时不再增加并发。默认为 2.0。
+        """
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(initial or self.max_limit)
+        self.limit = min(max(self.limit, self.min_limit), self.max_limit)
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self._latency_avg = 0.0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.current_limit)
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self, latency: float) -> None:
+        """
+        请求成功：延迟正常时加性增加并发数
+        """
+        healthy = (
+            self._latency_avg == 0
+            or latency <= self._latency_avg * self.latency_factor
+        )
+        if self._latency_avg == 0:
+            self._latency_avg = latency
+        else:
+            self._latency_avg = self._latency_avg * 0.8 + latency * 0.2
+        if healthy and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_overload(self) -> None:
+        """
+        遇到限流或超时：乘性减少并发数。
+        同一轮中已发出的请求一起失败时只减一次。
+        """
+        now = monotonic()
+        if now - self._last_decrease < max(1.0, self._latency_avg):
+            return
+        self._last_decrease = now
+        old_limit = self.current_limit
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        if self.current_limit < old_limit:
+            LOGGER.warning(
+                f"[并发控制] 检测到限流或超时，并发数 {old_limit} -> {self.current_limit}"
+            )
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        占用一个请求名额，根据请求结果调整并发数
+        """
+        await self.acquire()
+        st = monotonic()
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            if is_overload_error(ex):
+                self.on_overload()
+            raise
+        else:
+            self.on_success(monotonic() - st)
+        finally:
+            await self.release()
+
+
+class CHedgePolicy:
+    """
+    对冲请求策略，所有 worker 共享。
+    请求耗时超过目前见到的 p95 延迟仍未完成时，再发一个相同的请求，取先完成的一个；
+    对冲请求数不超过总请求数的 budget 比例。
+    """
+
+    def __init__(
+        self,
+        budget: float = 0.1,
+        quantile: float = 0.95,
+        min_samples: int = 20,
+        min_delay: float = 1.0,
+        window: int = 200,
+    ) -> None:
+        """
+        Args:
+            budget (float, optional): 对冲请求数占总请求数的最大比例。默认为 0.1。
+            quantile (float, optional): 触发对冲的延迟分位数。默认为 0.95。
+            min_samples (int, optional): 延迟样本少于该数量时不对冲。默认为 20。
+            min_delay (float, optional): 触发对冲的最短等待秒数。默认为 1.0。
+            window (int, optional): 保留最近多少个延迟样本。默认为 200。
+        """
+        self.budget = max(0.0, budget)
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies = deque(maxlen=window)
+
+    def record(self, latency: float) -> None:
+        self._latencies.append(latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        返回触发对冲前等待的秒数，样本不足时返回 None
+        """
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.quantile))
+        return max(self.min_delay, latencies[index])
+
+    def try_hedge(self) -> bool:
+        """
+        预算内时占用一次对冲
+        """
+        if self.hedges + 1 > self.requests * self.budget:
+            return False
+        self.hedges += 1
+        return True
+
+
+async def hedged_call(
+    policy: Optional[CHedgePolicy],
+    primary: Callable[[], Awaitable],
+    hedge: Optional[Callable[[], Awaitable]],
+) -> Tuple[Any, bool]:
+    """
+    先发出 primary 请求，超过 p95 延迟仍未完成且预算允许时再发出 hedge 请求，
+    返回 (先成功的结果, 是否由对冲请求完成)，另一个请求被取消。
+    两个请求都失败时抛出 primary 的异常。hedge 为 None 时不对冲。
+    """
+    if policy is None or hedge is None:
+        return await primary(), False
+
+    policy.requests += 1
+    st = monotonic()
+    primary_task = asyncio.ensure_future(primary())
+    tasks = [primary_task]
+    try:
+        delay = policy.hedge_delay()
+        if delay is not None:
+            await asyncio.wait(tasks, timeout=delay)
+        if primary_task.done() or delay is None or not policy.try_hedge():
+            result = await primary_task
+            policy.record(monotonic() - st)
+            return result, False
+
+        LOGGER.debug(f"[对冲请求] 请求超过 {delay:.1f}s 未完成，发出对冲请求")
+        hedge_st = monotonic()
+        hedge_task = asyncio.ensure_future(hedge())
+        tasks.append(hedge_task)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is not None:
+                    continue
+                won_by_hedge = task is hedge_task
+                if won_by_hedge:
+                    policy.hedge_wins += 1
+                    policy.record(monotonic() - hedge_st)
+                else:
+                    policy.record(monotonic() - st)
+                return task.result(), won_by_hedge
+        raise primary_task.exception()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        # 等待被取消的请求释放并发名额和连接
+        await asyncio.gather(*tasks, return_exceptions=True)
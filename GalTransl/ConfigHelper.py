@@ -95,8 +95,13 @@ class CProjectConfig:
         self.fPlugins = []  # 文件插件列表
         self.tokenPool = None  # 令牌池
         self.proxyPool = None  # 代理池
-        self.endpointQueue = None  # 端点队列
+        self.endpointPool = None  # Sakura端点池
         self.input_splitter = None  # 输入分割器
+        self.translMemory = None  # 翻译记忆库
+        self.problemAnalyzer = None  # 问题分析器
+        self.limiter = None  # 请求并发控制
+        self.hedger = None  # 对冲请求策略
+        self.resultWriter = None  # 译文后台写入队列
 
     def getProjectConfig(self) -> dict:
         """
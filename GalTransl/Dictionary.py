@@ -1,8 +1,10 @@
 from typing import List
+from bisect import bisect_left
 from os import path
 from GalTransl.CSentense import CSentense, CTransList
 from GalTransl import LOGGER
 from GalTransl.Utils import process_escape
+from GalTransl.AhoCorasick import CAhoCorasick
 
 
 class ifWord:
@@ -124,6 +126,9 @@ class CNormalDic:
 
     def __init__(self, dic_list: list) -> None:
         self.dic_list: List[CBasicDicElement] = []
+        self._matcher: CAhoCorasick = None  # 普通词条的多模式匹配器
+        self._word_positions: List[List[int]] = []  # 匹配器中每个词对应的词条位置
+        self._always_positions: List[int] = []  # 每句都要判断的条件/场景词条位置
         for dic_path in dic_list:
             self.load_dic(dic_path)  # 加载字典
 
@@ -132,6 +137,45 @@ class CNormalDic:
         按字典search_word的长度重排序
         """
         self.dic_list.sort(key=lambda x: len(x.search_word), reverse=True)
+        self._matcher = None
+
+    def _build_matcher(self):
+        """
+        把普通词条编译进 Aho-Corasick 自动机，条件/场景词条仍逐条判断
+        """
+        is_normal = [
+            not dic.is_conditionaDic
+            and not dic.is_situationsDic
+            and dic.search_word != ""
+            for dic in self.dic_list
+        ]
+        self._matcher = CAhoCorasick(
+            dic.search_word for dic, normal in zip(self.dic_list, is_normal) if normal
+        )
+        word_index = {word: i for i, word in enumerate(self._matcher.words)}
+        self._word_positions = [[] for _ in self._matcher.words]
+        self._always_positions = []
+        for i, dic in enumerate(self.dic_list):
+            if is_normal[i]:
+                self._word_positions[word_index[dic.search_word]].append(i)
+            else:
+                self._always_positions.append(i)
+
+    def _get_candidates(self, input_text: str, start: int) -> List[int]:
+        """
+        返回从 start 开始可能生效的词条位置（升序）：句中出现的普通词条和所有条件/场景词条
+        """
+        candidates = [
+            i
+            for word_id in self._matcher.find_all(input_text)
+            for i in self._word_positions[word_id]
+            if i >= start
+        ]
+        candidates.extend(
+            self._always_positions[bisect_left(self._always_positions, start) :]
+        )
+        candidates.sort()
+        return candidates
 
     def get_dst(self,word):
         for dic in self.dic_list:
@@ -154,6 +198,7 @@ class CNormalDic:
         situationsDic_count = 0
         dic_name = path.basename(dic_path)
         dic_name = path.splitext(dic_name)[0]
+        self._matcher = None
 
         for line in dic_lines:
             if line.startswith("\n"):
@@ -224,8 +269,18 @@ class CNormalDic:
         input_translate：这个句子所在的Translate对象
         full_match：是否全匹配，默认False，开启后查找词完全等于input_text才替换
         """
+        if self._matcher is None:
+            self._build_matcher()
+        # 不在句中的普通词条替换不会有任何效果，只按顺序遍历可能生效的词条，
+        # 句子被替换后重新扫描剩下的词条
+        candidates = self._get_candidates(input_text, 0)
+        k = 0
+
         # 遍历每个BasicDicElement做替换
-        for dic in self.dic_list:
+        while k < len(candidates):
+            i = candidates[k]
+            k += 1
+            dic = self.dic_list[i]
             # 场景字典判断
             if dic.is_situationsDic:
                 if ("diag" == dic.special_key and input_tran.is_dialogue == False) or (
@@ -298,6 +353,7 @@ class CNormalDic:
 
             search_word = dic.search_word
             replace_word = dic.replace_word
+            text_before = input_text
 
             # startwith情况，只替换开头的
             if dic.startswith_flag:
@@ -315,12 +371,25 @@ class CNormalDic:
                 elif search_word == input_text:
                     input_text = replace_word
 
+            if input_text != text_before:
+                candidates = self._get_candidates(input_text, i + 1)
+                k = 0
+
         return input_text
 
 
 class CGptDict:
+    # 渲染好的术语表缓存上限
+    PROMPT_CACHE_SIZE = 4096
+
     def __init__(self, dic_list: list) -> None:
         self._dic_list: List[CBasicDicElement] = []
+        self._dic_keys: set = set()  # 已载入的(src, dst, note)，用于去重
+        self._matcher: CAhoCorasick = None  # 词条的多模式匹配器
+        self._word_positions: List[List[int]] = []  # 匹配器中每个词对应的词条位置
+        self._always_positions: List[int] = []  # 每批都要判断的词条位置（^^开头或空词）
+        self._removal_positions: set = set()  # 查找词是前一条查找词子串的词条位置
+        self._prompt_cache: dict = {}  # (type, 命中词条位置) -> 术语表
         for dic_path in dic_list:
             self.load_dic(dic_path)  # 加载字典
     
@@ -335,6 +404,70 @@ class CGptDict:
         按字典search_word的长度重排序
         """
         self._dic_list.sort(key=lambda x: len(x.search_word), reverse=True)
+        self._matcher = None
+
+    def _build_matcher(self):
+        """
+        把所有词条编译进 Aho-Corasick 自动机，并清空术语表缓存
+        """
+        self._matcher = CAhoCorasick(dic.search_word for dic in self._dic_list)
+        word_index = {word: i for i, word in enumerate(self._matcher.words)}
+        self._word_positions = [[] for _ in self._matcher.words]
+        self._always_positions = []
+        self._removal_positions = set()
+        for i, dic in enumerate(self._dic_list):
+            if dic.startswith_flag or dic.search_word == "":
+                self._always_positions.append(i)
+            if dic.search_word != "":
+                self._word_positions[word_index[dic.search_word]].append(i)
+            if i > 0 and dic.search_word in self._dic_list[i - 1].search_word:
+                self._removal_positions.add(i)
+        self._prompt_cache = {}
+
+    def _get_candidates(self, input_text: str, start: int, removal: bool) -> List[int]:
+        """
+        返回从 start 开始需要判断的词条位置（升序）：
+        文本中出现的词条、^^开头的词条，以及 removal 时前一条出现在文本中的"子串词条"
+        """
+        candidates = set(self._always_positions[bisect_left(self._always_positions, start) :])
+        for word_id in self._matcher.find_all(input_text):
+            for i in self._word_positions[word_id]:
+                if i >= start:
+                    candidates.add(i)
+                if removal and i + 1 >= start and i + 1 in self._removal_positions:
+                    candidates.add(i + 1)
+        return sorted(candidates)
+
+    def _find_hits(self, input_text: str, type: str) -> tuple:
+        """
+        按词条顺序找出本批命中的词条位置。
+        gpt/sakura：查找词是前一条查找词的子串时，先从文本中去掉前一条查找词再判断；
+        tsv：每命中一条就从文本中去掉它的查找词。
+        只遍历可能命中的词条，文本被修改后重新扫描剩下的词条。
+        """
+        removal = type != "tsv"
+        hits = []
+        candidates = self._get_candidates(input_text, 0, removal)
+        k = 0
+        while k < len(candidates):
+            i = candidates[k]
+            k += 1
+            dic = self._dic_list[i]
+            if removal and i in self._removal_positions:
+                new_text = input_text.replace(self._dic_list[i - 1].search_word, "")
+                if new_text != input_text:
+                    input_text = new_text
+                    candidates = self._get_candidates(input_text, i + 1, removal)
+                    k = 0
+            if dic.startswith_flag or dic.search_word in input_text:
+                hits.append(i)
+                if not removal:
+                    new_text = input_text.replace(dic.search_word, "")
+                    if new_text != input_text:
+                        input_text = new_text
+                        candidates = self._get_candidates(input_text, i + 1, removal)
+                        k = 0
+        return tuple(hits)
 
     def load_dic(self, dic_path: str):
         """加载一个字典txt到这个对象的内存"""
@@ -349,6 +482,7 @@ class CGptDict:
         dic_name = path.basename(dic_path)
         dic_name = path.splitext(dic_name)[0]
         normalDic_count = 0
+        self._matcher = None
 
         for line in dic_lines:
             if line.startswith("\n"):
@@ -373,15 +507,11 @@ class CGptDict:
             else:
                 note = ""
 
-            redundant_flag = False
-            for d in self._dic_list:
-                if d.search_word == search_word and d.replace_word == replace_word:
-                    if d.note and d.note == note:
-                        LOGGER.warning(f"重复的GPT字典词条 {search_word} -> {replace_word} 已忽略")
-                        redundant_flag = True
-                        break
-            if redundant_flag:
+            dic_key = (search_word, replace_word, note)
+            if note and dic_key in self._dic_keys:
+                LOGGER.warning(f"重复的GPT字典词条 {search_word} -> {replace_word} 已忽略")
                 continue
+            self._dic_keys.add(dic_key)
 
             dic = CBasicDicElement(search_word, replace_word, dic_name=dic_name)
             dic.note = note
@@ -392,20 +522,24 @@ class CGptDict:
         )
 
     def gen_prompt(self, trans_list: CTransList, type="gpt"):
-        promt = ""
+        if self._matcher is None:
+            self._build_matcher()
         input_text = "\n".join(
             [f"{tran.speaker}:{tran.post_jp}" for tran in trans_list]
         )
+        hits = self._find_hits(input_text, type)
+        cache_key = (type, hits)
+        if cache_key in self._prompt_cache:
+            return self._prompt_cache[cache_key]
+
+        promt = ""
         if type == "gpt":
-            for i, dic in enumerate(self._dic_list):
-                prev_dic = self._dic_list[i - 1] if i > 0 else None
-                if prev_dic and dic.search_word in prev_dic.search_word:
-                    input_text = input_text.replace(prev_dic.search_word, "")
-                if dic.startswith_flag or dic.search_word in input_text:
-                    promt += f"| {dic.search_word} | {dic.replace_word} |"
-                    if dic.note != "":
-                        promt += f" {dic.note}"
-                    promt += " |\n"
+            for i in hits:
+                dic = self._dic_list[i]
+                promt += f"| {dic.search_word} | {dic.replace_word} |"
+                if dic.note != "":
+                    promt += f" {dic.note}"
+                promt += " |\n"
 
             if promt != "":
                 promt = (
@@ -413,33 +547,50 @@ class CGptDict:
                     + promt
                 )
         elif type == "sakura":
-            for i, dic in enumerate(self._dic_list):
-                prev_dic = self._dic_list[i - 1] if i > 0 else None
-                if prev_dic and dic.search_word in prev_dic.search_word:
-                    input_text = input_text.replace(prev_dic.search_word, "")
-                if dic.startswith_flag or dic.search_word in input_text:
-                    promt += f"{dic.search_word}->{dic.replace_word}"
-                    if dic.note != "":
-                        promt += f" #{dic.note}"
-                    promt += "\n"
+            for i in hits:
+                dic = self._dic_list[i]
+                promt += f"{dic.search_word}->{dic.replace_word}"
+                if dic.note != "":
+                    promt += f" #{dic.note}"
+                promt += "\n"
         elif type == "tsv":
-            for i, dic in enumerate(self._dic_list):
-                if dic.startswith_flag or dic.search_word in input_text:
-                    promt += f"{dic.search_word}\t{dic.replace_word}"
-                    input_text = input_text.replace(dic.search_word, "")
-                    if dic.note!= "":
-                        promt += f"\t{dic.note}"
-                    promt += "\n"
+            for i in hits:
+                dic = self._dic_list[i]
+                promt += f"{dic.search_word}\t{dic.replace_word}"
+                if dic.note!= "":
+                    promt += f"\t{dic.note}"
+                promt += "\n"
             if promt!= "":
                 promt = f"SRC\tDST\tNOTE\n{promt}"
+
+        if len(self._prompt_cache) >= self.PROMPT_CACHE_SIZE:
+            self._prompt_cache.clear()
+        self._prompt_cache[cache_key] = promt
         return promt
 
     def check_dic_use(self, find_from_str: str, tran: CSentense):
-        problem_list = []
-        for dic in self._dic_list:
-            if dic.search_word not in tran.post_jp:
-                continue
+        return self.check_dic_use_text(find_from_str, tran.post_jp)
+
+    def check_dic_use_text(self, find_from_str: str, post_jp: str) -> str:
+        """
+        检查 post_jp 中出现的词条在译文 find_from_str 中是否按字典翻译
+        """
+        if self._matcher is None:
+            self._build_matcher()
+        # 只检查原文中出现的词条，按字典顺序
+        positions = [
+            i
+            for word_id in self._matcher.find_all(post_jp)
+            for i in self._word_positions[word_id]
+        ]
+        positions.extend(
+            i for i in self._always_positions if self._dic_list[i].search_word == ""
+        )
+        positions.sort()
 
+        problem_list = []
+        for i in positions:
+            dic = self._dic_list[i]
             replace_word_list = (
                 dic.replace_word.split("/")
                 if "/" in dic.replace_word
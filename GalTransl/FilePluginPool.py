@@ -0,0 +1,116 @@
+"""
+在进程池中调用文件插件的 load_file/save_file
+"""
+
+import importlib.util
+import inspect
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os import cpu_count
+from typing import Any, Callable, List, Optional
+from GalTransl import LOGGER
+
+# 子进程中的文件插件实例，由进程池的 initializer 设置
+_worker_plugin = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+# 使用进程池的文件插件（主进程中的实例）
+_pool_plugin = None
+
+
+def _init_worker(module_path: str, class_name: str, state: dict) -> None:
+    """
+    按插件文件路径重新导入插件类，用 gtp_init 之后的实例属性恢复插件实例，不再调用 gtp_init
+    """
+    global _worker_plugin
+    spec = importlib.util.spec_from_file_location(
+        f"gt_file_plugin_{class_name}", module_path
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    plugin_class = getattr(module, class_name)
+    _worker_plugin = plugin_class.__new__(plugin_class)
+    _worker_plugin.__dict__.update(state)
+
+
+def _load_in_worker(file_path: str) -> list:
+    return _worker_plugin.load_file(file_path)
+
+
+def _save_in_worker(file_path: str, transl_json: list) -> None:
+    _worker_plugin.save_file(file_path, transl_json)
+
+
+def init_file_plugin_pool(fPlugins: list, file_count: int) -> None:
+    """
+    文件插件声明了 process_safe 且有多个文件时，创建读取/保存文件用的进程池
+    """
+    global _process_pool, _pool_plugin
+    shutdown_file_plugin_pool()
+    plugins = [plugin for plugin in fPlugins if not isinstance(plugin, str)]
+    if len(plugins) != 1 or file_count < 2:
+        return
+    plugin_object = plugins[0].plugin_object
+    if not getattr(plugin_object, "process_safe", False):
+        return
+    try:
+        state = plugin_object.__dict__
+        pickle.dumps(state)
+        _process_pool = ProcessPoolExecutor(
+            max_workers=min(cpu_count() or 1, file_count),
+            initializer=_init_worker,
+            initargs=(inspect.getfile(type(plugin_object)), type(plugin_object).__name__, state),
+        )
+    except Exception as e:
+        LOGGER.debug(f"无法为文件插件 {plugins[0].name} 创建进程池，改为在当前进程中读写: {e}")
+        _process_pool = None
+        return
+    _pool_plugin = plugin_object
+    LOGGER.debug(f"文件插件 {plugins[0].name} 使用进程池读写文件")
+
+
+def _run_in_pool(plugin_object, func: Callable, *args) -> Any:
+    """
+    插件使用进程池时在子进程中执行，进程池不可用时退回当前进程。返回 (是否已执行, 结果)
+    """
+    pool = _process_pool
+    if pool is None or plugin_object is not _pool_plugin:
+        return False, None
+    try:
+        return True, pool.submit(func, *args).result()
+    except BrokenProcessPool as e:
+        LOGGER.warning(f"文件插件进程池不可用，改为在当前进程中读写: {e}")
+        shutdown_file_plugin_pool()
+        return False, None
+
+
+def plugin_load_file(plugin, file_path: str) -> List:
+    done, result = _run_in_pool(plugin.plugin_object, _load_in_worker, file_path)
+    if done:
+        return result
+    return plugin.plugin_object.load_file(file_path)
+
+
+def plugin_save_func(plugin) -> Callable[[str, list], None]:
+    """
+    返回插件的保存函数，插件使用进程池时在子进程中保存
+    """
+    plugin_object = plugin.plugin_object
+
+    def save_file(file_path: str, transl_json: list) -> None:
+        done, _ = _run_in_pool(plugin_object, _save_in_worker, file_path, transl_json)
+        if not done:
+            plugin_object.save_file(file_path, transl_json)
+
+    return save_file
+
+
+def shutdown_file_plugin_pool() -> None:
+    """
+    关闭文件插件的进程池，在一次翻译任务结束时调用
+    """
+    global _process_pool, _pool_plugin
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True)
+        _process_pool = None
+    _pool_plugin = None
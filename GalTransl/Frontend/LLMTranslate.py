@@ -1,24 +1,39 @@
-from typing import List, Dict, Any, Optional, Union, Tuple
+from typing import List, Dict, Any, Optional, Union, Tuple, Callable, Awaitable
+from copy import copy
 from os import makedirs, cpu_count, sep as os_sep
-from os.path import join as joinpath, exists as isPathExists, dirname
+from os.path import join as joinpath, exists as isPathExists, dirname, getsize
 from alive_progress import alive_bar
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from time import time
 import asyncio
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from GalTransl import LOGGER
 from GalTransl.i18n import get_text, GT_LANG
 from GalTransl.Cache import get_transCache_from_json
+from GalTransl.CSentense import CTransList
 
 from GalTransl.ConfigHelper import initDictList, CProjectConfig
 from GalTransl.Dictionary import CGptDict, CNormalDic
-from GalTransl.Problem import find_problems
+from GalTransl.Problem import find_problems_async, shutdown_problem_pool
+from GalTransl.FilePluginPool import (
+    init_file_plugin_pool,
+    shutdown_file_plugin_pool,
+    plugin_load_file,
+    plugin_save_func,
+)
 from GalTransl.Cache import save_transCache_to_json
-from GalTransl.Name import load_name_table, dump_name_table_from_chunks
+from GalTransl.Name import (
+    load_name_table,
+    dump_name_table_from_chunks,
+    fill_name_table_from_dicts,
+)
 from GalTransl.CSerialize import update_json_with_transList, save_json
 from GalTransl.Dictionary import CNormalDic, CGptDict
 from GalTransl.ConfigHelper import CProjectConfig, initDictList
 from GalTransl.Utils import get_file_list
+from GalTransl.TranslMemory import init_transl_memory
+from GalTransl.Concurrency import CAdaptiveLimiter, CHedgePolicy
 from GalTransl.CSplitter import (
     SplitChunkMetadata,
     DictionaryCombiner,
@@ -27,24 +42,20 @@ from GalTransl.CSplitter import (
 
 
 async def update_progress_title(
-    bar, semaphore, workersPerProject: int, projectConfig: CProjectConfig
+    bar, limiter: CAdaptiveLimiter, workersPerProject: int, projectConfig: CProjectConfig
 ):
-    """异步任务，用于动态更新 alive_bar 的标题以显示活动工作线程数。"""
+    """异步任务，用于动态更新 alive_bar 的标题以显示活动请求数和当前并发上限。"""
     base_title = "翻译进度"
     while True:
         try:
-            # 计算当前活动的任务数
-            # semaphore.acquire() 会减少 _value，semaphore.release() 会增加 _value
-            # 因此，活动任务数 = 总容量 - 当前可用容量
-            active_workers = workersPerProject - semaphore._value
-            # 确保 active_workers 不会是负数（以防万一）
-            active_workers = max(0, active_workers)
+            # 计算当前正在进行的请求数
+            active_workers = max(0, limiter.in_flight)
             if active_workers == 0:
                 projectConfig.active_workers = workersPerProject
             else:
                 projectConfig.active_workers = active_workers
             # 更新标题
-            new_title = f"{base_title} [活跃任务: {active_workers}/{workersPerProject}]"
+            new_title = f"{base_title} [活跃任务: {active_workers}/{limiter.current_limit}]"
             bar.title(new_title)
 
             # 每隔一段时间更新一次，避免过于频繁
@@ -73,7 +84,17 @@ async def doLLMTranslate(
     gpt_dic_list = projectConfig.getDictCfgSection()["gpt.dict"]
     default_dic_dir = projectConfig.getDictCfgSection()["defaultDictFolder"]
     workersPerProject = projectConfig.getKey("workersPerProject") or 1
-    semaphore = asyncio.Semaphore(workersPerProject)
+    # 所有worker共享的并发控制，自适应时遇到限流/超时自动降低同时进行的请求数
+    if projectConfig.getKey("adaptiveConcurrency", True):
+        limiter = CAdaptiveLimiter(workersPerProject)
+    else:
+        limiter = CAdaptiveLimiter(workersPerProject, min_limit=workersPerProject)
+    projectConfig.limiter = limiter
+    # 对冲请求：请求超过 p95 延迟时再发一个相同的请求，取先完成的一个
+    if projectConfig.getKey("hedgeRequests", False):
+        projectConfig.hedger = CHedgePolicy(
+            budget=float(projectConfig.getKey("hedgeBudget", 0.1))
+        )
     fPlugins = projectConfig.fPlugins
     tPlugins = projectConfig.tPlugins
     eng_type = projectConfig.select_translator
@@ -106,29 +127,57 @@ async def doLLMTranslate(
 
     file_list.sort(key=natural_sort_key)
 
+    soryBy = projectConfig.getKey("sortBy", "name")
+    name_replaceDict_path_xlsx = joinpath(
+        projectConfig.getProjectDir(), "name替换表.xlsx"
+    )
+    name_replaceDict_path_csv = joinpath(
+        projectConfig.getProjectDir(), "name替换表.csv"
+    )
+    # 边读取边翻译：不需要预先扫描所有句子时，文件在worker有空时才读取和分割，翻译完即释放
+    stream_files = (
+        projectConfig.getKey("streamFiles", False)
+        and soryBy in ["name", "size"]
+        and eng_type != "GenDic"
+        and "dump-name" not in eng_type
+        and (
+            isPathExists(name_replaceDict_path_csv)
+            or isPathExists(name_replaceDict_path_xlsx)
+        )
+    )
+
+    # 声明了 process_safe 的文件插件在进程池中读取和保存文件
+    init_file_plugin_pool(fPlugins, len(file_list))
+
     all_jsons = []
-    # 读取所有文件获得total_chunks列表
-    with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
-        future_to_file = {
-            executor.submit(fplugins_load_file, file_path, fPlugins): file_path
-            for file_path in file_list
-        }
-        for future in as_completed(future_to_file):
-            file_path = future_to_file[future]
-            try:
-                json_list, save_func = future.result()
-                projectConfig.file_save_funcs[file_path] = save_func
-                total_chunks.extend(input_splitter.split(json_list, file_path))
-                if eng_type == "GenDic":
-                    all_jsons.extend(json_list)
-            except Exception as exc:
-                LOGGER.error(get_text("file_processing_error", GT_LANG, file_path, exc))
+    if stream_files:
+        if soryBy == "size":
+            file_list.sort(key=getsize, reverse=True)
+    else:
+        # 读取所有文件获得total_chunks列表
+        with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
+            future_to_file = {
+                executor.submit(fplugins_load_file, file_path, fPlugins): file_path
+                for file_path in file_list
+            }
+            for future in as_completed(future_to_file):
+                file_path = future_to_file[future]
+                try:
+                    json_list, save_func = future.result()
+                    projectConfig.file_save_funcs[file_path] = save_func
+                    total_chunks.extend(input_splitter.split(json_list, file_path))
+                    if eng_type == "GenDic":
+                        all_jsons.extend(json_list)
+                except Exception as exc:
+                    LOGGER.error(get_text("file_processing_error", GT_LANG, file_path, exc))
 
     if "dump-name" in eng_type:
+        shutdown_file_plugin_pool()
         await dump_name_table_from_chunks(total_chunks, projectConfig)
         return True
 
     if eng_type == "GenDic":
+        shutdown_file_plugin_pool()
         gptapi = await init_gptapi(projectConfig)
         await gptapi.batch_translate(all_jsons)
         return True
@@ -141,7 +190,6 @@ async def doLLMTranslate(
             LOGGER.error(get_text("task_execution_failed", GT_LANG, e))
             return None
 
-    soryBy = projectConfig.getKey("sortBy", "name")
     if soryBy == "name":
         # 按文件分组chunks，保持文件内部的顺序
         file_chunks = {}
@@ -162,16 +210,13 @@ async def doLLMTranslate(
     elif soryBy == "size":
         total_chunks.sort(key=lambda x: x.chunk_size, reverse=True)
         ordered_chunks = total_chunks
+    else:
+        # work: 查完缓存后按剩余工作量排序
+        ordered_chunks = total_chunks
 
     total_lines = sum([len(chunk.trans_list) for chunk in ordered_chunks])
 
     # 初始生成name替换表
-    name_replaceDict_path_xlsx = joinpath(
-        projectConfig.getProjectDir(), "name替换表.xlsx"
-    )
-    name_replaceDict_path_csv = joinpath(
-        projectConfig.getProjectDir(), "name替换表.csv"
-    )
     name_replaceDict_firstime = False
     if not isPathExists(name_replaceDict_path_csv) and not isPathExists(
         name_replaceDict_path_xlsx
@@ -207,35 +252,93 @@ async def doLLMTranslate(
             name_replaceDict_path_xlsx, name_replaceDict_firstime,total_chunks,projectConfig
         )
 
-    # 初始化共享的 gptapi 实例
-    gptapi = await init_gptapi(projectConfig)
+    # 初始化后端实例池，每个worker独占一个 gptapi 实例
+    gptapi_pool = CBackendPool()
+    await gptapi_pool.init(projectConfig, workersPerProject)
+
+    # 载入全局翻译记忆库
+    projectConfig.translMemory = None
+    if eng_type not in ["rebuildr", "rebuilda"]:
+        projectConfig.translMemory = init_transl_memory(projectConfig)
+    if projectConfig.translMemory:
+        async with gptapi_pool.lease() as gptapi:
+            projectConfig.translMemory.set_engine(
+                eng_type, gptapi.get_model_name(), gptapi.get_prompt_version()
+            )
 
     title_update_task = None  # 初始化任务变量
     projectConfig.active_workers = 1
     with alive_bar(
-        total=total_lines, title="翻译进度", unit=" line", enrich_print=False
+        total=None if stream_files else total_lines,
+        title="翻译进度",
+        unit=" line",
+        enrich_print=False,
     ) as bar:
-        projectConfig.bar = bar
+        # 总行数未知时进度条不支持 skipped 参数
+        projectConfig.bar = (
+            (lambda count=1, skipped=False: bar(count)) if stream_files else bar
+        )
 
         # 启动后台任务来更新进度条标题
         title_update_task = asyncio.create_task(
-            update_progress_title(bar, semaphore, workersPerProject, projectConfig)
+            update_progress_title(bar, limiter, workersPerProject, projectConfig)
         )
+        # 后台保存译文，保存大文件时其他分块的请求不受影响
+        projectConfig.resultWriter = CResultWriter(projectConfig, workersPerProject)
 
         # 创建所有翻译任务
         all_tasks = []
-        for chunk in ordered_chunks:
+        if stream_files:
+            # 生产者按顺序读取、分割文件，消费者各自取分块翻译，队列满时暂停读取
+            chunk_queue = asyncio.Queue(maxsize=workersPerProject)
+            gptapi_pool.set_producing(True)
             all_tasks.append(
-                doLLMTranslSingleChunk(
-                    semaphore,
-                    split_chunk=chunk,
-                    projectConfig=projectConfig,
-                    gptapi=gptapi,  # 传递共享的 gptapi 实例
+                produce_chunks(
+                    file_list, projectConfig, chunk_queue, workersPerProject, gptapi_pool
+                )
+            )
+            for _ in range(workersPerProject):
+                all_tasks.append(
+                    consume_chunks(chunk_queue, projectConfig, gptapi_pool, run_task)
                 )
+        elif soryBy == "work":
+            # 先查所有分块的缓存，剩余工作量大的先翻译(LPT)，全部命中的分块不占用后端直接收尾
+            prepared_chunks = [
+                (chunk, prepare_chunk(chunk, projectConfig)) for chunk in ordered_chunks
+            ]
+            hit_chunks = [chunk for chunk, (_, unhit) in prepared_chunks if not unhit]
+            prepared_chunks = [item for item in prepared_chunks if item[1][1]]
+            prepared_chunks.sort(
+                key=lambda item: estimate_chunk_work(item[1][1]), reverse=True
             )
+            gptapi_pool.add_pending(len(prepared_chunks))
+            for chunk, prepared in prepared_chunks:
+                all_tasks.append(
+                    doLLMTranslSingleChunk(
+                        split_chunk=chunk,
+                        projectConfig=projectConfig,
+                        gptapi_pool=gptapi_pool,
+                        prepared=prepared,
+                    )
+                )
+            for chunk in hit_chunks:
+                all_tasks.append(finish_chunk(chunk, projectConfig))
+            LOGGER.debug(
+                f"需翻译{len(prepared_chunks)}个分块，{len(hit_chunks)}个分块已全部命中缓存"
+            )
+        else:
+            gptapi_pool.add_pending(len(ordered_chunks))
+            for chunk in ordered_chunks:
+                all_tasks.append(
+                    doLLMTranslSingleChunk(
+                        split_chunk=chunk,
+                        projectConfig=projectConfig,
+                        gptapi_pool=gptapi_pool,
+                    )
+                )
 
         try:
-            # 使用信号量控制并发数量，同时启动所有翻译任务
+            # 同时启动所有翻译任务，后端池控制同时翻译的分块数，limiter控制同时进行的请求数
             await asyncio.gather(*[run_task(task) for task in all_tasks])
         finally:
             # 确保无论 gather 成功还是失败，都取消标题更新任务
@@ -246,108 +349,253 @@ async def doLLMTranslate(
                     await title_update_task
                 except asyncio.CancelledError:
                     pass  # 捕获预期的取消错误
+            # 等待队列中的文件保存完
+            await projectConfig.resultWriter.close()
+            projectConfig.resultWriter = None
+            gptapi_pool.close()
+            shutdown_problem_pool()
+            shutdown_file_plugin_pool()
+            projectConfig.limiter = None
+            if projectConfig.hedger:
+                LOGGER.debug(
+                    f"[对冲请求] 共{projectConfig.hedger.requests}次请求，"
+                    f"对冲{projectConfig.hedger.hedges}次，对冲获胜{projectConfig.hedger.hedge_wins}次"
+                )
+                projectConfig.hedger = None
+            if projectConfig.translMemory:
+                projectConfig.translMemory.close()
+
+
+async def produce_chunks(
+    file_list: List[str],
+    projectConfig: CProjectConfig,
+    chunk_queue: asyncio.Queue,
+    num_consumers: int,
+    gptapi_pool: "CBackendPool",
+) -> None:
+    """
+    依次读取并分割文件放入队列，读取当前文件时预读下一个文件。
+    全部放完后为每个消费者放入一个 None 表示结束。
+    放入的分块计入后端池的待翻译分块，读完前不允许工作窃取。
+    """
+    loop = asyncio.get_running_loop()
+    fPlugins = projectConfig.fPlugins
+    input_splitter = projectConfig.input_splitter
+
+    def load(file_path):
+        return loop.run_in_executor(None, fplugins_load_file, file_path, fPlugins)
+
+    try:
+        next_load = load(file_list[0]) if file_list else None
+        for i, file_path in enumerate(file_list):
+            current_load = next_load
+            next_load = load(file_list[i + 1]) if i + 1 < len(file_list) else None
+            try:
+                json_list, save_func = await current_load
+            except Exception as exc:
+                LOGGER.error(get_text("file_processing_error", GT_LANG, file_path, exc))
+                continue
+            projectConfig.file_save_funcs[file_path] = save_func
+            chunks = input_splitter.split(json_list, file_path)
+            fill_name_table_from_dicts(
+                projectConfig.name_replaceDict, chunks, projectConfig, verbose=False
+            )
+            for chunk in chunks:
+                gptapi_pool.add_pending()
+                await chunk_queue.put(chunk)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        LOGGER.error(get_text("task_execution_failed", GT_LANG, e))
+    gptapi_pool.set_producing(False)
+    for _ in range(num_consumers):
+        await chunk_queue.put(None)
+
+
+async def consume_chunks(
+    chunk_queue: asyncio.Queue,
+    projectConfig: CProjectConfig,
+    gptapi_pool: "CBackendPool",
+    run_task: Callable[[Awaitable], Awaitable],
+) -> None:
+    while (chunk := await chunk_queue.get()) is not None:
+        await run_task(
+            doLLMTranslSingleChunk(
+                split_chunk=chunk,
+                projectConfig=projectConfig,
+                gptapi_pool=gptapi_pool,
+            )
+        )
+
+
+def get_chunk_file_name(split_chunk: SplitChunkMetadata, projectConfig: CProjectConfig) -> str:
+    input_dir = projectConfig.getInputPath()
+    return (
+        split_chunk.file_path.replace(input_dir, "").lstrip(os_sep).replace(os_sep, "-}")
+    )  # 多级文件夹
+
+
+def get_chunk_cache_path(split_chunk: SplitChunkMetadata, projectConfig: CProjectConfig) -> str:
+    return joinpath(
+        projectConfig.getCachePath(),
+        get_chunk_file_name(split_chunk, projectConfig)
+        + (f"_{split_chunk.chunk_index}" if split_chunk.total_chunks > 1 else ""),
+    )
+
+
+def prepare_chunk(
+    split_chunk: SplitChunkMetadata, projectConfig: CProjectConfig
+) -> Tuple[CTransList, CTransList]:
+    """
+    分块的翻译前处理，并查询缓存和翻译记忆库。
+
+    Returns:
+        Tuple[CTransList, CTransList]: 命中的句子和需要翻译的句子。
+    """
+    pre_dic = projectConfig.pre_dic
+    tPlugins = projectConfig.tPlugins
+    eng_type = projectConfig.select_translator
+
+    # 翻译前处理
+    for tran in split_chunk.trans_list:
+        for plugin in tPlugins:
+            try:
+                tran = plugin.plugin_object.before_src_processed(tran)
+            except Exception as e:
+                LOGGER.error(
+                    get_text("plugin_execution_failed", GT_LANG, plugin.name, e)
+                )
+
+        if projectConfig.getFilePlugin() in [
+            "file_galtransl_json",
+            "file_mtbench_chrf",
+        ]:
+            tran.analyse_dialogue()
+
+        tran.post_jp = pre_dic.do_replace(tran.post_jp, tran)
+
+        if projectConfig.getDictCfgSection("usePreDictInName"):
+            if isinstance(tran.speaker, str) and isinstance(tran._speaker, str):
+                tran.speaker = pre_dic.do_replace(tran.speaker, tran)
+        for plugin in tPlugins:
+            try:
+                tran = plugin.plugin_object.after_src_processed(tran)
+            except Exception as e:
+                LOGGER.error(
+                    get_text("plugin_execution_failed", GT_LANG, plugin.name, e)
+                )
+
+    translist_hit, translist_unhit = get_transCache_from_json(
+        split_chunk.trans_list,
+        get_chunk_cache_path(split_chunk, projectConfig),
+        retry_failed=projectConfig.getKey("retranslFail"),
+        proofread=False,
+        retran_key=projectConfig.getKey("retranslKey"),
+        eng_type=eng_type,
+    )
+
+    # 缓存未命中的句子先查翻译记忆库
+    if projectConfig.translMemory and len(translist_unhit) > 0:
+        translist_mem, translist_unhit = projectConfig.translMemory.fill(
+            translist_unhit, retran_key=projectConfig.getKey("retranslKey")
+        )
+        translist_hit.extend(translist_mem)
+
+    if len(translist_hit) > 0:
+        projectConfig.bar(len(translist_hit), skipped=True) # 更新进度条
+    return translist_hit, translist_unhit
+
+
+def estimate_chunk_work(translist_unhit: CTransList) -> int:
+    """
+    估计分块剩余的翻译量：未命中句子的原文总长度
+    """
+    return sum(len(tran.post_jp) for tran in translist_unhit)
 
 
 async def doLLMTranslSingleChunk(
-    semaphore: asyncio.Semaphore,
     split_chunk: SplitChunkMetadata,
     projectConfig: CProjectConfig,
-    gptapi: Any,  # 添加 gptapi 参数
+    gptapi_pool: "CBackendPool",
+    prepared: Optional[Tuple[CTransList, CTransList]] = None,
 ) -> Tuple[bool, List, List, str, SplitChunkMetadata]:
+    """
+    翻译一个分块。prepared 为 prepare_chunk 的结果，已提前查过缓存时传入。
+    调用前需用 gptapi_pool.add_pending 排入该分块。
+    """
+    # 取得准入名额后才打印和查缓存，同时只处理不超过后端实例数的分块
+    async with gptapi_pool.admit():
+        await _translate_single_chunk(split_chunk, projectConfig, gptapi_pool, prepared)
 
-    async with semaphore:
-        print(f"线程 {semaphore._value} 开始翻译 {split_chunk.file_path}")
-        st = time()
-        proj_dir = projectConfig.getProjectDir()
-        input_dir = projectConfig.getInputPath()
-        output_dir = projectConfig.getOutputPath()
-        cache_dir = projectConfig.getCachePath()
-        pre_dic = projectConfig.pre_dic
-        post_dic = projectConfig.post_dic
-        gpt_dic = projectConfig.gpt_dic
-        file_path = split_chunk.file_path
-        file_name = (
-            file_path.replace(input_dir, "").lstrip(os_sep).replace(os_sep, "-}")
-        )  # 多级文件夹
-        tPlugins = projectConfig.tPlugins
-        eng_type = projectConfig.select_translator
-
-        total_splits = split_chunk.total_chunks
-        file_index = split_chunk.chunk_index
-        input_file_path = file_path
-        output_file_path = input_file_path.replace(input_dir, output_dir)
-
-        cache_file_path = joinpath(
-            cache_dir,
-            file_name + (f"_{file_index}" if total_splits > 1 else ""),
-        )
-        part_info = f" (part {file_index+1}/{total_splits})" if total_splits > 1 else ""
-        # LOGGER.info(f"开始翻译 {file_name}{part_info}, 引擎类型: {eng_type}")
-
-        LOGGER.debug(f"文件 {file_name} 分块 {file_index+1}/{total_splits}:")
-        LOGGER.debug(f"  开始索引: {split_chunk.start_index}")
-        LOGGER.debug(f"  结束索引: {split_chunk.end_index}")
-        LOGGER.debug(f"  非交叉大小: {split_chunk.chunk_non_cross_size}")
-        LOGGER.debug(f"  实际大小: {split_chunk.chunk_size}")
-        LOGGER.debug(f"  交叉数量: {split_chunk.cross_num}")
-
-        # 翻译前处理
-        for tran in split_chunk.trans_list:
-            for plugin in tPlugins:
-                try:
-                    tran = plugin.plugin_object.before_src_processed(tran)
-                except Exception as e:
-                    LOGGER.error(
-                        get_text("plugin_execution_failed", GT_LANG, plugin.name, e)
-                    )
 
-            if projectConfig.getFilePlugin() in [
-                "file_galtransl_json",
-                "file_mtbench_chrf",
-            ]:
-                tran.analyse_dialogue()
+async def _translate_single_chunk(
+    split_chunk: SplitChunkMetadata,
+    projectConfig: CProjectConfig,
+    gptapi_pool: "CBackendPool",
+    prepared: Optional[Tuple[CTransList, CTransList]],
+) -> None:
+    # 从准入到租用后端实例之间没有 await，其他分块的工作窃取不会抢走本分块要用的实例
+    print(f"开始翻译 {split_chunk.file_path}")
+    st = time()
+    gpt_dic = projectConfig.gpt_dic
+    file_name = get_chunk_file_name(split_chunk, projectConfig)
+    eng_type = projectConfig.select_translator
+
+    total_splits = split_chunk.total_chunks
+    file_index = split_chunk.chunk_index
+    cache_file_path = get_chunk_cache_path(split_chunk, projectConfig)
+    part_info = f" (part {file_index+1}/{total_splits})" if total_splits > 1 else ""
+    # LOGGER.info(f"开始翻译 {file_name}{part_info}, 引擎类型: {eng_type}")
 
-            tran.post_jp = pre_dic.do_replace(tran.post_jp, tran)
+    LOGGER.debug(f"文件 {file_name} 分块 {file_index+1}/{total_splits}:")
+    LOGGER.debug(f"  开始索引: {split_chunk.start_index}")
+    LOGGER.debug(f"  结束索引: {split_chunk.end_index}")
+    LOGGER.debug(f"  非交叉大小: {split_chunk.chunk_non_cross_size}")
+    LOGGER.debug(f"  实际大小: {split_chunk.chunk_size}")
+    LOGGER.debug(f"  交叉数量: {split_chunk.cross_num}")
 
-            if projectConfig.getDictCfgSection("usePreDictInName"):
-                if isinstance(tran.speaker, str) and isinstance(tran._speaker, str):
-                    tran.speaker = pre_dic.do_replace(tran.speaker, tran)
-            for plugin in tPlugins:
-                try:
-                    tran = plugin.plugin_object.after_src_processed(tran)
-                except Exception as e:
-                    LOGGER.error(
-                        get_text("plugin_execution_failed", GT_LANG, plugin.name, e)
-                    )
+    if prepared is None:
+        prepared = prepare_chunk(split_chunk, projectConfig)
+    translist_hit, translist_unhit = prepared
 
-        translist_hit, translist_unhit = get_transCache_from_json(
-            split_chunk.trans_list,
-            cache_file_path,
-            retry_failed=projectConfig.getKey("retranslFail"),
-            proofread=False,
-            retran_key=projectConfig.getKey("retranslKey"),
-            eng_type=eng_type,
-        )
+    if len(translist_unhit) > 0:
+        num_per_request = projectConfig.getKey("gpt.numPerRequestTranslate")
 
-        if len(translist_hit) > 0:
-            projectConfig.bar(len(translist_hit), skipped=True) # 更新进度条
+        async def translate_unhit(gptapi, translist_unhit: CTransList):
+            gptapi.split_tail = tail_splitter
+            try:
+                await gptapi.batch_translate(
+                    file_name,
+                    cache_file_path,
+                    split_chunk.trans_list,
+                    num_per_request,
+                    retry_failed=projectConfig.getKey("retranslFail"),
+                    gpt_dic=gpt_dic,
+                    retran_key=projectConfig.getKey("retranslKey"),
+                    translist_hit=translist_hit,
+                    translist_unhit=translist_unhit,
+                )
+            finally:
+                gptapi.split_tail = None
+
+        tail_splitter = None
+        if projectConfig.getKey("workStealing", True):
+            tail_splitter = CTailSplitter(
+                gptapi_pool,
+                translate_unhit,
+                min_lines=num_per_request,
+                cross_num=split_chunk.cross_num,
+            )
 
-        if len(translist_unhit) > 0:
+        async with gptapi_pool.lease() as gptapi:
             # 执行翻译
-            await gptapi.batch_translate(
-                file_name,
-                cache_file_path,
-                split_chunk.trans_list,
-                projectConfig.getKey("gpt.numPerRequestTranslate"),
-                retry_failed=projectConfig.getKey("retranslFail"),
-                gpt_dic=gpt_dic,
-                retran_key=projectConfig.getKey("retranslKey"),
-                translist_hit=translist_hit,
-                translist_unhit=translist_unhit,
-            )
+            await translate_unhit(gptapi, translist_unhit)
 
             # 执行校对（如果启用）
             if projectConfig.getKey("gpt.enableProofRead"):
+                if tail_splitter:
+                    # 校对前等待拆出的子任务完成
+                    await tail_splitter.wait()
                 if "gpt4" in eng_type:
                     await gptapi.batch_translate(
                         file_name,
@@ -361,69 +609,98 @@ async def doLLMTranslSingleChunk(
                     )
                 else:
                     LOGGER.warning("当前引擎不支持校对，跳过校对步骤")
-            gptapi.clean_up()
+        # 归还实例后再等待，空出的实例可以继续接拆出的子任务
+        if tail_splitter:
+            await tail_splitter.wait()
+
+    et = time()
+    LOGGER.info(
+        get_text(
+            "file_translation_completed", GT_LANG, file_name, part_info, et - st
+        )
+    )
+    await finish_chunk(split_chunk, projectConfig)
 
-        # 翻译后处理
-        for tran in split_chunk.trans_list:
-            for plugin in tPlugins:
-                try:
-                    tran = plugin.plugin_object.before_dst_processed(tran)
-                except Exception as e:
-                    LOGGER.error(f" 插件 {plugin.name} 执行失败: {e}")
 
-            tran.recover_dialogue_symbol()
-            tran.post_zh = post_dic.do_replace(tran.post_zh, tran)
+async def finish_chunk(split_chunk: SplitChunkMetadata, projectConfig: CProjectConfig):
+    """
+    分块的翻译后处理，文件的所有分块都完成后合并保存
+    """
+    post_dic = projectConfig.post_dic
+    tPlugins = projectConfig.tPlugins
 
-            for plugin in tPlugins:
-                try:
-                    tran = plugin.plugin_object.after_dst_processed(tran)
-                except Exception as e:
-                    LOGGER.error(
-                        get_text("plugin_execution_failed", GT_LANG, plugin.name, e)
-                    )
+    # 翻译后处理
+    for tran in split_chunk.trans_list:
+        for plugin in tPlugins:
+            try:
+                tran = plugin.plugin_object.before_dst_processed(tran)
+            except Exception as e:
+                LOGGER.error(f" 插件 {plugin.name} 执行失败: {e}")
 
-        et = time()
-        LOGGER.info(
+        tran.recover_dialogue_symbol()
+        tran.post_zh = post_dic.do_replace(tran.post_zh, tran)
+
+        for plugin in tPlugins:
+            try:
+                tran = plugin.plugin_object.after_dst_processed(tran)
+            except Exception as e:
+                LOGGER.error(
+                    get_text("plugin_execution_failed", GT_LANG, plugin.name, e)
+                )
+
+    split_chunk.update_file_finished_chunk()
+    # 检查是否该文件的所有chunk都翻译完成
+    if split_chunk.is_file_finished():
+        LOGGER.debug(
             get_text(
-                "file_translation_completed", GT_LANG, file_name, part_info, et - st
+                "file_chunks_completed",
+                GT_LANG,
+                get_chunk_file_name(split_chunk, projectConfig),
             )
         )
-
-        split_chunk.update_file_finished_chunk()
-        # 检查是否该文件的所有chunk都翻译完成
-        if split_chunk.is_file_finished():
-            LOGGER.debug(get_text("file_chunks_completed", GT_LANG, file_name))
-            await postprocess_results(
-                split_chunk.get_file_finished_chunks(), projectConfig
-            )
+        resultChunks = split_chunk.get_file_finished_chunks()
+        # 分块已取出交给写入队列，不再保留在完成记录中
+        split_chunk.drop_file_finished_chunks()
+        if projectConfig.resultWriter:
+            await projectConfig.resultWriter.submit(resultChunks)
+        else:
+            await postprocess_results(resultChunks, projectConfig)
 
 
 async def postprocess_results(
     resultChunks: List[SplitChunkMetadata],
     projectConfig: CProjectConfig,
+    executor: Optional[ThreadPoolExecutor] = None,
 ):
+    """
+    找问题，然后在 executor 中更新翻译记忆库、保存缓存和译文，不阻塞事件循环
+    """
+    eng_type = projectConfig.select_translator
+    gpt_dic = projectConfig.gpt_dic
 
-    proj_dir = projectConfig.getProjectDir()
+    # 对每个分块执行错误检查
+    if eng_type != "rebuildr":
+        for chunk in resultChunks:
+            await find_problems_async(chunk.trans_list, projectConfig, gpt_dic)
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, save_results, resultChunks, projectConfig)
+
+
+def save_results(resultChunks: List[SplitChunkMetadata], projectConfig: CProjectConfig):
+    """
+    更新翻译记忆库，保存每个分块的缓存，合并分块并用文件插件保存译文
+    """
     input_dir = projectConfig.getInputPath()
     output_dir = projectConfig.getOutputPath()
-    cache_dir = projectConfig.getCachePath()
-    eng_type = projectConfig.select_translator
-    gpt_dic = projectConfig.gpt_dic
     name_replaceDict = projectConfig.name_replaceDict
 
-    # 对每个分块执行错误检查和缓存保存
-    for i, chunk in enumerate(resultChunks):
-        trans_list = chunk.trans_list
-        file_path = chunk.file_path
-        cache_file_path = joinpath(
-            cache_dir,
-            file_path.replace(input_dir, "").lstrip(os_sep).replace(os_sep, "-}")
-            + (f"_{chunk.chunk_index}" if chunk.total_chunks > 1 else ""),
-        )
-
-        if eng_type != "rebuildr":
-            find_problems(trans_list, projectConfig, gpt_dic)
-            save_transCache_to_json(trans_list, cache_file_path, post_save=True)
+    if projectConfig.select_translator != "rebuildr":
+        for chunk in resultChunks:
+            if projectConfig.translMemory:
+                projectConfig.translMemory.update(chunk.trans_list)
+            cache_file_path = get_chunk_cache_path(chunk, projectConfig)
+            save_transCache_to_json(chunk.trans_list, cache_file_path, post_save=True)
 
     # 使用output_combiner合并结果，即使只有一个结果
     all_trans_list, all_json_list = DictionaryCombiner.combine(resultChunks)
@@ -441,6 +718,197 @@ async def postprocess_results(
         LOGGER.info(f"已保存文件: {output_file_path}")  # 添加保存确认日志
 
 
+class CResultWriter:
+    """
+    译文的后台写入队列。文件的所有分块完成后放入有界队列，由一个写入任务依次找问题，
+    并在单独的线程中保存缓存和译文；队列满时 submit 等待，限制待保存的文件数。
+    """
+
+    def __init__(self, projectConfig: CProjectConfig, max_pending: int) -> None:
+        """
+        Args:
+            projectConfig (CProjectConfig): 项目配置。
+            max_pending (int): 最多等待保存的文件数。
+        """
+        self.projectConfig = projectConfig
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_pending))
+        # 只用一个线程，文件插件的 save_file 不会被并发调用
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, resultChunks: List[SplitChunkMetadata]) -> None:
+        await self._queue.put(resultChunks)
+
+    async def _run(self) -> None:
+        while (resultChunks := await self._queue.get()) is not None:
+            try:
+                await postprocess_results(resultChunks, self.projectConfig, self._executor)
+            except Exception as e:
+                LOGGER.error(
+                    get_text("file_processing_error", GT_LANG, resultChunks[0].file_path, e)
+                )
+
+    async def close(self) -> None:
+        """
+        等待队列中的文件全部保存完
+        """
+        if not self._task.done():
+            await self._queue.put(None)
+            await self._task
+        self._executor.shutdown(wait=True)
+
+
+class CTailSplitter:
+    """
+    工作窃取：分块翻译途中出现空闲的后端实例(且没有分块在排队)时，
+    把剩余未翻译句子的后一半拆成子任务交给空闲的实例，子任务可以继续被拆分。
+    子任务直接翻译分块中的原句子，分块的元数据和合并方式不受影响。
+    """
+
+    def __init__(
+        self,
+        gptapi_pool: "CBackendPool",
+        translate_func: Callable[[Any, CTransList], Awaitable],
+        min_lines: int,
+        cross_num: int = 0,
+    ) -> None:
+        """
+        Args:
+            gptapi_pool (CBackendPool): 后端实例池。
+            translate_func: 用给定的后端实例翻译给定的未命中句子。
+            min_lines (int): 拆分后每部分至少剩余的句数。
+            cross_num (int, optional): 子任务前面带上的交叉句数，只作为上下文，译文不保留。默认为 0。
+        """
+        self.gptapi_pool = gptapi_pool
+        self.translate_func = translate_func
+        self.min_lines = max(1, min_lines)
+        self.cross_num = cross_num
+        self._tasks: List[asyncio.Task] = []
+
+    def __call__(self, translist_unhit: CTransList, cut: int) -> None:
+        rest = len(translist_unhit) - cut
+        if rest < self.min_lines * 2:
+            return
+        gptapi = self.gptapi_pool.try_lease()
+        if gptapi is None:
+            return
+        mid = cut + rest // 2
+        tail = translist_unhit[mid:]
+        del translist_unhit[mid:]
+        # 交叉部分用副本翻译，不覆盖原worker的译文
+        cross = [copy(tran) for tran in translist_unhit[max(cut, mid - self.cross_num) : mid]]
+        LOGGER.debug(f"[工作窃取] 拆出{len(tail)}句交给空闲的worker")
+        self._tasks.append(asyncio.create_task(self._run(gptapi, cross, tail)))
+
+    async def _run(self, gptapi, cross: CTransList, tail: CTransList) -> None:
+        # 交叉部分只作为上下文，不计入进度条和翻译结果
+        gptapi.context_lines = frozenset(id(tran) for tran in cross)
+        try:
+            await self.translate_func(gptapi, cross + tail)
+        finally:
+            gptapi.context_lines = frozenset()
+            self.gptapi_pool.release(gptapi)
+
+    async def wait(self) -> None:
+        """
+        等待所有拆出的子任务(包括子任务再拆出的)完成
+        """
+        while self._tasks:
+            await self._tasks.pop(0)
+
+
+class CBackendPool:
+    """
+    翻译后端实例池。每个worker租用一个独立的后端实例，
+    分块之间不共享对话上下文、重试计数和 last_file_name。
+    """
+
+    def __init__(self) -> None:
+        self._backends: list = []
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._waiting = 0
+        # 已排入但还未开始翻译的分块数
+        self._pending = 0
+        # 还有分块未排入（边读取边翻译时文件还没读完）
+        self._producing = False
+        # 同时处理的分块数，与后端实例数相同
+        self._admission: Optional[asyncio.Semaphore] = None
+
+    async def init(self, projectConfig: CProjectConfig, size: int) -> None:
+        """
+        创建 size 个后端实例放入池中
+        """
+        for _ in range(max(1, size)):
+            gptapi = await init_gptapi(projectConfig)
+            self._backends.append(gptapi)
+            self._idle.put_nowait(gptapi)
+        self._admission = asyncio.Semaphore(len(self._backends))
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        分块准入：在打印、查缓存之前占用，同时处理的分块数不超过后端实例数。
+        与租用实例分开，全部命中缓存的分块不占用后端实例。
+        """
+        async with self._admission:
+            self.chunk_started()
+            yield
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        租用一个空闲的后端实例，用完后重置状态并归还
+        """
+        self._waiting += 1
+        try:
+            gptapi = await self._idle.get()
+        finally:
+            self._waiting -= 1
+        try:
+            yield gptapi
+        finally:
+            self.release(gptapi)
+
+    def add_pending(self, count: int = 1) -> None:
+        """
+        排入 count 个待翻译的分块，分块开始时调用 chunk_started
+        """
+        self._pending += count
+
+    def chunk_started(self) -> None:
+        """
+        分块开始处理，由 admit 调用
+        """
+        self._pending -= 1
+
+    def set_producing(self, producing: bool) -> None:
+        self._producing = producing
+
+    def try_lease(self):
+        """
+        所有分块都已开始翻译且有空闲实例时立即租用一个，否则返回 None。
+        用 release 归还。
+        """
+        if (
+            self._pending > 0
+            or self._producing
+            or self._waiting > 0
+            or self._idle.empty()
+        ):
+            return None
+        return self._idle.get_nowait()
+
+    def release(self, gptapi) -> None:
+        # 下一个分块的 batch_translate 会因文件名不同而重置会话
+        gptapi.last_file_name = ""
+        gptapi.retry_count = 0
+        self._idle.put_nowait(gptapi)
+
+    def close(self) -> None:
+        for gptapi in self._backends:
+            gptapi.clean_up()
+
+
 async def init_gptapi(
     projectConfig: CProjectConfig,
 ):
@@ -459,7 +927,7 @@ async def init_gptapi(
     """
     proxyPool = projectConfig.proxyPool
     tokenPool = projectConfig.tokenPool
-    sakuraEndpointQueue = projectConfig.endpointQueue
+    sakuraEndpointPool = projectConfig.endpointPool
     eng_type = projectConfig.select_translator
 
     match eng_type:
@@ -478,10 +946,9 @@ async def init_gptapi(
         case "sakura-009" | "sakura-v1.0" | "galtransl-v2.5" | "galtransl-v3":
             from GalTransl.Backend.SakuraTranslate import CSakuraTranslate
 
-            sakura_endpoint = await sakuraEndpointQueue.get()
-            if sakuraEndpointQueue is None:
+            if sakuraEndpointPool is None:
                 raise ValueError(f"Endpoint is required for engine type {eng_type}")
-            return CSakuraTranslate(projectConfig, eng_type, sakura_endpoint, proxyPool)
+            return CSakuraTranslate(projectConfig, eng_type, sakuraEndpointPool, proxyPool)
         case "rebuildr" | "rebuilda" | "dump-name":
             from GalTransl.Backend.RebuildTranslate import CRebuildTranslate
 
@@ -503,8 +970,8 @@ def fplugins_load_file(file_path: str, fPlugins: list) -> Tuple[List[Dict], Any]
             LOGGER.warning(f"跳过无效的插件项: {plugin}")
             continue
         try:
-            result = plugin.plugin_object.load_file(file_path)
-            save_func = plugin.plugin_object.save_file
+            result = plugin_load_file(plugin, file_path)
+            save_func = plugin_save_func(plugin)
             break
         except TypeError as e:
             LOGGER.error(
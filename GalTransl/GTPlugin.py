@@ -56,6 +56,11 @@ class GTextPlugin(IPlugin):
 
 
 class GFilePlugin(IPlugin):
+    # Set to True if load_file/save_file only read the state set up in gtp_init and that state is picklable.
+    # 设为True表示load_file/save_file只读取gtp_init中设置的实例属性，且这些属性可以pickle。
+    # 文件较多时会在进程池中并行读取和保存文件，每个子进程使用gtp_init之后实例属性的副本。
+    process_safe = False
+
     def gtp_init(self, plugin_conf: dict, project_conf: dict):
         """
         This method is called when the plugin is loaded.在插件加载时被调用。
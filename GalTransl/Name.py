@@ -1,12 +1,9 @@
 from typing import Dict, List
-import openpyxl
 from os.path import join as joinpath, splitext
 from GalTransl.CSplitter import SplitChunkMetadata
 from GalTransl import LOGGER
 from GalTransl.ConfigHelper import CProjectConfig
 import csv
-from InquirerPy import inquirer
-from InquirerPy.base.control import Choice
 import asyncio
 import sys  # Added for input
 import os
@@ -26,13 +23,6 @@ def load_name_table(
     - A dictionary containing the name table.
     """
 
-    usePostDictInName = proj_config.getDictCfgSection("usePostDictInName") or False
-    useGPTDictInName = proj_config.getDictCfgSection("useGPTDictInName") or False
-    usePreDictInName=proj_config.getDictCfgSection("usePreDictInName") or False
-    gpt_dic = proj_config.gpt_dic
-    post_dic = proj_config.post_dic
-    pre_dic=proj_config.pre_dic
-
     def _load_internal(path: str) -> tuple[Dict[str, str], List[str], bool]:
         """Internal helper to load and check the name table."""
         name_table_internal: Dict[str, str] = {}
@@ -43,6 +33,8 @@ def load_name_table(
 
         try:
             if file_extension == ".xlsx":
+                import openpyxl
+
                 workbook = openpyxl.load_workbook(path)
                 sheet = workbook.active
                 header = [cell.value for cell in sheet[1]]
@@ -149,6 +141,29 @@ def load_name_table(
                 f"'{table_base_name}' 中name翻译有缺失。程序将继续，但这些名字不会被替换。"
             )
 
+    fill_name_table_from_dicts(name_table, chunks, proj_config)
+    return name_table
+
+
+def fill_name_table_from_dicts(
+    name_table: Dict[str, str],
+    chunks: List[SplitChunkMetadata],
+    proj_config: CProjectConfig,
+    verbose: bool = True,
+) -> None:
+    """
+    按 usePreDictInName/useGPTDictInName/usePostDictInName 用字典补充 chunks 中出现的name。
+    边读取文件边翻译时，每读入一个文件调用一次。
+    """
+    usePostDictInName = proj_config.getDictCfgSection("usePostDictInName") or False
+    useGPTDictInName = proj_config.getDictCfgSection("useGPTDictInName") or False
+    usePreDictInName=proj_config.getDictCfgSection("usePreDictInName") or False
+    if not (usePreDictInName or useGPTDictInName or usePostDictInName):
+        return
+    gpt_dic = proj_config.gpt_dic
+    post_dic = proj_config.post_dic
+    pre_dic=proj_config.pre_dic
+
     name_counter = {}
     for chunk in chunks:
         for tran in chunk.trans_list:
@@ -165,7 +180,8 @@ def load_name_table(
             if pre_dic.get_dst(name)!= "":
                 name_table[name] = pre_dic.get_dst(name)
                 count += 1
-        LOGGER.info(f"usePreDictInName: 使用译前字典载入 {count} 条name替换表")
+        if verbose:
+            LOGGER.info(f"usePreDictInName: 使用译前字典载入 {count} 条name替换表")
 
     if useGPTDictInName:
         count = 0
@@ -173,7 +189,8 @@ def load_name_table(
             if gpt_dic.get_dst(name) != "":
                 name_table[name] = gpt_dic.get_dst(name)
                 count += 1
-        LOGGER.info(f"useGPTDictInName: 使用GPT字典载入 {count} 条name替换表")
+        if verbose:
+            LOGGER.info(f"useGPTDictInName: 使用GPT字典载入 {count} 条name替换表")
 
     if usePostDictInName:
         count = 0
@@ -181,9 +198,8 @@ def load_name_table(
             if post_dic.get_dst(name) != "":
                 name_table[name] = post_dic.get_dst(name)
                 count += 1
-        LOGGER.info(f"usePostDictInName: 使用译后字典载入 {count} 条name替换表")
-
-    return name_table
+        if verbose:
+            LOGGER.info(f"usePostDictInName: 使用译后字典载入 {count} 条name替换表")
 
 
 async def dump_name_table_from_chunks(
@@ -208,6 +224,9 @@ async def dump_name_table_from_chunks(
 
     # Ask user for export format
     try:
+        from InquirerPy import inquirer
+        from InquirerPy.base.control import Choice
+
         export_format = await inquirer.select(
             message="请选择导出 name替换表 的格式 (这个替换表可以刷写结果文件中的name字段):",
             choices=[
@@ -225,6 +244,8 @@ async def dump_name_table_from_chunks(
 
     try:
         if export_format == "xlsx":
+            import openpyxl
+
             workbook = openpyxl.Workbook()
             sheet = workbook.active
             sheet.title = "NameTable"
@@ -1,10 +1,197 @@
 """
 分析问题
 """
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from typing import List, Optional, Tuple
+from GalTransl import LOGGER
 from GalTransl.CSentense import CTransList
 from GalTransl.ConfigHelper import CProjectConfig, CProblemType
 from GalTransl.Utils import get_most_common_char, contains_japanese, contains_english,punctuation_zh
 from GalTransl.Dictionary import CGptDict
+from GalTransl.AhoCorasick import CAhoCorasick
+
+# 标点错漏检查的标点与名称
+CHAR_TO_ERROR = {
+    ("（", ")"): "括号",
+    "：": "冒号",
+    "*": "*号",
+    ("『", "「", "“"): "引号",
+}
+# 语言不通检查前去掉的中文标点
+PUNCTUATION_ZH_TABLE = str.maketrans("", "", punctuation_zh)
+# 句子数不少于该值的分块在进程池中找问题
+PROCESS_POOL_MIN_LINES = 5000
+
+# (pre_jp, post_jp, pre_zh, post_zh)
+ProblemRow = Tuple[str, str, str, str]
+
+
+class CProblemAnalyzer:
+    """
+    按项目配置预先编译好的问题分析器，一次遍历完成所有启用的检查。
+    只保存纯数据，可以发送到子进程中使用。
+    """
+
+    def __init__(self, projectConfig: CProjectConfig, gpt_dict: CGptDict = None) -> None:
+        find_type = projectConfig.getProblemAnalyzeConfig("problemList")
+        if not find_type:
+            find_type = projectConfig.getProblemAnalyzeConfig("GPT35")  # 兼容旧版
+        self.gpt_dict = gpt_dict
+        self.lb_symbol = projectConfig.getlbSymbol()
+        self.target_lang = getattr(projectConfig, "target_lang", "")
+
+        self.check_word_freq = CProblemType.词频过高 in find_type
+        self.check_punctuation = CProblemType.标点错漏 in find_type
+        self.check_japanese = CProblemType.残留日文 in find_type
+        self.check_lost_lb = CProblemType.丢失换行 in find_type
+        self.check_extra_lb = CProblemType.多加换行 in find_type
+        self.check_length = (
+            CProblemType.比日文长 in find_type or CProblemType.比日文长严格 in find_type
+        )
+        self.len_beta = 1.0 if CProblemType.比日文长严格 in find_type else 1.3
+        self.check_dic_use = CProblemType.字典使用 in find_type
+        self.check_english = CProblemType.引入英文 in find_type
+        self.check_lang = CProblemType.语言不通 in find_type
+
+        # 有无字典：一次扫描找出原文/译文中出现的键和值，只检查相关的词条
+        self.arinashi_list = list(projectConfig.getProblemAnalyzeArinashiDict().items())
+        self._arinashi_matcher = CAhoCorasick(
+            word for pair in self.arinashi_list for word in pair
+        )
+        word_index = {word: i for i, word in enumerate(self._arinashi_matcher.words)}
+        self._arinashi_positions = [[] for _ in self._arinashi_matcher.words]
+        self._arinashi_always = []
+        for i, (key, value) in enumerate(self.arinashi_list):
+            if key == "" or value == "":
+                self._arinashi_always.append(i)
+                continue
+            self._arinashi_positions[word_index[key]].append(i)
+            self._arinashi_positions[word_index[value]].append(i)
+
+    def _check_arinashi(self, pre_jp: str, post_zh: str, problem_list: list):
+        matcher = self._arinashi_matcher
+        positions = set(self._arinashi_always)
+        for word_id in matcher.find_all(pre_jp) | matcher.find_all(post_zh):
+            positions.update(self._arinashi_positions[word_id])
+        for i in sorted(positions):
+            key, value = self.arinashi_list[i]
+            if key not in pre_jp and value in post_zh:
+                problem_list.append(f"本无 {key} 译有 {value}")
+            if key in pre_jp and value not in post_zh:
+                problem_list.append(f"本有 {key} 译无 {value}")
+
+    def analyze(self, rows: List[ProblemRow]) -> List[str]:
+        """
+        对每一行返回问题描述，没有问题时为空字符串
+        """
+        results = [""] * len(rows)
+        problem_lists = [None] * len(rows)
+        # 语言不通：先收集，最后统一识别 (行号, 插入位置, 文本)
+        lang_requests = []
+
+        for row_index, (pre_jp, post_jp, pre_zh, post_zh) in enumerate(rows):
+            if pre_zh == "":
+                continue
+
+            problem_list = []
+            if self.check_word_freq:
+                most_word, word_count = get_most_common_char(post_zh)
+                if word_count > 20 and most_word != ".":
+                    problem_list.append(f"词频过高-'{most_word}'{str(word_count)}次")
+            if self.check_punctuation:
+                for chars, error in CHAR_TO_ERROR.items():
+                    if isinstance(chars, tuple):
+                        if not any(char in pre_jp for char in chars):
+                            if any(char in post_zh for char in chars):
+                                problem_list.append(f"本无{error}")
+                        elif not any(char in post_zh for char in chars):
+                            problem_list.append(f"本有{error}")
+                    else:
+                        if chars not in pre_jp:
+                            if chars in post_zh:
+                                problem_list.append(f"本无{error}")
+                        elif chars not in post_zh:
+                            problem_list.append(f"本有{error}")
+            if self.check_japanese:
+                if contains_japanese(pre_zh):
+                    problem_list.append("残留日文")
+            if self.check_lost_lb:
+                if pre_jp.count(self.lb_symbol) > post_zh.count(self.lb_symbol):
+                    problem_list.append("丢失换行")
+            if self.check_extra_lb:
+                if pre_jp.count(self.lb_symbol) < post_zh.count(self.lb_symbol):
+                    problem_list.append("多加换行")
+            if self.check_length:
+                if len(post_zh) > len(pre_jp) * self.len_beta:
+                    problem_list.append(
+                        f"比日文长{round(len(post_zh)/max(len(pre_jp),0.1),1)}倍"
+                    )
+            if self.check_dic_use:
+                if val := self.gpt_dict.check_dic_use_text(pre_zh, post_jp):
+                    problem_list.append(val)
+            if self.check_english:
+                if not contains_english(post_jp) and contains_english(pre_zh):
+                    if contains_english(post_zh): # 修了的不显示
+                        problem_list.append("引入英文")
+            if self.check_lang:
+                tmp_text = pre_zh.translate(PUNCTUATION_ZH_TABLE)
+                if len(tmp_text) > 3:
+                    lang_requests.append((row_index, len(problem_list), tmp_text))
+
+            if self.arinashi_list:
+                self._check_arinashi(pre_jp, post_zh, problem_list)
+
+            problem_lists[row_index] = problem_list
+
+        if lang_requests:
+            lang_ids = self._classify_langs([text for _, _, text in lang_requests])
+            # 倒序插入，保证同一行内前面的插入位置不受影响
+            for row_index, insert_pos, text in reversed(lang_requests):
+                lang_id = lang_ids[text]
+                if lang_id == "zh":
+                    lang_id = "zh-cn"
+                if lang_id != self.target_lang and lang_id != "ja":
+                    problem_lists[row_index].insert(insert_pos, "语言不通")
+
+        for row_index, problem_list in enumerate(problem_lists):
+            if problem_list:
+                results[row_index] = ", ".join(problem_list)
+        return results
+
+    @staticmethod
+    def _classify_langs(texts: List[str]) -> dict:
+        """
+        批量识别语言，相同文本只识别一次
+        """
+        import langid
+
+        return {text: langid.classify(text)[0] for text in set(texts)}
+
+
+def get_problem_analyzer(
+    projectConfig: CProjectConfig, gpt_dict: CGptDict = None
+) -> CProblemAnalyzer:
+    """
+    获取项目的问题分析器，每个项目只编译一次
+    """
+    analyzer = projectConfig.problemAnalyzer
+    if analyzer is None or analyzer.gpt_dict is not gpt_dict:
+        analyzer = CProblemAnalyzer(projectConfig, gpt_dict)
+        projectConfig.problemAnalyzer = analyzer
+    return analyzer
+
+
+def _apply_problems(trans_list: CTransList, problems: List[str]) -> None:
+    for tran, problem in zip(trans_list, problems):
+        if problem:
+            tran.problem += problem
+
+
+def _to_rows(trans_list: CTransList) -> List[ProblemRow]:
+    return [(tran.pre_jp, tran.post_jp, tran.pre_zh, tran.post_zh) for tran in trans_list]
+
 
 def find_problems(
     trans_list: CTransList,
@@ -16,98 +203,75 @@ def find_problems(
 
     参数:
     - trans_list: 翻译对象列表。
-    - find_type: 要查找的问题类型列表。
-    - arinashi_dict: 一个自定义字典，其中的键值对将会被用于查找问题。
+    - projectConfig: 项目配置，要查找的问题类型和有无字典从中读取。
+    - gpt_dict: 检查字典使用时用到的GPT字典。
 
     返回值:
     - 无返回值，但会修改每个翻译对象的 `problem` 属性。
     """
-    arinashi_dict = projectConfig.getProblemAnalyzeArinashiDict()
-    find_type = projectConfig.getProblemAnalyzeConfig("problemList")
-    if not find_type:
-        find_type = projectConfig.getProblemAnalyzeConfig("GPT35")  # 兼容旧版
-    lb_symbol = projectConfig.getlbSymbol()
-
-    for tran in trans_list:
-        pre_jp = tran.pre_jp
-        post_jp = tran.post_jp
-        pre_zh = tran.pre_zh
-        post_zh = tran.post_zh
-        if pre_zh == "":
-            continue
-
-        problem_list = []
-        if CProblemType.词频过高 in find_type:
-            most_word, word_count = get_most_common_char(post_zh)
-            if word_count > 20 and most_word != ".":
-                problem_list.append(f"词频过高-'{most_word}'{str(word_count)}次")
-        if CProblemType.标点错漏 in find_type:
-            char_to_error = {
-                ("（", ")"): "括号",
-                "：": "冒号",
-                "*": "*号",
-                ("『", "「", "“"): "引号",
-            }
-
-            for chars, error in char_to_error.items():
-                if isinstance(chars, tuple):
-                    if not any(char in pre_jp for char in chars):
-                        if any(char in post_zh for char in chars):
-                            problem_list.append(f"本无{error}")
-                    elif any(char in pre_jp for char in chars):
-                        if not any(char in post_zh for char in chars):
-                            problem_list.append(f"本有{error}")
-                else:
-                    if chars not in pre_jp:
-                        if chars in post_zh:
-                            problem_list.append(f"本无{error}")
-                    elif chars in pre_jp:
-                        if chars not in post_zh:
-                            problem_list.append(f"本有{error}")
-        if CProblemType.残留日文 in find_type:
-            if contains_japanese(pre_zh):
-                problem_list.append("残留日文")
-        if CProblemType.丢失换行 in find_type:
-            if pre_jp.count(lb_symbol) > post_zh.count(lb_symbol):
-                problem_list.append("丢失换行")
-        if CProblemType.多加换行 in find_type:
-            if pre_jp.count(lb_symbol) < post_zh.count(lb_symbol):
-                problem_list.append("多加换行")
-        if CProblemType.比日文长 in find_type or CProblemType.比日文长严格 in find_type:
-            len_beta=1.3
-            if CProblemType.比日文长严格 in find_type:
-                len_beta=1.0
-            if len(post_zh) > len(pre_jp) * len_beta:
-                problem_list.append(
-                    f"比日文长{round(len(post_zh)/max(len(pre_jp),0.1),1)}倍"
-                )
-        if CProblemType.字典使用 in find_type:
-            if val := gpt_dict.check_dic_use(pre_zh, tran):
-                problem_list.append(val)
-        if CProblemType.引入英文 in find_type:
-            if not contains_english(post_jp) and contains_english(pre_zh):
-                if contains_english(post_zh): # 修了的不显示
-                    problem_list.append("引入英文")
-        if CProblemType.语言不通 in find_type:
-            tmp_text=pre_zh
-            for chr in punctuation_zh:
-                tmp_text=tmp_text.replace(chr,"")
-            if len(tmp_text)>3:
-                import langid
-                result=langid.classify(tmp_text)
-                lang_id=result[0]   
-                if lang_id=="zh":
-                    lang_id="zh-cn"
-                if lang_id!=projectConfig.target_lang:
-                    if lang_id!="ja":
-                        problem_list.append(f"语言不通")
-
-        if arinashi_dict != {}:
-            for key, value in arinashi_dict.items():
-                if key not in pre_jp and value in post_zh:
-                    problem_list.append(f"本无 {key} 译有 {value}")
-                if key in pre_jp and value not in post_zh:
-                    problem_list.append(f"本有 {key} 译无 {value}")
-
-        if problem_list:
-            tran.problem += ", ".join(problem_list)
+    analyzer = get_problem_analyzer(projectConfig, gpt_dict)
+    _apply_problems(trans_list, analyzer.analyze(_to_rows(trans_list)))
+
+
+# 子进程中的问题分析器，由进程池的 initializer 设置
+_worker_analyzer: Optional[CProblemAnalyzer] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+# 创建进程池时使用的分析器，分析器重建后进程池也要重建
+_pool_analyzer: Optional[CProblemAnalyzer] = None
+
+
+def _init_worker(analyzer: CProblemAnalyzer) -> None:
+    global _worker_analyzer
+    _worker_analyzer = analyzer
+
+
+def _analyze_in_worker(rows: List[ProblemRow]) -> List[str]:
+    return _worker_analyzer.analyze(rows)
+
+
+async def find_problems_async(
+    trans_list: CTransList,
+    projectConfig: CProjectConfig,
+    gpt_dict: CGptDict = None,
+) -> None:
+    """
+    find_problems 的异步版本。大分块放到进程池中分析，不阻塞事件循环；
+    进程池不可用时退回当前进程。
+    """
+    global _process_pool, _pool_analyzer
+    analyzer = get_problem_analyzer(projectConfig, gpt_dict)
+    if len(trans_list) < PROCESS_POOL_MIN_LINES:
+        _apply_problems(trans_list, analyzer.analyze(_to_rows(trans_list)))
+        return
+
+    rows = _to_rows(trans_list)
+    try:
+        if _process_pool is not None and _pool_analyzer is not analyzer:
+            # 字典或项目变化后分析器已重建，已提交的任务仍用旧分析器执行完
+            _process_pool.shutdown(wait=False)
+            _process_pool = None
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=min(4, cpu_count() or 1),
+                initializer=_init_worker,
+                initargs=(analyzer,),
+            )
+            _pool_analyzer = analyzer
+        loop = asyncio.get_running_loop()
+        problems = await loop.run_in_executor(_process_pool, _analyze_in_worker, rows)
+    except Exception as e:
+        LOGGER.debug(f"进程池找问题失败，改为在当前进程中执行: {e}")
+        shutdown_problem_pool()
+        problems = analyzer.analyze(rows)
+    _apply_problems(trans_list, problems)
+
+
+def shutdown_problem_pool() -> None:
+    """
+    关闭找问题用的进程池，在一次翻译任务结束时调用
+    """
+    global _process_pool, _pool_analyzer
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    _pool_analyzer = None
@@ -4,10 +4,9 @@ from os import makedirs as mkdir
 import logging, colorlog
 from GalTransl import LOGGER, TRANSLATOR_SUPPORTED, new_version, GALTRANSL_VERSION,NEED_OpenAITokenPool
 from GalTransl.GTPlugin import GTextPlugin, GFilePlugin
-from GalTransl.COpenAI import COpenAITokenPool, init_sakura_endpoint_queue
 from GalTransl.yapsy.PluginManager import PluginManager
 from GalTransl.ConfigHelper import CProjectConfig, CProxyPool
-from GalTransl.Frontend.LLMTranslate import doLLMTranslate
+from GalTransl.ClientPool import HTTP_CLIENT_POOL
 from GalTransl.i18n import get_text,GT_LANG
 from GalTransl.CSplitter import (
     DictionaryCountSplitter,
@@ -172,8 +171,13 @@ async def run_galtransl(cfg: CProjectConfig, translator: str):
     if not proxyPool:
         LOGGER.warning("不使用代理")
 
+    # 所有后端共享的HTTP连接池
+    HTTP_CLIENT_POOL.configure(cfg.getKey("workersPerProject") or 1)
+
     # OpenAITokenPool初始化
     if any(x in translator for x in NEED_OpenAITokenPool):
+        from GalTransl.COpenAI import COpenAITokenPool
+
         OpenAITokenPool = COpenAITokenPool(cfg, translator)
         checkAvailable=cfg.getBackendConfigSection("OpenAI-Compatible").get("checkAvailable",True)
         if checkAvailable:
@@ -186,8 +190,9 @@ async def run_galtransl(cfg: CProjectConfig, translator: str):
 
     # 初始化sakura端点队列
     if "sakura" in translator or "galtransl" in translator:
-        sakura_endpoint_queue = await init_sakura_endpoint_queue(cfg)
-        cfg.endpointQueue = sakura_endpoint_queue
+        from GalTransl.COpenAI import init_sakura_endpoint_pool
+
+        cfg.endpointPool = await init_sakura_endpoint_pool(cfg)
 
     # 检查更新
     if new_version and new_version[0] != GALTRANSL_VERSION:
@@ -226,7 +231,13 @@ async def run_galtransl(cfg: CProjectConfig, translator: str):
     cfg.proxyPool = proxyPool
     cfg.input_splitter = input_splitter
 
-    await doLLMTranslate(cfg)
+    # 翻译前端及其依赖按需导入，show-plugs 等不翻译的命令启动更快
+    from GalTransl.Frontend.LLMTranslate import doLLMTranslate
+
+    try:
+        await doLLMTranslate(cfg)
+    finally:
+        await HTTP_CLIENT_POOL.aclose()
 
     for plugin in file_plugins + text_plugins:
         plugin.plugin_object.gtp_final()
@@ -0,0 +1,174 @@
+"""
+跨项目、跨文件的全局翻译记忆库
+"""
+
+import sqlite3
+import threading
+from hashlib import sha1
+from os import makedirs
+from os.path import dirname, abspath, isabs, join
+from time import time
+from typing import Optional, Tuple
+from GalTransl import LOGGER
+from GalTransl.CSentense import CSentense, CTransList
+from GalTransl.Cache import check_retran_key
+
+_KEY_SEP = "\x1f"
+
+
+class CTranslMemory:
+    """
+    以 (原文, 说话人, 上下文, 引擎, 提示词版本) 的哈希为键的 SQLite 翻译记忆库。
+    在发起请求前查询，相同句子在其他文件或其他项目中翻译过时直接复用。
+    """
+
+    def __init__(self, db_path: str, context_num: int = 1) -> None:
+        """
+        Args:
+            db_path (str): 记忆库文件路径。
+            context_num (int, optional): 键中包含的前后非空句数量，0 表示只看本句。默认为 1。
+        """
+        self.db_path = abspath(db_path)
+        self.context_num = max(0, context_num)
+        self.engine_key = ""
+        if dirname(self.db_path):
+            makedirs(dirname(self.db_path), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # update 在保存结果的线程中执行，与事件循环中的 fill 共用连接
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS transl_memory (
+                key TEXT PRIMARY KEY,
+                src TEXT,
+                pre_zh TEXT,
+                trans_by TEXT,
+                problem TEXT,
+                engine TEXT,
+                updated REAL
+            )"""
+        )
+        self._conn.commit()
+        LOGGER.info(f"已载入翻译记忆库: {self.db_path}")
+
+    def set_engine(self, eng_type: str, model_name: str, prompt_version: str) -> None:
+        """
+        设置当前使用的引擎与提示词版本，不同引擎/提示词的译文互不复用
+        """
+        self.engine_key = f"{eng_type}|{model_name}|{prompt_version}"
+
+    def _context(self, tran: CSentense, forward: bool) -> str:
+        result = []
+        current = tran
+        while len(result) < self.context_num:
+            current = current.next_tran if forward else current.prev_tran
+            while current and current.post_jp == "":
+                current = current.next_tran if forward else current.prev_tran
+            if current is None:
+                break
+            result.append(f"{current.speaker}{current.post_jp}")
+        return _KEY_SEP.join(result)
+
+    def make_key(self, tran: CSentense) -> str:
+        speaker = tran.speaker if isinstance(tran.speaker, str) else "/".join(tran.speaker)
+        raw = _KEY_SEP.join(
+            [
+                tran.post_jp,
+                speaker,
+                self._context(tran, forward=False),
+                self._context(tran, forward=True),
+                self.engine_key,
+            ]
+        )
+        return sha1(raw.encode("utf-8")).hexdigest()
+
+    def fill(
+        self, translist_unhit: CTransList, retran_key=""
+    ) -> Tuple[CTransList, CTransList]:
+        """
+        用记忆库填充未命中缓存的句子。
+
+        Args:
+            translist_unhit (CTransList): 未命中缓存的句子。
+            retran_key (str or list, optional): 重译关键字，原文或问题中包含时不复用。
+
+        Returns:
+            Tuple[CTransList, CTransList]: 记忆库命中的句子和仍需翻译的句子。
+        """
+        translist_hit, translist_rest = [], []
+        cur = self._conn.cursor()
+        for tran in translist_unhit:
+            if tran.post_jp == "":
+                translist_rest.append(tran)
+                continue
+            with self._lock:
+                row = cur.execute(
+                    "SELECT pre_zh, trans_by, problem FROM transl_memory WHERE key=?",
+                    (self.make_key(tran),),
+                ).fetchone()
+            if row is None:
+                translist_rest.append(tran)
+                continue
+            pre_zh, trans_by, problem = row
+            if retran_key and (
+                check_retran_key(retran_key, tran.pre_jp)
+                or check_retran_key(retran_key, problem)
+            ):
+                translist_rest.append(tran)
+                continue
+            tran.pre_zh = pre_zh
+            tran.post_zh = pre_zh
+            tran.trans_by = trans_by
+            translist_hit.append(tran)
+        if translist_hit:
+            LOGGER.debug(f"[translMemory]命中{len(translist_hit)}句")
+        return translist_hit, translist_rest
+
+    def update(self, trans_list: CTransList) -> None:
+        """
+        把已翻译的句子写入记忆库，失败的翻译不写入
+        """
+        now = time()
+        rows = []
+        for tran in trans_list:
+            if tran.post_jp == "" or tran.pre_zh == "":
+                continue
+            if "Failed" in tran.trans_by:
+                continue
+            rows.append(
+                (
+                    self.make_key(tran),
+                    tran.post_jp,
+                    tran.pre_zh,
+                    tran.trans_by,
+                    tran.problem,
+                    self.engine_key,
+                    now,
+                )
+            )
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO transl_memory VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def init_transl_memory(projectConfig) -> Optional[CTranslMemory]:
+    """
+    根据配置初始化翻译记忆库，未配置 translationMemory 时返回 None
+    """
+    db_path = projectConfig.getKey("translationMemory", "")
+    if not db_path:
+        return None
+    if not isabs(db_path):
+        # 相对路径以项目目录为基准，多个项目可指向同一个记忆库文件
+        db_path = join(projectConfig.getProjectDir(), db_path)
+    context_num = projectConfig.getKey("translationMemoryContext", 1)
+    return CTranslMemory(db_path, int(context_num))
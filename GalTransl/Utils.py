@@ -6,7 +6,6 @@ import codecs
 from typing import Tuple, List
 from collections import Counter
 from re import compile
-import requests
 
 PATTERN_CODE_BLOCK = compile(r"```([\w]*)\n([\s\S]*?)\n```")
 whitespace = ' \t\n\r\v\f'
@@ -221,6 +220,8 @@ def fix_quotes2(text):
 
 def check_for_tool_updates(new_version):
     try:
+        import requests
+
         release_api = 'https://api.github.com/repos/xd2333/GalTransl/releases/latest'
         response = requests.get(
             release_api, timeout=5).json()
@@ -229,25 +230,69 @@ def check_for_tool_updates(new_version):
     except Exception:
         pass
 
-def find_most_repeated_substring(text):
-    max_count = 0
-    max_substring = ""
+def _common_extension(text: str, i: int, j: int, backward: bool = False) -> int:
+    """
+    从 i、j 两处开始（backward 时为 i、j 之前）向同一方向比较，返回相同部分的长度。
+    先倍增再折半比较切片，比较次数为对数级。
+    """
+    limit = i if backward else len(text) - j
+    length, step = 0, 1
+    while length < limit:
+        step = min(step, limit - length)
+        if backward:
+            same = text[i - length - step : i - length] == text[j - length - step : j - length]
+        else:
+            same = text[i + length : i + length + step] == text[j + length : j + length + step]
+        if same:
+            length += step
+            step *= 2
+        elif step == 1:
+            break
+        else:
+            step //= 2
+    return length
+
+
+def find_most_repeated_substring(text: str) -> Tuple[str, int]:
+    """
+    找出文本中连续重复次数最多的子串。
+
+    对每个周期 p 只在 0, p, 2p... 处检查 text[a] == text[a+p]，再向两侧扩展得到整段重复，
+    检查位置总数为 O(n log n)。次数相同时取更长的子串，再相同取最靠前的。
+
+    返回值:
+    - (子串, 连续出现次数)，没有重复时返回 (text, 1)，空字符串返回 ("", 0)。
+    """
     n = len(text)
+    if n == 0:
+        return "", 0
+    best_count, best_len, best_start = 1, n, 0
+    for p in range(1, n // 2 + 1):
+        a = 0
+        while a + p < n:
+            if text[a] != text[a + p]:
+                a += p
+                continue
+            back = _common_extension(text, a, a + p, backward=True)
+            fwd = _common_extension(text, a, a + p)
+            start = a - back
+            count = (back + fwd) // p + 1
+            if count > best_count or (
+                count == best_count
+                and (p > best_len or (p == best_len and start < best_start))
+            ):
+                best_count, best_len, best_start = count, p, start
+            # 跳过同一段重复内的其余检查位置
+            a += (fwd // p + 1) * p
+    return text[best_start : best_start + best_len], best_count
+
+
+def is_repetition_loop(text: str, threshold: int) -> bool:
+    """
+    检查文本是否陷入重复输出（同一子串连续出现超过 threshold 次）
+    """
+    return find_most_repeated_substring(text)[1] > threshold
 
-    for i in range(n):
-        for j in range(i + 1, n + 1):
-            substring = text[i:j]
-            count = 1
-            start = j
-            while start + len(substring) <= n and text[start:start + len(substring)] == substring:
-                count += 1
-                start += len(substring)
-            
-            if count > max_count or (count == max_count and len(substring) > len(max_substring)):
-                max_count = count
-                max_substring = substring
-
-    return max_substring, max_count
 
 def decompress_file_lzma(input_filepath, output_filepath=None):
     """
@@ -2,6 +2,7 @@ import os
 import logging
 from time import localtime
 import threading
+import multiprocessing
 from GalTransl.Utils import check_for_tool_updates
 
 LOGGER = logging.getLogger(__name__)
@@ -141,7 +142,19 @@ DEBUG_LEVEL = {
 }
 
 new_version = []
-update_thread = threading.Thread(target=check_for_tool_updates, args=(new_version,))
-update_thread.start()
+# 设置环境变量 GALTRANSL_NO_UPDATE_CHECK=1 可跳过启动时的版本检查（离线、脚本批量调用等）
+# 进程池的子进程会重新导入 GalTransl，只在主进程中检查。
+# spawn 的子进程在反序列化 initializer 时就会导入，此时 parent_process() 还是 None，但进程名已设置
+update_thread = None
+if (
+    os.environ.get("GALTRANSL_NO_UPDATE_CHECK", "") in ("", "0")
+    and multiprocessing.parent_process() is None
+    and multiprocessing.current_process().name == "MainProcess"
+):
+    # 守护线程：无网络时不会让程序在退出前等待请求超时
+    update_thread = threading.Thread(
+        target=check_for_tool_updates, args=(new_version,), daemon=True
+    )
+    update_thread.start()
 
 transl_counter = {"tran_count": 0, "error_count": 0}
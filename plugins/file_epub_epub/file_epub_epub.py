@@ -16,6 +16,9 @@ except ImportError:
     LOGGER.warning("缺少依赖包beautifulsoup4, 请更新依赖")
 
 class FilePlugin(GFilePlugin):
+    # load_file/save_file 不修改实例状态，可以在进程池中并行读写
+    process_safe = True
+
     def gtp_init(self, plugin_conf: dict, project_conf: dict):
         """
         This method is called when the plugin is loaded. 在插件加载时被调用。
@@ -5,6 +5,9 @@ import re
 
 
 class file_plugin(GFilePlugin):
+    # load_file/save_file 不修改实例状态，可以在进程池中并行读写
+    process_safe = True
+
     def gtp_init(self, plugin_conf: dict, project_conf: dict):
         """
         This method is called when the plugin is loaded. 在插件加载时被调用。
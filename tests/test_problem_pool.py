@@ -0,0 +1,42 @@
+import asyncio
+from types import SimpleNamespace
+
+import GalTransl.Problem as Problem
+
+
+class FakeAnalyzer:
+    def __init__(self, tag: str) -> None:
+        self.tag = tag
+
+    def analyze(self, rows):
+        return [self.tag] * len(rows)
+
+
+def make_trans_list(lines: int):
+    return [
+        SimpleNamespace(pre_jp="あ", post_jp="あ", pre_zh="啊", post_zh="啊", problem="")
+        for _ in range(lines)
+    ]
+
+
+def test_pool_follows_rebuilt_analyzer(monkeypatch):
+    analyzers = [FakeAnalyzer("旧"), FakeAnalyzer("新")]
+    monkeypatch.setattr(Problem, "PROCESS_POOL_MIN_LINES", 1)
+    monkeypatch.setattr(
+        Problem, "get_problem_analyzer", lambda projectConfig, gpt_dict=None: analyzers[0]
+    )
+
+    async def main():
+        first, second = make_trans_list(3), make_trans_list(3)
+        await Problem.find_problems_async(first, None)
+        # 字典变化后 get_problem_analyzer 返回新的分析器
+        analyzers.pop(0)
+        await Problem.find_problems_async(second, None)
+        return first, second
+
+    try:
+        first, second = asyncio.run(main())
+    finally:
+        Problem.shutdown_problem_pool()
+    assert [tran.problem for tran in first] == ["旧"] * 3
+    assert [tran.problem for tran in second] == ["新"] * 3
@@ -0,0 +1,170 @@
+import asyncio
+from types import SimpleNamespace
+
+import GalTransl.Frontend.LLMTranslate as LLMTranslate
+from GalTransl.Frontend.LLMTranslate import (
+    CBackendPool,
+    CTailSplitter,
+    doLLMTranslSingleChunk,
+)
+
+NUM_PER_REQUEST = 5
+
+
+class FakeBackend:
+    split_tail = None
+
+    def __init__(self, started: set) -> None:
+        self.last_file_name = ""
+        self.retry_count = 0
+        self.started = started
+
+    async def batch_translate(self, *args, translist_unhit=None, **kwargs):
+        # 记录已开始翻译的分块（拆出的子任务是新的列表）
+        self.started.add(id(translist_unhit))
+        i = 0
+        while i < len(translist_unhit):
+            batch = translist_unhit[i : i + NUM_PER_REQUEST]
+            if self.split_tail:
+                self.split_tail(translist_unhit, i + len(batch))
+            await asyncio.sleep(0.001)
+            i += len(batch)
+
+    def clean_up(self) -> None:
+        pass
+
+
+class FakeConfig:
+    gpt_dic = None
+    select_translator = "gpt4"
+
+    def getKey(self, key, default=None):
+        return {
+            "gpt.numPerRequestTranslate": NUM_PER_REQUEST,
+            "workStealing": True,
+        }.get(key, default)
+
+    def getInputPath(self):
+        return "gt_input"
+
+    def getCachePath(self):
+        return "transl_cache"
+
+
+def make_chunk(index: int, lines: int):
+    return SimpleNamespace(
+        file_path=f"gt_input/{index}.json",
+        chunk_index=0,
+        total_chunks=1,
+        start_index=0,
+        end_index=lines,
+        chunk_non_cross_size=lines,
+        chunk_size=lines,
+        cross_num=0,
+        trans_list=[],
+    )
+
+
+def run_chunks(monkeypatch, num_chunks: int, num_backends: int, lines: int = 100):
+    """
+    用 num_backends 个后端翻译 num_chunks 个分块，返回每次拆分时还没开始翻译的分块数
+    """
+    unhit_lists = [list(range(lines)) for _ in range(num_chunks)]
+    chunk_ids = {id(unhit) for unhit in unhit_lists}
+    started = set()
+    splits = []
+    split_call = CTailSplitter.__call__
+
+    def record_split(self, translist_unhit, cut):
+        before = len(translist_unhit)
+        queued = len(chunk_ids - started)
+        split_call(self, translist_unhit, cut)
+        if len(translist_unhit) < before:
+            splits.append(queued)
+
+    async def fake_init_gptapi(projectConfig):
+        return FakeBackend(started)
+
+    async def fake_finish_chunk(split_chunk, projectConfig):
+        pass
+
+    monkeypatch.setattr(CTailSplitter, "__call__", record_split)
+    monkeypatch.setattr(LLMTranslate, "init_gptapi", fake_init_gptapi)
+    monkeypatch.setattr(LLMTranslate, "finish_chunk", fake_finish_chunk)
+
+    async def main():
+        config = FakeConfig()
+        pool = CBackendPool()
+        await pool.init(config, num_backends)
+        pool.add_pending(num_chunks)
+        await asyncio.gather(
+            *[
+                doLLMTranslSingleChunk(
+                    split_chunk=make_chunk(i, lines),
+                    projectConfig=config,
+                    gptapi_pool=pool,
+                    prepared=([], unhit_lists[i]),
+                )
+                for i in range(num_chunks)
+            ]
+        )
+
+    asyncio.run(main())
+    return splits
+
+
+def test_no_stealing_while_chunks_are_queued(monkeypatch):
+    splits = run_chunks(monkeypatch, num_chunks=8, num_backends=4)
+    assert all(queued == 0 for queued in splits)
+
+
+def test_stealing_when_backends_are_idle(monkeypatch):
+    splits = run_chunks(monkeypatch, num_chunks=1, num_backends=4)
+    assert splits
+
+
+def test_context_lines_not_counted():
+    from GalTransl.Backend.BaseTranslate import BaseTranslate
+
+    lines = [object() for _ in range(5)]
+    backend = SimpleNamespace(context_lines=frozenset(id(tran) for tran in lines[:2]))
+    num, kept = BaseTranslate.exclude_context_lines(backend, 5, lines)
+    assert num == 3
+    assert kept == lines[2:]
+
+
+def test_chunks_admitted_before_prepare(monkeypatch):
+    active = {"now": 0, "max": 0}
+
+    def fake_prepare_chunk(split_chunk, projectConfig):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        return [], list(range(20))
+
+    async def fake_init_gptapi(projectConfig):
+        return FakeBackend(set())
+
+    async def fake_finish_chunk(split_chunk, projectConfig):
+        active["now"] -= 1
+
+    monkeypatch.setattr(LLMTranslate, "prepare_chunk", fake_prepare_chunk)
+    monkeypatch.setattr(LLMTranslate, "init_gptapi", fake_init_gptapi)
+    monkeypatch.setattr(LLMTranslate, "finish_chunk", fake_finish_chunk)
+
+    async def main():
+        config = FakeConfig()
+        pool = CBackendPool()
+        await pool.init(config, 2)
+        pool.add_pending(8)
+        await asyncio.gather(
+            *[
+                doLLMTranslSingleChunk(
+                    split_chunk=make_chunk(i, 20), projectConfig=config, gptapi_pool=pool
+                )
+                for i in range(8)
+            ]
+        )
+
+    asyncio.run(main())
+    # 同时准备(查缓存、打印)的分块不超过后端实例数
+    assert active["max"] <= 2
@@ -0,0 +1,118 @@
+"""
+GalTransl 启动耗时基准：用 python -X importtime 在子进程中多次导入各入口模块，
+输出导入总耗时的中位数和最慢的模块，并检查不该在启动时加载的重型依赖。
+
+用法（在仓库根目录执行）:
+    python useful_tools/GalTransl_StartupBench/startup_bench.py
+    python useful_tools/GalTransl_StartupBench/startup_bench.py -n 10 --top 15
+    python useful_tools/GalTransl_StartupBench/startup_bench.py --max-ms 600
+    python useful_tools/GalTransl_StartupBench/startup_bench.py -m GalTransl.Backend.SakuraTranslate
+
+超过 --max-ms 或加载了禁止的依赖时退出码为 1，可以在 CI 中使用。
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from statistics import median
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# 入口模块 -> 导入该模块时不应加载的依赖
+DEFAULT_TARGETS: Dict[str, List[str]] = {
+    # 所有命令都会导入，show-plugs 只需要这些
+    "GalTransl.Runner": ["openai", "openpyxl", "InquirerPy", "tiktoken", "requests"],
+    # dump-name、rebuildr、rebuilda 的翻译前端
+    "GalTransl.Frontend.LLMTranslate": ["openai", "openpyxl", "InquirerPy", "tiktoken", "requests"],
+    "GalTransl.Backend.RebuildTranslate": ["openai", "tiktoken", "requests"],
+    # 需要请求接口的翻译模板，作为参照
+    "GalTransl.Backend.GPT4Translate": ["openpyxl", "InquirerPy", "tiktoken", "requests"],
+    "GalTransl.Backend.SakuraTranslate": ["openpyxl", "InquirerPy", "tiktoken", "requests"],
+}
+
+# import time: self [us] | cumulative | imported package
+IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(-?\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run_importtime(module: str) -> Tuple[float, List[Tuple[int, str]], List[str]]:
+    """
+    在新的解释器中导入 module，返回 (总耗时ms, [(累计耗时us, 模块名)], 已加载的模块名)
+    """
+    env = dict(os.environ)
+    env["GALTRANSL_NO_UPDATE_CHECK"] = "1"  # 不发起网络请求，结果才可比较
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    code = f"import sys, {module}; print('\\n'.join(sys.modules))"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+
+    total_us = 0
+    records = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match[2]), len(match[3]), match[4]
+        records.append((cumulative, name))
+        # 缩进为 1 的是顶层导入，累计耗时之和即导入总耗时
+        if indent == 1:
+            total_us += cumulative
+    return total_us / 1000, records, proc.stdout.split()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="GalTransl 启动耗时基准")
+    parser.add_argument(
+        "-m", "--module", action="append", help="要测试的入口模块，可重复，默认测试所有内置入口"
+    )
+    parser.add_argument("-n", "--runs", type=int, default=5, help="每个模块重复次数，默认 5")
+    parser.add_argument("--top", type=int, default=10, help="列出累计耗时最多的模块数，默认 10")
+    parser.add_argument(
+        "--max-ms", type=float, default=0, help="导入总耗时中位数的上限(ms)，0 表示不检查"
+    )
+    args = parser.parse_args()
+
+    targets = (
+        {module: DEFAULT_TARGETS.get(module, []) for module in args.module}
+        if args.module
+        else DEFAULT_TARGETS
+    )
+    failed = False
+    for module, forbidden in targets.items():
+        totals = []
+        slowest: Dict[str, int] = {}
+        loaded: List[str] = []
+        for _ in range(max(1, args.runs)):
+            total_ms, records, loaded = run_importtime(module)
+            totals.append(total_ms)
+            for cumulative, name in records:
+                slowest[name] = max(slowest.get(name, 0), cumulative)
+        total = median(totals)
+        print(f"== {module}: {total:.1f} ms (中位数, 最快 {min(totals):.1f} ms, {len(totals)} 次)")
+        for name, cumulative in sorted(slowest.items(), key=lambda item: -item[1])[
+            : args.top
+        ]:
+            print(f"   {cumulative / 1000:8.1f} ms  {name}")
+
+        loaded_roots = {name.split(".")[0] for name in loaded}
+        if bad := [name for name in forbidden if name in loaded_roots]:
+            print(f"   !! 启动时加载了应按需导入的依赖: {', '.join(bad)}")
+            failed = True
+        if args.max_ms and total > args.max_ms:
+            print(f"   !! 超过上限 {args.max_ms:.0f} ms")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())